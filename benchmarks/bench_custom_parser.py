@@ -0,0 +1,99 @@
+# --- bench_custom_parser.py ---
+# 对比旧的“整体 json.loads + 递归拼接列表”兜底解析器与新的预筛选流式扫描器。
+# 用法（在仓库根目录）：python -m benchmarks.bench_custom_parser [--iterations 50]
+
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("SECURE_1PSID", "benchmark")
+os.environ.setdefault("SECURE_1PSIDTS", "benchmark")
+
+from src.custom_parser import iter_generated_image_urls  # noqa: E402
+from src.response_parser import ParsedResponse  # noqa: E402
+from benchmarks.synthetic import build_response  # noqa: E402
+
+SCENARIOS = {
+    "1 candidate, 4 images": dict(generated_images=4, tail_frames=4),
+    "8 candidates x 16 images, 32KB text": dict(text_size=32000, candidates=8, generated_images=16, tail_frames=16),
+    "8 candidates x 16 images, 24 frame lines *": dict(text_size=8000, candidates=8, generated_images=16,
+                                                     tail_frames=4, tail_lines=24),
+}
+
+
+def legacy_find_urls(raw_text: str) -> list[str]:
+    """改造前 find_generated_images_from_raw_text 的扫描逻辑（不构造 GeneratedImage）。"""
+    urls = []
+    keyword = ")]}'"
+    start_index = raw_text.find(keyword)
+    if start_index == -1: return []
+    json_blob = raw_text[start_index:]
+    clean_text = json_blob[4:].strip() if json_blob.startswith(keyword) else json_blob
+    data = json.loads(clean_text)
+    for item in data:
+        if isinstance(item, list) and len(item) > 2 and isinstance(item[2], str):
+            if "https://lh3.googleusercontent.com/gg/" in item[2]:
+                urls.extend(_legacy_recursive_find_urls(json.loads(item[2])))
+    unique_urls = []
+    seen_urls = set()
+    for url in urls:
+        if url not in seen_urls:
+            unique_urls.append(url)
+            seen_urls.add(url)
+    return unique_urls
+
+
+def _legacy_recursive_find_urls(data) -> list[str]:
+    urls = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            urls.extend(_legacy_recursive_find_urls(value))
+    elif isinstance(data, list):
+        for item in data:
+            urls.extend(_legacy_recursive_find_urls(item))
+    elif isinstance(data, str) and data.startswith("https://lh3.googleusercontent.com/gg/"):
+        urls.append(data)
+    return urls
+
+
+def single_frame_line(raw_text: str) -> str:
+    """旧解析器只能处理前缀后紧跟单个 JSON 值的响应，这里去掉长度行并只保留第一帧行供其对照。"""
+    return ")]}'\n" + raw_text.split("\n")[2]
+
+
+def cpu_time_per_call(func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy custom image parser with the prefiltering scanner.")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<44} {'size':>9} {'legacy':>11} {'scan':>11} {'reuse':>11}")
+    for name, params in SCENARIOS.items():
+        raw_text = build_response(**params)
+        legacy_text = single_frame_line(raw_text)
+        assert legacy_find_urls(legacy_text) == list(iter_generated_image_urls(raw_text))
+
+        def reuse():
+            # 模拟主解析器已经解码过 body 之后再进入兜底的场景
+            parsed = ParsedResponse(raw_text)
+            parsed.image_body(0)
+            start = time.process_time()
+            list(iter_generated_image_urls(raw_text, parsed))
+            return time.process_time() - start
+
+        legacy = cpu_time_per_call(lambda: legacy_find_urls(legacy_text), args.iterations)
+        scan = cpu_time_per_call(lambda: list(iter_generated_image_urls(raw_text)), args.iterations)
+        reused = sum(reuse() for _ in range(args.iterations)) / args.iterations
+        print(f"{name:<44} {len(raw_text):>8}B {legacy * 1e3:>9.3f}ms {scan * 1e3:>9.3f}ms {reused * 1e3:>9.3f}ms")
+    print("* 旧解析器无法处理多行帧（整体 json.loads 会报 Extra data），legacy 列只统计了第一行。")
+
+
+if __name__ == "__main__":
+    main()
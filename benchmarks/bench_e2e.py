@@ -0,0 +1,267 @@
+# --- bench_e2e.py (端到端压测：本服务 + mock Gemini 后端) ---
+# 启动 mock 后端与指向它的本服务，然后并发请求 /v1/chat/completions，
+# 覆盖历史压平、图片处理（data URI 与远程 URL）、帧解析与响应序列化的完整路径，
+# 输出吞吐、端到端延迟与首字节延迟的分位数（JSON）。回复不完整（文本被截断或缺少生图）的请求记为错误，不计入延迟。
+# 用法（在仓库根目录）：
+#   python -m benchmarks.bench_e2e --requests 500 --concurrency 32 --output e2e.json
+#   python -m benchmarks.bench_e2e --mock-args "--latency-ms 800 --error-rate 0.02 --generated-images 1"
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+import orjson as json
+
+from .mock_gemini import _PNG_1X1, _lorem
+from .stats import summarize_latencies
+
+API_KEY = "bench-api-key"
+MODEL = "gemini-2.5-flash"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(port: int, mock_args: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.mock_gemini", "--port", str(port),
+                             *shlex.split(mock_args)])
+
+
+def start_app(port: int, mock_url: str, accounts: int, cache_dir: str, log_file) -> subprocess.Popen:
+    env = {key: value for key, value in os.environ.items() if not key.startswith("SECURE_1PSID")}
+    env.update({
+        "GEMINI_BACKEND_URL": mock_url,
+        "API_KEY": API_KEY,
+        "SECURE_1PSID": "mock-psid-0",
+        "SECURE_1PSIDTS": "mock-psidts-0",
+        # 空值会终止 config 中多账号的读取，避免 .env 里的真实账号被 load_dotenv 补进来
+        f"SECURE_1PSID_{accounts}": "",
+        "RESPONSE_CACHE_ENABLED": "false",
+        # 所有落盘状态都放进临时目录：不读入真实账号的 Cookie/Gem 缓存，也不把 mock 的 Gem ID 写回仓库
+        "IMAGE_PROXY_CACHE_DIR": cache_dir,
+        "BOOTSTRAP_CACHE_PATH": os.path.join(cache_dir, "bootstrap_cache.json"),
+        "COOKIE_CACHE_PATH": os.path.join(cache_dir, "cookie_cache.json"),
+        # 只有一个 uvicorn 进程：开发者环境里启用了共享存储时改用临时文件，否则显式关闭
+        "WORKERS": "1",
+        "SHARED_STORE_PATH": os.path.join(cache_dir, "shared_state.sqlite") if os.environ.get("SHARED_STORE_PATH")
+        else "",
+    })
+    for i in range(1, accounts):
+        env[f"SECURE_1PSID_{i}"] = f"mock-psid-{i}"
+        env[f"SECURE_1PSIDTS_{i}"] = f"mock-psidts-{i}"
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"],
+                            env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, headers: dict | None = None, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url, headers=headers)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def build_payload(rng: random.Random, args, mock_url: str) -> tuple[dict, bool]:
+    messages = [{"role": "system", "content": "You are a load-test assistant."}]
+    for turn in range(args.history_turns):
+        messages.append({"role": "user", "content": f"Question {turn}: " + "lorem " * rng.randint(5, 50)})
+        messages.append({"role": "assistant", "content": f"Answer {turn}: " + "ipsum " * rng.randint(20, 200)})
+
+    content = [{"type": "text", "text": f"Request {rng.getrandbits(64):x}: describe this."}]
+    if rng.random() < args.image_ratio:
+        if rng.random() < 0.5:
+            url = "data:image/png;base64," + base64.b64encode(_PNG_1X1 + rng.randbytes(args.image_bytes)).decode()
+        else:
+            url = f"{mock_url}/images/{rng.getrandbits(32):x}.png"
+        content.append({"type": "image_url", "image_url": {"url": url}})
+    messages.append({"role": "user", "content": content})
+
+    stream = rng.random() < args.stream_ratio
+    return {"model": MODEL, "messages": messages, "stream": stream}, stream
+
+
+def reply_content(body: bytes, stream: bool) -> tuple[str, int]:
+    """从响应体中取出回复文本与图片数量；流式响应拼接各个 delta，图片以 Markdown 形式出现在文本中。"""
+    if stream:
+        text = ""
+        for line in body.split(b"\n"):
+            if line.startswith(b"data: {"):
+                choices = json.loads(line[6:]).get("choices") or [{}]
+                text += choices[0].get("delta", {}).get("content") or ""
+        return text, text.count("![Generated Image](")
+    content = json.loads(body)["choices"][0]["message"]["content"]
+    if isinstance(content, str):
+        return content, 0
+    text = "".join(block.get("text") or "" for block in content if block.get("type") == "text")
+    return text, sum(block.get("type") == "image_url" for block in content)
+
+
+def check_reply(body: bytes, stream: bool, expected: dict) -> str | None:
+    """mock 的回复必须完整：包含全部正文并带有配置数量的生图。返回错误类型，完整时返回 None。"""
+    try:
+        text, images = reply_content(body, stream)
+    except (ValueError, KeyError, IndexError, TypeError):
+        return "malformed_reply"
+    if not text.strip():
+        return "empty_reply"
+    if _lorem(expected["response_bytes"]) not in text or images < expected["generated_images"]:
+        return "incomplete_reply"
+    return None
+
+
+async def send_one(client: httpx.AsyncClient, url: str, payload: dict, stream: bool, expected: dict) -> dict:
+    started = time.perf_counter()
+    first_byte = None
+    chunks: list[bytes] = []
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            async for chunk in response.aiter_bytes():
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+                chunks.append(chunk)
+            status = response.status_code
+        finished = time.perf_counter()
+        body = b"".join(chunks)
+        # 流式请求出错时服务端仍返回 200，错误放在最后一个数据块里
+        if status != 200:
+            error = None
+        elif stream and b'"error"' in body[-512:]:
+            error = "stream_error_chunk"
+        else:
+            error = check_reply(body, stream, expected)
+    except httpx.HTTPError as e:
+        finished = time.perf_counter()
+        status, error = None, type(e).__name__
+    return {
+        "stream": stream,
+        "status": status,
+        "error": error or (None if status == 200 else f"http_{status}"),
+        "latency_ms": (finished - started) * 1000,
+        "ttfb_ms": (first_byte - started) * 1000 if first_byte else None,
+    }
+
+
+async def run_load(args, app_url: str, mock_url: str, expected: dict) -> tuple[list[dict], float]:
+    rng = random.Random(args.seed)
+    payloads = [build_payload(rng, args, mock_url) for _ in range(args.requests + args.warmup)]
+    url = f"{app_url}/v1/chat/completions"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(headers={"Authorization": f"Bearer {API_KEY}"}, timeout=args.timeout,
+                                 limits=limits) as client:
+        await asyncio.gather(*(send_one(client, url, *payload, expected) for payload in payloads[:args.warmup]))
+
+        queue = iter(payloads[args.warmup:])
+        results = []
+
+        async def worker():
+            for payload, stream in queue:
+                results.append(await send_one(client, url, payload, stream, expected))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    ok = [r for r in results if r["error"] is None]
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "errors": dict(Counter(r["error"] for r in results if r["error"] is not None)),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize_latencies([r["latency_ms"] for r in ok]),
+        "ttfb": summarize_latencies([r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None]),
+    }
+
+
+async def main_async(args) -> dict:
+    mock_port, app_port = args.mock_port or _free_port(), args.app_port or _free_port()
+    mock_url, app_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{app_port}"
+    with tempfile.TemporaryDirectory() as cache_dir, open(args.app_log, "wb") as app_log:
+        mock = start_mock(mock_port, args.mock_args)
+        app = None
+        try:
+            await wait_ready(f"{mock_url}/mock/stats")
+            app = start_app(app_port, mock_url, args.accounts, cache_dir, app_log)
+            await wait_ready(f"{app_url}/v1/models", headers={"Authorization": f"Bearer {API_KEY}"})
+            async with httpx.AsyncClient() as client:
+                expected = (await client.get(f"{mock_url}/mock/stats")).json()["config"]
+            results, elapsed = await run_load(args, app_url, mock_url, expected)
+            async with httpx.AsyncClient() as client:
+                mock_stats = (await client.get(f"{mock_url}/mock/stats")).json()
+        finally:
+            for process in (app, mock):
+                if process is not None:
+                    process.terminate()
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+
+    return {
+        "suite": "e2e",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "app_log")},
+        "mock": mock_stats,
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize(results, elapsed),
+        "stream": summarize([r for r in results if r["stream"]], elapsed),
+        "non_stream": summarize([r for r in results if not r["stream"]], elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a mock Gemini backend.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="流式请求的比例")
+    parser.add_argument("--image-ratio", type=float, default=0.3, help="携带图片的请求比例（data URI 与远程 URL 各半）")
+    parser.add_argument("--image-bytes", type=int, default=32 * 1024, help="data URI 图片的大小")
+    parser.add_argument("--history-turns", type=int, default=3, help="每个请求附带的历史轮数")
+    parser.add_argument("--accounts", type=int, default=1, help="账号池中的 mock 账号数量")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mock-args", default="", help="原样传给 benchmarks.mock_gemini 的参数")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--app-port", type=int, default=0)
+    parser.add_argument("--app-log", default=os.devnull, help="本服务的日志输出文件")
+    parser.add_argument("--output", help="JSON 结果写入该文件，默认输出到 stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    overall = report["overall"]
+    print(f"{overall['succeeded']}/{overall['requests']} ok, {overall['throughput_rps']} req/s, "
+          f"latency p50 {overall['latency'].get('p50_ms')}ms p99 {overall['latency'].get('p99_ms')}ms, "
+          f"errors {overall['errors']}", file=sys.stderr)
+    payload = json.dumps(report, option=json.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(payload)
+    else:
+        sys.stdout.write(payload.decode() + "\n")
+
+
+if __name__ == "__main__":
+    main()
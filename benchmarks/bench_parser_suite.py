@@ -0,0 +1,198 @@
+# --- bench_parser_suite.py ---
+# 离线解析器基准套件：对 benchmarks/fixtures.py 中的每份语料分别运行
+# patched_generate_content 的解析逻辑（_parse_model_output）与 find_generated_images_from_raw_text，
+# 统计吞吐、p50/p99 延迟与峰值内存，结果以 JSON 输出，便于长期跟踪。
+# 用法（在仓库根目录）：
+#   python -m benchmarks.bench_parser_suite --output bench.json
+#   python -m benchmarks.bench_parser_suite --baseline bench.json --max-regression 0.2
+
+import argparse
+import contextlib
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import orjson as json
+
+os.environ.setdefault("SECURE_1PSID", "benchmark")
+os.environ.setdefault("SECURE_1PSIDTS", "benchmark")
+
+from gemini_webapi.utils import logger  # noqa: E402
+
+from src import gemini_client  # noqa: E402
+from src.custom_parser import find_generated_images_from_raw_text  # noqa: E402
+from src.gemini_client import _parse_model_output  # noqa: E402
+from benchmarks.fixtures import load_fixtures  # noqa: E402
+from benchmarks.stats import percentile  # noqa: E402
+
+CLIENT = SimpleNamespace(proxy=None, cookies={"__Secure-1PSID": "benchmark"})
+
+TARGETS = {
+    "parse_model_output": lambda raw_text: _parse_model_output(CLIENT, raw_text),
+    "custom_parser": lambda raw_text: find_generated_images_from_raw_text(raw_text, CLIENT.cookies, CLIENT.proxy),
+}
+
+# 这些语料在 parse_model_output 中必须走到自定义解析器兜底，否则测到的其实是正常路径
+FALLBACK_FIXTURES = {"malformed_generated_images"}
+
+
+def uses_custom_parser(raw_text: str) -> bool:
+    """解析一次，返回 _parse_model_output 是否调用了自定义解析器。"""
+    calls = []
+    original = gemini_client.find_generated_images_from_raw_text
+
+    def tracking(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    gemini_client.find_generated_images_from_raw_text = tracking
+    try:
+        _parse_model_output(CLIENT, raw_text)
+    except Exception:
+        pass
+    finally:
+        gemini_client.find_generated_images_from_raw_text = original
+    return bool(calls)
+
+
+def _describe(result) -> dict:
+    """记录一次调用的输出概要，便于确认语料确实走到了预期分支。"""
+    if isinstance(result, list):
+        return {"images": len(result)}
+    return {"candidates": len(result.candidates), "images": len(result.images), "text_chars": len(result.text)}
+
+
+def measure(func, raw_text: str, iterations: int, min_seconds: float, warmup: int) -> dict:
+    error = None
+    output = None
+    errors = 0
+    for _ in range(warmup):
+        try:
+            output = _describe(func(raw_text))
+        except Exception as e:
+            error = type(e).__name__
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < iterations or time.perf_counter() - started < min_seconds:
+        t0 = time.perf_counter_ns()
+        try:
+            func(raw_text)
+        except Exception:
+            errors += 1
+        samples.append((time.perf_counter_ns() - t0) / 1e6)
+    elapsed = time.perf_counter() - started
+
+    # 峰值内存单独测一次，避免 tracemalloc 的开销污染延迟数据
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        func(raw_text)
+    except Exception:
+        pass
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "iterations": len(samples),
+        "errors": errors,
+        "error_type": error,
+        "output": output,
+        "throughput_per_s": round(len(samples) / elapsed, 2),
+        "throughput_mb_per_s": round(len(raw_text.encode()) * len(samples) / elapsed / 1e6, 2),
+        "mean_ms": round(sum(samples) / len(samples), 4),
+        "p50_ms": round(percentile(samples, 0.50), 4),
+        "p99_ms": round(percentile(samples, 0.99), 4),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline: dict, max_regression: float) -> list[str]:
+    """与基线逐项比较 p50，返回超出允许退化比例的条目描述。"""
+    previous = {(r["fixture"], r["target"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result["fixture"], result["target"]))
+        if not old or not old["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / old["p50_ms"]
+        line = f"{result['fixture']:<36} {result['target']:<20} p50 {old['p50_ms']:.4f} -> {result['p50_ms']:.4f}ms " \
+               f"({ratio:.2f}x)"
+        print(line, file=sys.stderr)
+        if ratio > 1 + max_regression:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline parser benchmark suite.")
+    parser.add_argument("--fixture", action="append", help="只运行指定语料，可重复")
+    parser.add_argument("--target", action="append", choices=sorted(TARGETS), help="只运行指定解析器，可重复")
+    parser.add_argument("--iterations", type=int, default=200, help="每项最少调用次数")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="每项最少运行时间")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", help="JSON 结果写入该文件，默认输出到 stdout")
+    parser.add_argument("--baseline", help="与之前保存的 JSON 结果比较 p50")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="p50 允许的退化比例，超出时退出码为 1")
+    args = parser.parse_args()
+
+    # 兜底路径会打印调试信息与告警日志，测量期间全部屏蔽，保证 stdout 只有 JSON
+    logger.disable("src")
+    results = []
+    with open(os.devnull, "w") as devnull:
+        fixtures = load_fixtures(args.fixture)
+        for name in FALLBACK_FIXTURES & fixtures.keys():
+            with contextlib.redirect_stdout(devnull):
+                fallback = uses_custom_parser(fixtures[name])
+            if not fallback:
+                print(f"Fixture '{name}' no longer reaches the custom parser fallback.", file=sys.stderr)
+                sys.exit(1)
+        for name, raw_text in fixtures.items():
+            for target in args.target or sorted(TARGETS):
+                with contextlib.redirect_stdout(devnull):
+                    stats = measure(TARGETS[target], raw_text, args.iterations, args.min_seconds, args.warmup)
+                result = {"fixture": name, "target": target, "bytes": len(raw_text.encode()), **stats}
+                results.append(result)
+                print(f"{name:<36} {target:<20} p50 {stats['p50_ms']:>9.4f}ms  p99 {stats['p99_ms']:>9.4f}ms  "
+                      f"{stats['throughput_per_s']:>10.1f}/s  peak {stats['peak_memory_bytes'] / 1024:>9.1f}KiB",
+                      file=sys.stderr)
+
+    report = {
+        "suite": "parser",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    payload = json.dumps(report, option=json.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(payload)
+    else:
+        sys.stdout.write(payload.decode() + "\n")
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            regressions = compare(results, json.loads(f.read()), args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.max_regression:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# --- bench_response_parser.py ---
+# 比较旧的“每个候选项重新解码帧”实现与 ParsedResponse 一次性解析的 CPU 耗时。
+# 用法（在仓库根目录）：python -m benchmarks.bench_response_parser [--iterations 200]
+
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+import orjson as json
+
+os.environ.setdefault("SECURE_1PSID", "benchmark")
+os.environ.setdefault("SECURE_1PSIDTS", "benchmark")
+
+from gemini_webapi import Candidate, ModelOutput  # noqa: E402
+
+from src.gemini_client import (  # noqa: E402
+    IMAGE_PLACEHOLDER_PATTERN, _build_generated_images, _parse_model_output, _parse_thoughts, _parse_web_images
+)
+from benchmarks.synthetic import build_response  # noqa: E402
+
+SCENARIOS = {
+    "plain text": dict(text_size=4000),
+    # 旧实现只读第一行帧；ParsedResponse 读最后一个快照行，两者内容相同时耗时应相当
+    "plain text, 8 snapshot lines": dict(text_size=4000, tail_lines=7),
+    "web images": dict(text_size=2000, web_images=4),
+    "4 candidates, generated images": dict(candidates=4, tail_frames=8, generated_images=4),
+    "8 candidates x 32KB, generated images": dict(text_size=32000, candidates=8, tail_frames=16,
+                                                   generated_images=4),
+}
+
+
+def legacy_parse(client, raw_text: str) -> ModelOutput:
+    """改造前 patched_generate_content 中的解析逻辑（对照组，不含自定义解析器兜底）。"""
+    response_json = json.loads(raw_text.split("\n")[2])
+    body = None
+    body_index = 0
+    for i, part in enumerate(response_json):
+        try:
+            main_part = json.loads(part[2])
+            if main_part and len(main_part) > 4 and main_part[4]:
+                body = main_part
+                body_index = i
+                break
+        except (IndexError, TypeError, ValueError):
+            continue
+
+    candidates = []
+    for candidate_index, candidate_data in enumerate(body[4]):
+        text = candidate_data[1][0]
+        generated_images = []
+        if candidate_data[12] and candidate_data[12][7] and candidate_data[12][7][0]:
+            img_body = None
+            for i in range(body_index, len(response_json)):
+                try:
+                    img_part = json.loads(response_json[i][2])
+                    if img_part[4][candidate_index][12][7][0]:
+                        img_body = img_part
+                        break
+                except (IndexError, TypeError, ValueError):
+                    continue
+            img_candidate = img_body[4][candidate_index]
+            text = IMAGE_PLACEHOLDER_PATTERN.sub("", img_candidate[1][0]).rstrip()
+            generated_images = _build_generated_images(client, img_candidate[12][7][0])
+        candidates.append(Candidate(rcid=candidate_data[0], text=text, thoughts=_parse_thoughts(candidate_data),
+                                    web_images=_parse_web_images(client, candidate_data),
+                                    generated_images=generated_images))
+    return ModelOutput(metadata=body[1], candidates=candidates)
+
+
+def cpu_time_per_call(func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-candidate frame decoding with single-pass ParsedResponse.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    client = SimpleNamespace(proxy=None, cookies={"__Secure-1PSID": "benchmark"})
+    print(f"{'scenario':<46} {'size':>9} {'legacy':>11} {'indexed':>11} {'speedup':>8}")
+    for name, params in SCENARIOS.items():
+        raw_text = build_response(**params)
+        legacy_output = legacy_parse(client, raw_text)
+        indexed_output = _parse_model_output(client, raw_text)
+        assert [c.text for c in legacy_output.candidates] == [c.text for c in indexed_output.candidates]
+        assert len(legacy_output.images) == len(indexed_output.images)
+
+        legacy = cpu_time_per_call(lambda: legacy_parse(client, raw_text), args.iterations)
+        indexed = cpu_time_per_call(lambda: _parse_model_output(client, raw_text), args.iterations)
+        print(f"{name:<46} {len(raw_text):>8}B {legacy * 1e3:>9.3f}ms {indexed * 1e3:>9.3f}ms "
+              f"{legacy / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
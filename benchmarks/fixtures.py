@@ -0,0 +1,45 @@
+# --- fixtures.py (解析器基准测试语料) ---
+# 合成语料由固定参数生成，结果可复现；真实录制的响应体可放入 benchmarks/recorded/<名称>.txt，会被一并加载。
+
+from pathlib import Path
+from typing import Callable
+
+from .synthetic import break_generated_images, build_noise_response, build_response
+
+RECORDED_DIR = Path(__file__).parent / "recorded"
+
+
+def _truncate(raw_text: str) -> str:
+    """从第一帧行的中间截断，模拟连接中断导致的半截响应。"""
+    return raw_text[:len(raw_text) // 2]
+
+
+SYNTHETIC_FIXTURES: dict[str, Callable[[], str]] = {
+    "plain_text": lambda: build_response(text_size=2000),
+    "long_text": lambda: build_response(text_size=64000, tail_lines=4),
+    "thoughts": lambda: build_response(text_size=4000, thoughts=True),
+    "web_images": lambda: build_response(text_size=2000, web_images=6),
+    "multi_candidate": lambda: build_response(text_size=4000, candidates=3, tail_frames=4),
+    "generated_images": lambda: build_response(text_size=2000, generated_images=4, tail_lines=3),
+    "multi_candidate_generated_images": lambda: build_response(text_size=8000, candidates=4, generated_images=4,
+                                                               tail_frames=8, tail_lines=6),
+    # 以下为畸形响应：生图结构损坏触发兜底解析、截断的响应体、只有无关帧没有 body
+    "malformed_generated_images": lambda: break_generated_images(
+        build_response(text_size=2000, generated_images=4, tail_lines=3)),
+    "malformed_truncated": lambda: _truncate(build_response(text_size=4000, generated_images=2)),
+    "malformed_no_body": lambda: build_noise_response(noise_frames=8),
+}
+
+
+def load_fixtures(names: list[str] | None = None) -> dict[str, str]:
+    """返回 名称 -> 原始响应文本；names 为空时返回全部合成语料与录制语料。"""
+    fixtures = {name: build() for name, build in SYNTHETIC_FIXTURES.items()}
+    if RECORDED_DIR.is_dir():
+        for path in sorted(RECORDED_DIR.glob("*.txt")):
+            fixtures[f"recorded/{path.stem}"] = path.read_text(encoding="utf-8")
+    if names:
+        missing = set(names) - fixtures.keys()
+        if missing:
+            raise KeyError(f"Unknown fixture(s): {', '.join(sorted(missing))}")
+        fixtures = {name: fixtures[name] for name in names}
+    return fixtures
@@ -0,0 +1,218 @@
+# --- mock_gemini.py (本地 mock Gemini 后端) ---
+# 模拟 gemini.google.com 的初始化、Gem 列表/创建、附件上传、StreamGenerate 与生图下载接口，
+# 延迟、错误率、限流比例与响应大小均可配置，用于在不消耗真实账号的情况下压测整条链路。
+# 用法（在仓库根目录）：
+#   python -m benchmarks.mock_gemini --port 8765 --latency-ms 300 --snapshots 8 --error-rate 0.01
+#   GEMINI_BACKEND_URL=http://127.0.0.1:8765 python run.py
+# 运行时可通过 POST /mock/config 修改配置，GET /mock/stats 查看各接口的请求计数。
+# 流式与非流式请求在线路上完全相同，两者拿到同样的多行快照；非流式解析读取最后一个快照行，同样能拿到完整回复（含生图）。
+
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, fields
+
+import orjson as json
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from src.config import META_GEM_NAME
+
+from .synthetic import GENERATED_IMAGE_URL, IMAGE_PLACEHOLDER
+
+# 1x1 PNG，生图与示例图片都以它开头，不足 image_bytes 的部分补零
+_PNG_1X1 = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 200  # StreamGenerate 返回响应头之前的等待时间（模拟首字节延迟）
+    jitter_ms: float = 50  # 在 latency_ms 基础上叠加的随机抖动上限
+    snapshot_interval_ms: float = 30  # 相邻两个流式快照之间的间隔
+    snapshots: int = 8  # 每个响应的快照行数，最后一行为完整回复
+    response_bytes: int = 2000  # 最终回复文本的大小
+    generated_images: int = 0  # 每个回复附带的生成图片数量
+    image_bytes: int = 64 * 1024  # /gg/ 与 /images/ 返回的图片大小
+    error_rate: float = 0.0  # StreamGenerate 返回 500 的比例
+    throttle_rate: float = 0.0  # StreamGenerate 返回 429 的比例
+    upload_latency_ms: float = 50
+    init_latency_ms: float = 50
+    meta_gem_exists: bool = True  # 为 False 时 Gem 列表中不包含元指令 Gem，客户端会走创建流程
+
+    def update(self, values: dict):
+        for field in fields(self):
+            if field.name in values:
+                setattr(self, field.name, field.type(values[field.name]) if field.type is not bool
+                        else str(values[field.name]).lower() in ("1", "true", "yes"))
+
+
+def _frame_response(lines: list[list]) -> str:
+    encoded = [json.dumps(frame).decode() for frame in lines]
+    return ")]}'\n" + "".join(f"{len(line)}\n{line}\n" for line in encoded)
+
+
+def _lorem(size: int) -> str:
+    return ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (size // 57 + 1))[:size]
+
+
+def _snapshot_body(metadata: list, text: str, image_ids: list[str]) -> list:
+    candidate = [metadata[2], [text]] + [None] * 36
+    if image_ids:
+        candidate[12] = [None] * 7 + [[[
+            [[None, None, None, [None, None, None, GENERATED_IMAGE_URL.format(image_id)]],
+             None, None, [None, None, None, None, None, [f"mock image {i}"], i]]
+            for i, image_id in enumerate(image_ids)
+        ]]]
+    return [None, metadata[:2], None, None, [candidate]]
+
+
+def _parse_prompt(form) -> tuple[str, list | None]:
+    try:
+        inner = json.loads(json.loads(form["f.req"])[1])
+        return inner[0][0], inner[2]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return "", None
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Gemini backend")
+    stats: Counter = Counter()
+    gems: dict[str, str] = {}  # 通过创建接口新建的 Gem：id -> 名称
+    rng = random.Random()
+
+    def image_bytes() -> bytes:
+        return _PNG_1X1 + bytes(max(0, config.image_bytes - len(_PNG_1X1)))
+
+    @app.get("/app")
+    async def init_page():
+        stats["init"] += 1
+        await asyncio.sleep(config.init_latency_ms / 1000)
+        return PlainTextResponse('<script>window.WIZ_global_data = {"SNlM0e":"mock-access-token"};</script>',
+                                 media_type="text/html")
+
+    @app.post("/RotateCookies")
+    async def rotate_cookies():
+        stats["rotate_cookies"] += 1
+        response = PlainTextResponse("")
+        response.set_cookie("__Secure-1PSIDTS", f"mock-{uuid.uuid4().hex}")
+        return response
+
+    @app.post("/_/BardChatUi/data/batchexecute")
+    async def batch_execute(request: Request):
+        form = await request.form()
+        parts = []
+        for rpc_id, payload, _, tag in json.loads(form["f.req"])[0]:
+            stats[f"batchexecute:{rpc_id}"] += 1
+            if rpc_id == "CNgdBe":
+                if tag == "system":
+                    result = [None, None, [["mock-system-gem", ["Mock Gem", "predefined"], ["prompt"]]]]
+                else:
+                    custom = [[gem_id, [name, ""], ["prompt"]] for gem_id, name in gems.items()]
+                    if config.meta_gem_exists:
+                        custom.append(["mock-meta-gem", [META_GEM_NAME, ""], ["prompt"]])
+                    result = [None, None, custom]
+            elif rpc_id == "oMH3Zd":  # 创建 Gem
+                gem_id = f"mock-gem-{uuid.uuid4().hex[:8]}"
+                gems[gem_id] = json.loads(payload)[0][0] if payload else "gem"
+                result = [gem_id]
+            else:
+                result = []
+            parts.append(["wrb.fr", rpc_id, json.dumps(result).decode(), None, None, None, tag])
+        return PlainTextResponse(_frame_response([parts]))
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        form = await request.form()
+        data = await form["file"].read()
+        stats["upload"] += 1
+        await asyncio.sleep(config.upload_latency_ms / 1000)
+        return PlainTextResponse(f"/contrib_service/ttl_1d/{hashlib.sha256(data).hexdigest()}")
+
+    @app.post("/_/BardChatUi/data/assistant.lamda.BardFrontendService/StreamGenerate")
+    async def stream_generate(request: Request):
+        form = await request.form()
+        prompt, chat_metadata = _parse_prompt(form)
+        await asyncio.sleep((config.latency_ms + rng.uniform(0, config.jitter_ms)) / 1000)
+
+        roll = rng.random()
+        if roll < config.throttle_rate:
+            stats["generate:429"] += 1
+            return PlainTextResponse("Too Many Requests", status_code=429)
+        if roll < config.throttle_rate + config.error_rate:
+            stats["generate:500"] += 1
+            return PlainTextResponse("Internal Server Error", status_code=500)
+        stats["generate:200"] += 1
+
+        cid = chat_metadata[0] if chat_metadata and chat_metadata[0] else f"c_{uuid.uuid4().hex[:16]}"
+        metadata = [cid, f"r_{uuid.uuid4().hex[:16]}", f"rc_{uuid.uuid4().hex[:16]}"]
+        text = f"Echo({len(prompt)} chars): " + _lorem(config.response_bytes)
+        image_ids = [uuid.uuid4().hex for _ in range(config.generated_images)]
+        if image_ids:
+            text += " " + " ".join(IMAGE_PLACEHOLDER.format(i) for i in range(len(image_ids)))
+        snapshots = max(1, config.snapshots)
+
+        async def frames():
+            yield ")]}'\n"
+            for i in range(1, snapshots + 1):
+                if i > 1:
+                    await asyncio.sleep(config.snapshot_interval_ms / 1000)
+                final = i == snapshots
+                body = _snapshot_body(metadata, text if final else text[:len(text) * i // snapshots],
+                                      image_ids if final else [])
+                line = json.dumps([["wrb.fr", None, json.dumps(body).decode()]]).decode()
+                yield f"{len(line)}\n{line}\n"
+
+        return StreamingResponse(frames(), media_type="application/json")
+
+    @app.get("/gg/{image_id}")
+    async def generated_image(image_id: str):
+        stats["generated_image"] += 1
+        return Response(image_bytes(), media_type="image/png")
+
+    @app.get("/images/{name}")
+    async def sample_image(name: str):
+        """供压测请求中的远程图片 URL 使用。"""
+        stats["sample_image"] += 1
+        return Response(image_bytes(), media_type="image/png")
+
+    @app.get("/mock/stats")
+    async def get_stats():
+        return {"stats": dict(stats), "config": asdict(config), "time": time.time()}
+
+    @app.post("/mock/config")
+    async def set_config(request: Request):
+        config.update(await request.json())
+        return asdict(config)
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Mock Gemini backend for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    for field in fields(MockConfig):
+        flag = "--" + field.name.replace("_", "-")
+        if field.type is bool:
+            parser.add_argument(flag, type=lambda v: v.lower() in ("1", "true", "yes"), default=field.default)
+        else:
+            parser.add_argument(flag, type=field.type, default=field.default)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    config = MockConfig(**{field.name: getattr(args, field.name) for field in fields(MockConfig)})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# --- stats.py (基准测试共用的统计函数) ---
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    """最近秩百分位，sorted_samples 须已排序且非空。"""
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize_latencies(samples: list[float]) -> dict:
+    """延迟样本（毫秒）的均值与 p50/p90/p99/max，样本为空时返回空字典。"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+        "p50_ms": round(percentile(ordered, 0.50), 3),
+        "p90_ms": round(percentile(ordered, 0.90), 3),
+        "p99_ms": round(percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
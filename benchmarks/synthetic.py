@@ -0,0 +1,94 @@
+# --- synthetic.py (合成的 StreamGenerate 响应体) ---
+# 按 Gemini 网页端的帧结构生成响应文本，供解析器基准测试离线使用。
+
+import orjson as json
+
+GENERATED_IMAGE_URL = "https://lh3.googleusercontent.com/gg/{}"
+WEB_IMAGE_URL = "https://example.com/web-image-{}.jpg"
+IMAGE_PLACEHOLDER = "http://googleusercontent.com/image_generation_content/{}"
+
+
+def _candidate(index: int, text: str, thoughts: str | None = None, web_images: int = 0,
+               generated_images: int = 0) -> list:
+    candidate = [f"rc_{index}", [text]] + [None] * 36
+    if web_images or generated_images:
+        media = [None] * 8
+        if web_images:
+            media[1] = [[[[WEB_IMAGE_URL.format(i)], None, None, None, f"alt {i}"]] + [None] * 6 + [[f"Web {i}"]]
+                        for i in range(web_images)]
+        if generated_images:
+            media[7] = [[
+                [[None, None, None, [None, None, None, GENERATED_IMAGE_URL.format(f"{index}-{i}")]],
+                 None, None, [None, None, None, None, None, [f"alt {i}"], i]]
+                for i in range(generated_images)
+            ]]
+        candidate[12] = media
+    if thoughts:
+        candidate[37] = [[thoughts]]
+    return candidate
+
+
+def _body(candidates: list) -> list:
+    return [None, ["c_synthetic", "r_synthetic"], None, None, candidates]
+
+
+def _part(inner) -> list:
+    return ["wrb.fr", None, json.dumps(inner).decode() if inner is not None else None]
+
+
+def build_response(text_size: int = 2000, candidates: int = 1, noise_frames: int = 4, tail_frames: int = 0,
+                   thoughts: bool = False, web_images: int = 0, generated_images: int = 0,
+                   tail_lines: int = 0) -> str:
+    """
+    生成一个完整的 StreamGenerate 响应文本：
+    noise_frames 个无关部分 -> 含 body 的部分 -> tail_frames 个后续部分，
+    之后再追加 tail_lines 个独立的 <长度>/帧 行（每行一个完整快照，与真实响应的后续行一致）。
+    """
+    text = ("Lorem ipsum dolor sit amet. " * (text_size // 28 + 1))[:text_size]
+    if generated_images:
+        text += " " + IMAGE_PLACEHOLDER.format(0)
+    parts = [_part([None, None, {"noise": i}]) for i in range(noise_frames)]
+    body = [_candidate(i, text, "Thinking..." if thoughts else None, web_images, generated_images)
+            for i in range(candidates)]
+    parts.append(_part(_body(body)))
+    for _ in range(tail_frames):
+        parts.append(_part(_body([_candidate(c, text, web_images=web_images) for c in range(candidates)])))
+    lines = [json.dumps(parts).decode()]
+    for _ in range(tail_lines):
+        lines.append(json.dumps([_part(_body(body))]).decode())
+    return ")]}'\n" + "".join(f"{len(line)}\n{line}\n" for line in lines)
+
+
+def build_noise_response(noise_frames: int = 8) -> str:
+    """只有无关部分、没有任何 body 的响应。"""
+    line = json.dumps([_part([None, None, {"noise": i}]) for i in range(noise_frames)]).decode()
+    return f")]}}'\n{len(line)}\n{line}\n"
+
+
+def break_generated_images(raw_text: str) -> str:
+    """
+    把每个帧行中每个生图条目多包一层列表，使官方结构解析失败（TypeError/IndexError），
+    URL 仍留在响应里，用于触发自定义解析器兜底。非流式解析读取最后一个快照行，因此每一行都要破坏。
+    """
+    lines = raw_text.split("\n")
+    for index in range(2, len(lines), 2):
+        if lines[index]:
+            lines[index] = _break_frame_line(lines[index])
+            lines[index - 1] = str(len(lines[index]))
+    return "\n".join(lines)
+
+
+def _break_frame_line(line: str) -> str:
+    frame = json.loads(line)
+    for part in frame:
+        try:
+            body = json.loads(part[2])
+        except (IndexError, TypeError, ValueError):
+            continue
+        if not (body and len(body) > 4 and body[4]):
+            continue
+        for candidate in body[4]:
+            if candidate[12] and candidate[12][7]:
+                candidate[12][7][0] = [[gen_img] for gen_img in candidate[12][7][0]]
+        part[2] = json.dumps(body).decode()
+    return json.dumps(frame).decode()
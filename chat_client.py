@@ -1,4 +1,12 @@
 import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
 import requests
 import json
 from dotenv import load_dotenv
@@ -113,8 +121,177 @@ def start_chat_loop(headers: dict):
             print(f"\n[Error]: Failed to parse the server's response. Text: {response.text}")
 
 
+def load_prompts(path: str) -> list[dict]:
+    """
+    从 JSONL 文件读取压测用的 prompt，每行一个对象，按以下顺序识别：
+    "messages"（OpenAI 格式的消息列表）> "prompt" / "text" / "content" > "title" + "body"（如 requests.jsonl）。
+    可选的 "stream" 字段会覆盖 --stream-ratio 的随机选择。
+    """
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "messages" in item:
+                messages = item["messages"]
+            else:
+                text = item.get("prompt") or item.get("text") or item.get("content") or \
+                    "\n\n".join(part for part in (item.get("title"), item.get("body")) if part)
+                if not text:
+                    raise ValueError(f"{path}:{line_no}: no prompt text found")
+                messages = [{"role": "user", "content": text}]
+            prompts.append({"messages": messages, "stream": item.get("stream")})
+    if not prompts:
+        raise ValueError(f"{path}: no prompts found")
+    return prompts
+
+
+async def send_bench_request(client, payload: dict) -> dict:
+    """
+    发送一个请求并记录：TTFB（收到响应头）、TTFT（收到第一个非空内容）、总耗时与错误类型。
+    非流式请求的内容随响应一次性返回，TTFT 即总耗时。
+    """
+    result = {"stream": payload["stream"], "ttfb_ms": None, "ttft_ms": None, "latency_ms": None, "error": None}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", CHAT_ENDPOINT, json=payload) as response:
+            result["ttfb_ms"] = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"http_{response.status_code}"
+            elif payload["stream"]:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    chunk = json.loads(line[6:])
+                    if "error" in chunk:
+                        result["error"] = "stream_error"
+                        break
+                    if result["ttft_ms"] is None and chunk["choices"][0]["delta"].get("content"):
+                        result["ttft_ms"] = (time.perf_counter() - started) * 1000
+            else:
+                data = json.loads(await response.aread())
+                if data["choices"][0]["message"]["content"]:
+                    result["ttft_ms"] = (time.perf_counter() - started) * 1000
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    except (KeyError, IndexError, ValueError):
+        result["error"] = "invalid_response"
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def run_benchmark(args, headers: dict) -> dict:
+    # 只有压测模式依赖 benchmarks 包，交互模式不需要在仓库根目录下运行
+    from benchmarks.stats import summarize_latencies
+
+    prompts = load_prompts(args.prompts)
+    rng = random.Random(args.seed)
+
+    def next_payload() -> dict:
+        prompt = rng.choice(prompts)
+        stream = prompt["stream"] if prompt["stream"] is not None else rng.random() < args.stream_ratio
+        return {"model": args.model, "messages": prompt["messages"], "stream": stream}
+
+    results = []
+    max_connections = args.concurrency if not args.rps else max(args.concurrency, int(args.rps * args.timeout))
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(headers=headers, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        if args.rps:
+            # 开环：按固定到达速率发起请求，不等待之前的请求完成，排队延迟会如实反映在结果里
+            tasks = []
+            for i in range(args.requests):
+                delay = started + i / args.rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send_bench_request(client, next_payload())))
+            results = await asyncio.gather(*tasks)
+        else:
+            # 闭环：固定数量的并发 worker，每个 worker 完成一个请求后立即发起下一个
+            remaining = iter(range(args.requests))
+
+            async def worker():
+                for _ in remaining:
+                    results.append(await send_bench_request(client, next_payload()))
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    def summarize(subset: list[dict]) -> dict:
+        ok = [r for r in subset if r["error"] is None]
+        return {
+            "requests": len(subset),
+            "succeeded": len(ok),
+            "errors": dict(Counter(r["error"] for r in subset if r["error"])),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "ttfb": summarize_latencies([r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None]),
+            "ttft": summarize_latencies([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+            "latency": summarize_latencies([r["latency_ms"] for r in ok]),
+        }
+
+    return {
+        "target": API_URL_BASE,
+        "mode": f"rps={args.rps}" if args.rps else f"concurrency={args.concurrency}",
+        "elapsed_s": round(elapsed, 3),
+        "offered_rps": args.rps,
+        "overall": summarize(results),
+        "stream": summarize([r for r in results if r["stream"]]),
+        "non_stream": summarize([r for r in results if not r["stream"]]),
+    }
+
+
+def print_benchmark_report(report: dict):
+    print(f"\n--- Benchmark against {report['target']} ({report['mode']}, {report['elapsed_s']}s) ---")
+    for name in ("overall", "stream", "non_stream"):
+        part = report[name]
+        if not part["requests"]:
+            continue
+        print(f"[{name}] {part['succeeded']}/{part['requests']} ok, {part['throughput_rps']} req/s, "
+              f"errors: {part['errors'] or 'none'}")
+        for metric in ("ttfb", "ttft", "latency"):
+            stats = part[metric]
+            if stats:
+                print(f"   {metric:<8} p50 {stats['p50_ms']:>9.1f}ms   p90 {stats['p90_ms']:>9.1f}ms   "
+                      f"p99 {stats['p99_ms']:>9.1f}ms   max {stats['max_ms']:>9.1f}ms")
+
+
+def parse_args() -> argparse.Namespace:
+    global API_URL_BASE, MODELS_ENDPOINT, CHAT_ENDPOINT, MODEL_TO_USE
+    parser = argparse.ArgumentParser(description="CatfishAPI client: interactive chat or load benchmark.")
+    parser.add_argument("--url", default=API_URL_BASE, help="服务地址")
+    parser.add_argument("--model", default=MODEL_TO_USE)
+    parser.add_argument("--bench", action="store_true", help="非交互的压测模式")
+    parser.add_argument("--prompts", default="requests.jsonl", help="压测 prompt 的 JSONL 文件")
+    parser.add_argument("--requests", type=int, default=100, help="压测请求总数")
+    parser.add_argument("--concurrency", type=int, default=8, help="闭环模式的并发数")
+    parser.add_argument("--rps", type=float, default=0, help="设置后改为开环模式，按该速率发起请求")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="流式请求的比例")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="压测结果 JSON 的保存路径")
+    args = parser.parse_args()
+
+    API_URL_BASE = args.url.rstrip("/")
+    MODELS_ENDPOINT = f"{API_URL_BASE}/v1/models"
+    CHAT_ENDPOINT = f"{API_URL_BASE}/v1/chat/completions"
+    MODEL_TO_USE = args.model
+    return args
+
+
 def main():
     """主函数，检查配置并启动客户端。"""
+    args = parse_args()
+    if args.bench:
+        auth_headers = {"Authorization": f"Bearer {API_KEY}"} if API_KEY else {}
+        report = asyncio.run(run_benchmark(args, auth_headers))
+        print_benchmark_report(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        sys.exit(0 if report["overall"]["succeeded"] else 1)
+
     print("=============================================")
     print("    CatfishAPI Interactive Client v2.0     ")
     print("=============================================")
@@ -1,4 +1,10 @@
 import uvicorn
 
+from src.config import WORKERS
+
 if __name__ == "__main__":
-    uvicorn.run("src.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if WORKERS > 1:
+        # 多 worker 模式：各 worker 通过 SHARED_STORE_PATH 共享会话与缓存，不能与自动重载同时使用
+        uvicorn.run("src.main:app", host="0.0.0.0", port=8000, workers=WORKERS)
+    else:
+        uvicorn.run("src.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
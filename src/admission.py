@@ -0,0 +1,216 @@
+# --- admission.py (准入控制) ---
+# 在 Conversation.send_message / send_message_stream 之前限制同时发往上游的请求数。
+# 名额用完时请求按 API Key（租户）分别进入有界的 FIFO 队列；名额空出时按各租户的权重公平地挑选下一个请求，
+# 批量任务只能用掉交互式用户用不完的余量。租户的令牌桶限速、并发上限、队列已满或等待超过上限时
+# 立即以 429 + Retry-After 拒绝，避免突发流量一起压到上游、一起被限流、一起超时。
+
+import asyncio
+import math
+import time
+from collections import deque
+
+from .config import ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS
+from .metrics import (
+    ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, TENANT_LATENCY, TENANT_QUEUE_WAIT, TENANT_REQUESTS,
+    observe_stage
+)
+from .tenants import Tenant
+
+# 估算 Retry-After 用的单请求占用时长的初始值（秒），之后按实际占用时长做指数滑动平均
+_INITIAL_SERVICE_SECONDS = 10.0
+_SERVICE_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """限速、队列已满或排队超时。retry_after 为建议客户端重试前等待的秒数。"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server is busy ({reason}), please retry after {retry_after}s.")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _TenantQueue:
+    """
+    一个租户的调度状态。virtual_pass 是步长调度（stride scheduling）中的“通行值”：
+    每获得一个名额增加 1/weight，名额空出时交给通行值最小的租户，因此长期来看各租户按权重分享名额。
+    """
+    __slots__ = ("tenant", "waiters", "in_flight", "virtual_pass")
+
+    def __init__(self, tenant: Tenant):
+        self.tenant = tenant
+        self.waiters: deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.virtual_pass = 0.0
+
+
+class AdmissionSlot:
+    """一个已获得的并发名额。release() 可重复调用，只有第一次生效。"""
+
+    __slots__ = ("_controller", "_queue", "_arrived_at", "_acquired_at", "_released")
+
+    def __init__(self, controller: "AdmissionController", queue: _TenantQueue, arrived_at: float):
+        self._controller = controller
+        self._queue = queue
+        self._arrived_at = arrived_at
+        self._acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        now = time.monotonic()
+        tenant = self._queue.tenant
+        tenant.completed += 1
+        tenant.total_latency += now - self._arrived_at
+        tenant.total_queue_wait += self._acquired_at - self._arrived_at
+        TENANT_LATENCY.labels(tenant.name).observe(now - self._arrived_at)
+        self._controller._release(self._queue, now - self._acquired_at)
+
+
+class AdmissionController:
+    """
+    全局并发上限 + 每个租户一个有界等待队列。max_concurrency <= 0 时不限制全局并发，
+    但租户自己的限速与并发上限仍然生效。同一租户内部严格按到达顺序放行。
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._queues: dict[str, _TenantQueue] = {}
+        self._virtual_time = 0.0  # 最近一次被放行的通行值，新进入排队的租户从这里开始，不能攒下空闲时的额度
+        self._service_seconds = _INITIAL_SERVICE_SECONDS
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue.waiters) for queue in self._queues.values())
+
+    def _queue(self, tenant: Tenant) -> _TenantQueue:
+        queue = self._queues.get(tenant.name)
+        if queue is None:
+            queue = self._queues[tenant.name] = _TenantQueue(tenant)
+        return queue
+
+    def _can_start(self, queue: _TenantQueue) -> bool:
+        if self.enabled and self.in_flight >= self.max_concurrency:
+            return False
+        return not queue.tenant.max_concurrency or queue.in_flight < queue.tenant.max_concurrency
+
+    def _start(self, queue: _TenantQueue):
+        queue.virtual_pass = max(queue.virtual_pass, self._virtual_time)
+        self._virtual_time = queue.virtual_pass
+        queue.virtual_pass += 1 / queue.tenant.weight
+        queue.in_flight += 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def retry_after(self, queue: _TenantQueue) -> int:
+        """按该租户的排队长度、可用的并发名额与平均占用时长估算轮到新请求所需的时间。"""
+        slots = min(filter(None, (self.max_concurrency if self.enabled else 0, queue.tenant.max_concurrency)),
+                    default=max(1, self.in_flight))
+        return max(1, math.ceil(self._service_seconds * (len(queue.waiters) + 1) / slots))
+
+    def _reject(self, queue: _TenantQueue, reason: str, retry_after: int | None = None):
+        self.rejected += 1
+        queue.tenant.rejected += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+        TENANT_REQUESTS.labels(queue.tenant.name, reason).inc()
+        raise AdmissionRejected(reason, retry_after or self.retry_after(queue))
+
+    async def _take_token(self, queue: _TenantQueue):
+        if queue.tenant.bucket is not None:
+            wait = await queue.tenant.bucket.take()
+            if wait:
+                self._reject(queue, "rate_limited", math.ceil(wait))
+
+    async def charge(self, tenant: Tenant):
+        """
+        合并进同一租户已有上游调用的请求不占用名额，但照样计入该租户的请求数并消耗令牌桶，
+        否则重复发送相同的请求就能绕过限速。超过限速时抛出 AdmissionRejected。
+        """
+        queue = self._queue(tenant)
+        tenant.requests += 1
+        await self._take_token(queue)
+        TENANT_REQUESTS.labels(tenant.name, "coalesced").inc()
+
+    async def acquire(self, tenant: Tenant) -> AdmissionSlot:
+        arrived_at = time.monotonic()
+        queue = self._queue(tenant)
+        tenant.requests += 1
+        if queue.waiters and len(queue.waiters) >= self.max_queue:
+            self._reject(queue, "queue_full")
+        await self._take_token(queue)
+
+        if not queue.waiters and self._can_start(queue):
+            self._start(queue)
+            return self._admitted(queue, arrived_at)
+        if len(queue.waiters) >= self.max_queue:
+            self._reject(queue, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            # 超时的同时恰好拿到名额时照常放行
+            if not waiter.done() or waiter.cancelled():
+                self._reject(queue, "timeout")
+        except BaseException:
+            # 客户端断开等原因被取消：已经移交过来的名额要还回去
+            if waiter.done() and not waiter.cancelled():
+                self._release(queue, None)
+            raise
+        finally:
+            if waiter in queue.waiters:
+                queue.waiters.remove(waiter)
+        return self._admitted(queue, arrived_at)
+
+    def _admitted(self, queue: _TenantQueue, arrived_at: float) -> AdmissionSlot:
+        waited = time.monotonic() - arrived_at
+        observe_stage("queue", waited)
+        TENANT_QUEUE_WAIT.labels(queue.tenant.name).observe(waited)
+        TENANT_REQUESTS.labels(queue.tenant.name, "admitted").inc()
+        return AdmissionSlot(self, queue, arrived_at)
+
+    def _release(self, queue: _TenantQueue, held_seconds: float | None):
+        if held_seconds is not None:
+            self._service_seconds += _SERVICE_EWMA_ALPHA * (held_seconds - self._service_seconds)
+        queue.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """只要还有空余名额，就按通行值从小到大把名额交给可以开始的租户的队首请求。"""
+        while True:
+            candidates = [queue for queue in self._queues.values() if queue.waiters and self._can_start(queue)]
+            if not candidates:
+                return
+            queue = min(candidates, key=lambda q: q.virtual_pass)
+            waiter = queue.waiters.popleft()
+            if waiter.done():  # 已超时或被取消
+                continue
+            self._start(queue)
+            waiter.set_result(None)
+
+    def tenant_stats(self) -> list[dict]:
+        return [{**queue.tenant.stats(), "in_flight": queue.in_flight, "queue_depth": len(queue.waiters)}
+                for queue in self._queues.values()]
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "in_flight": self.in_flight, "max_concurrency": self.max_concurrency,
+                "queue_depth": self.queue_depth, "max_queue": self.max_queue, "admitted": self.admitted,
+                "rejected": self.rejected, "avg_service_seconds": round(self._service_seconds, 3)}
+
+
+admission = AdmissionController(ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS)
+ADMISSION_QUEUE_DEPTH.set_function(lambda: admission.queue_depth)
+ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
@@ -0,0 +1,92 @@
+# --- attachments.py (内存中的附件) ---
+
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+
+import aiofiles
+
+from .config import ATTACHMENT_SPILL_BYTES, TEMP_UPLOAD_DIR
+from .metrics import stage_timer
+
+
+class Attachment:
+    """
+    一个待上传的附件。解码/下载得到的字节直接留在内存中交给上传流程，不再经过磁盘；
+    只有超过 ATTACHMENT_SPILL_BYTES 的大附件才会落盘，用完后由 cleanup() 删除。
+    """
+    __slots__ = ("name", "sha256", "size", "_data", "_path", "_owns_path")
+
+    def __init__(self, name: str, data: bytes | memoryview | None = None, path: str | None = None,
+                 sha256: str | None = None, owns_path: bool = False):
+        self.name = name
+        self._data = data
+        self._path = path
+        self._owns_path = owns_path
+        if data is not None:
+            self.size = len(data)
+            self.sha256 = sha256 or hashlib.sha256(data).hexdigest()
+        else:
+            self.size = os.path.getsize(path)
+            self.sha256 = sha256 or hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+    @classmethod
+    async def from_bytes(cls, name: str, data: bytes | memoryview) -> "Attachment":
+        """从内存中的字节创建附件，超过阈值时写入临时文件以免长时间占用内存。"""
+        if len(data) <= ATTACHMENT_SPILL_BYTES:
+            return cls(name, data=data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = os.path.join(TEMP_UPLOAD_DIR, f"{uuid.uuid4()}-{name}")
+        with stage_timer("attachment_spill"):
+            async with aiofiles.open(path, "wb") as f:
+                await f.write(data)
+        return cls(name, path=path, sha256=sha256, owns_path=True)
+
+    @classmethod
+    def from_path(cls, path: str | Path) -> "Attachment":
+        """兼容直接传入文件路径的调用方（例如 ChatSession.send_message(files=[...])）。"""
+        return cls(Path(path).name, path=str(path))
+
+    @property
+    def spilled(self) -> bool:
+        return self._data is None
+
+    def read(self) -> bytes | memoryview:
+        if self._data is not None:
+            return self._data
+        with open(self._path, "rb") as f:
+            return f.read()
+
+    def cleanup(self):
+        self._data = None
+        if self._owns_path and self._path:
+            try:
+                os.remove(self._path)
+            except OSError as e:
+                print(f"Error cleaning up temp file {self._path}: {e}")
+            self._owns_path = False
+
+    def __repr__(self):
+        return f"Attachment(name='{self.name}', size={self.size}, spilled={self.spilled})"
+
+
+def as_attachment(file: "Attachment | str | Path") -> Attachment:
+    return file if isinstance(file, Attachment) else Attachment.from_path(file)
+
+
+def cleanup_attachments(attachments: list[Attachment]):
+    for attachment in attachments:
+        attachment.cleanup()
+
+
+def purge_stale_temp_uploads(max_age_seconds: float = 3600):
+    """启动时清理上次进程崩溃后遗留在临时目录里的落盘附件。"""
+    now = time.time()
+    for entry in os.scandir(TEMP_UPLOAD_DIR):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age_seconds:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"Error purging stale temp file {entry.path}: {e}")
@@ -0,0 +1,52 @@
+# --- backend_override.py (把上游请求改写到本地 mock 服务，仅用于压测) ---
+
+import importlib
+
+import httpx
+
+from .config import GEMINI_BACKEND_URL
+
+# gemini_webapi 中各自 `from httpx import AsyncClient` 的模块。
+# utils 包把同名函数导出到了包上，会遮住子模块属性，所以按模块路径导入
+_ASYNC_CLIENT_MODULES = (
+    "gemini_webapi.client",
+    "gemini_webapi.types.image",
+    "gemini_webapi.utils.get_access_token",
+    "gemini_webapi.utils.rotate_1psidts",
+    "gemini_webapi.utils.upload_file",
+)
+
+
+class RedirectTransport(httpx.AsyncHTTPTransport):
+    """保持请求路径不变，只把协议、主机和端口替换为 mock 服务的地址。"""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = httpx.URL(base_url)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self.base_url.scheme, host=self.base_url.host,
+                                            port=self.base_url.port)
+        return await super().handle_async_request(request)
+
+
+class RedirectedAsyncClient(httpx.AsyncClient):
+    """每个客户端持有自己的 RedirectTransport（transport 会随客户端一起关闭，不能共享）。"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs["transport"] = RedirectTransport(GEMINI_BACKEND_URL)
+        super().__init__(*args, **kwargs)
+
+
+def upstream_client_kwargs() -> dict:
+    """本项目自行创建的上游 httpx 客户端（上传、生图代理）在 mock 模式下需要附加的参数。"""
+    return {"transport": RedirectTransport(GEMINI_BACKEND_URL)} if GEMINI_BACKEND_URL else {}
+
+
+def apply_backend_override():
+    """GEMINI_BACKEND_URL 非空时，替换 gemini_webapi 各模块里引用的 AsyncClient。"""
+    if not GEMINI_BACKEND_URL:
+        return
+    for module_name in _ASYNC_CLIENT_MODULES:
+        importlib.import_module(module_name).AsyncClient = RedirectedAsyncClient
+    print(f"[WARN] GEMINI_BACKEND_URL is set. All upstream requests are redirected to {GEMINI_BACKEND_URL}.")
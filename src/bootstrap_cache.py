@@ -0,0 +1,59 @@
+# --- bootstrap_cache.py (启动元数据缓存) ---
+# 每个账号的元指令Gem ID 写入本地 JSON 文件。重启时直接使用缓存的 Gem，
+# 启动只需 client.init()（获取 access_token）即可开始服务，fetch_gems / create_gem 移到后台校验，
+# 缓存的 Gem 已被删除时才重新创建。元指令Gem 的名称或提示词变了，缓存整体失效。
+# access_token 有效期短，且与 Cookie 一起才有意义，不做缓存。
+# 多 worker 部署时 Gem ID 同时写入 shared_store，先完成引导的 worker 写入后，其余 worker 直接使用。
+
+import hashlib
+import time
+
+from gemini_webapi import Gem
+
+from .config import BOOTSTRAP_CACHE_PATH, META_GEM_NAME, META_GEM_PROMPT
+from .cookie_store import read_json, write_json_atomically
+from .shared_store import shared_store
+
+
+def account_key(psid: str) -> str:
+    # 文件与共享存储里不保存 PSID 本身
+    return hashlib.sha256(psid.encode()).hexdigest()[:16]
+
+
+def _meta_gem_fingerprint() -> str:
+    return hashlib.sha256(f"{META_GEM_NAME}\0{META_GEM_PROMPT}".encode()).hexdigest()
+
+
+class BootstrapCache:
+    """账号 -> 元指令Gem。path 为空时只在内存中保存。"""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        data = read_json(path)
+        if data.get("meta_gem") != _meta_gem_fingerprint():
+            data = {}
+        self._accounts: dict[str, dict] = data.get("accounts", {})
+
+    async def meta_gem_for(self, psid: str) -> Gem | None:
+        key = account_key(psid)
+        entry = self._accounts.get(key)
+        if not entry and shared_store.enabled:
+            shared = await shared_store.get("meta_gem", key)
+            if shared and shared.get("fingerprint") == _meta_gem_fingerprint():
+                entry = shared
+        if not entry:
+            return None
+        return Gem(id=entry["id"], name=META_GEM_NAME, prompt=META_GEM_PROMPT, predefined=False)
+
+    async def save(self, psid: str, meta_gem: Gem):
+        key = account_key(psid)
+        if shared_store.enabled:
+            await shared_store.set("meta_gem", key, {"id": meta_gem.id, "fingerprint": _meta_gem_fingerprint()})
+        if self._accounts.get(key, {}).get("id") == meta_gem.id:
+            return
+        self._accounts[key] = {"id": meta_gem.id, "updated": int(time.time())}
+        if self.path:
+            write_json_atomically(self.path, {"meta_gem": _meta_gem_fingerprint(), "accounts": self._accounts})
+
+
+bootstrap_cache = BootstrapCache(BOOTSTRAP_CACHE_PATH)
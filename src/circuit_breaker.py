@@ -0,0 +1,145 @@
+# --- circuit_breaker.py (账号级熔断器) ---
+# 上游失败先分类，再决定怎么处理：限流与鉴权失败立即熔断，5xx/网络错误这类瞬时故障保持客户端可用，
+# 只有连续出现或错误率过高时才熔断。熔断期间该账号不再接收请求，冷却结束后放行一个试探请求（半开），
+# 成功即恢复，失败则以加倍的冷却时间再次熔断。
+
+import asyncio
+import re
+import time
+from collections import deque
+
+import httpx
+from gemini_webapi.exceptions import (
+    APIError, AuthError, TemporarilyBlocked, TimeoutError as GeminiTimeoutError, UsageLimitExceeded
+)
+from gemini_webapi.utils import logger
+
+from .config import (
+    ACCOUNT_COOLDOWN_SECONDS, ACCOUNT_ERROR_WINDOW, ACCOUNT_MAX_ERROR_RATE, BREAKER_FAILURE_THRESHOLD,
+    BREAKER_MAX_COOLDOWN_SECONDS
+)
+from .metrics import BREAKER_TRANSITIONS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+# 失败类型
+THROTTLED = "throttled"  # 429、用量超限、临时封禁：账号本身被限流，立即熔断并冷却
+AUTH = "auth"  # 401/403、Cookie 失效：立即熔断，并在后台重建客户端
+TRANSIENT = "transient"  # 5xx、网络错误、超时：客户端保持可用，连续出现才熔断
+OTHER = "other"  # 解析失败、空结果等：只计入错误率
+
+_STATUS_PATTERN = re.compile(r"status code (\d{3})")
+
+
+class UpstreamStatusError(APIError):
+    """StreamGenerate 返回了非 200 状态码。"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Request failed with status code {status_code}")
+        self.status_code = status_code
+
+
+def classify_failure(error: BaseException) -> str:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        match = _STATUS_PATTERN.search(str(error))
+        status = int(match.group(1)) if match else None
+    if isinstance(error, (UsageLimitExceeded, TemporarilyBlocked)) or status == 429:
+        return THROTTLED
+    if isinstance(error, AuthError) or status in (401, 403):
+        return AUTH
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, GeminiTimeoutError)) or (status or 0) >= 500:
+        return TRANSIENT
+    return OTHER
+
+
+class CircuitBreaker:
+    """单个账号的熔断器：closed -> open -> half_open -> closed/open。"""
+
+    def __init__(self, name: str, window: int = ACCOUNT_ERROR_WINDOW, max_error_rate: float = ACCOUNT_MAX_ERROR_RATE,
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = ACCOUNT_COOLDOWN_SECONDS,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN_SECONDS):
+        self.name = name
+        self.state = CLOSED
+        self.recent_results: deque[bool] = deque(maxlen=window)
+        self.max_error_rate = max_error_rate
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.trial_in_flight = False
+        self.last_failure: str | None = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.recent_results:
+            return 0.0
+        return self.recent_results.count(False) / len(self.recent_results)
+
+    def allows_request(self) -> bool:
+        """closed 时放行；open 且冷却已过时转为 half_open，只放行一个试探请求。"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() < self.opened_until:
+                return False
+            self._transition(HALF_OPEN)
+        return not self.trial_in_flight
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_until - time.monotonic()) if self.state == OPEN else 0.0
+
+    def on_request(self):
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = True
+
+    def on_request_done(self):
+        # 试探请求被取消时既不算成功也不算失败，允许下一个请求继续试探
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.recent_results.append(True)
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.cooldown = self.base_cooldown
+            self.recent_results.clear()
+            self._transition(CLOSED)
+            logger.info(f"[{self.name}] Circuit closed, account is back in rotation.")
+
+    def record_failure(self, kind: str):
+        self.recent_results.append(False)
+        self.consecutive_failures += 1
+        self.last_failure = kind
+        if self.state == HALF_OPEN:
+            self.trip(f"trial request failed ({kind})", backoff=True)
+        elif self.state == OPEN:
+            return  # 熔断前就已发出的请求，不再延长冷却
+        elif kind in (THROTTLED, AUTH):
+            self.trip(kind)
+        elif self.consecutive_failures >= self.failure_threshold:
+            self.trip(f"{self.consecutive_failures} consecutive failures ({kind})")
+        elif len(self.recent_results) >= self.recent_results.maxlen // 2 and self.error_rate > self.max_error_rate:
+            self.trip(f"error rate {self.error_rate:.0%}")
+
+    def trip(self, reason: str, backoff: bool = False):
+        if backoff:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        self.opened_until = time.monotonic() + self.cooldown
+        self.trial_in_flight = False
+        logger.warning(f"[{self.name}] Circuit opened for {self.cooldown:.0f}s: {reason}")
+        self._transition(OPEN)
+
+    def allow_trial(self):
+        """客户端重建成功后不必等冷却结束，下一个请求即作为试探请求。"""
+        if self.state == OPEN:
+            self.opened_until = 0.0
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            BREAKER_TRANSITIONS.labels(self.name, state).inc()
@@ -0,0 +1,134 @@
+# --- coalescer.py (相同请求的合并) ---
+# 同一时刻到达的完全相同的请求（模型 + 压平后的 prompt + 附件内容哈希）只向上游发一次：
+# 第一个请求在独立的任务中调用上游，之后到达的请求订阅同一个 Flight，共享上游返回的 ModelOutput 快照。
+# 上游调用不属于任何一个客户端，发起者断开连接不会影响其他订阅者；所有订阅者都离开后才取消上游调用。
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+
+from gemini_webapi import ModelOutput
+
+
+class Flight:
+    """
+    一次正在进行的上游调用。快照依次追加到 outputs（非流式调用只有一个），结束时 done 置位；
+    订阅者从头读取，因此中途加入的请求也能拿到完整的流式输出。
+    """
+
+    def __init__(self, key: str | None):
+        self.key = key
+        self.outputs: list[ModelOutput] = []
+        self.error: BaseException | None = None
+        self.done = False
+        self.subscribers = 0
+        self.conversation = None  # 上游调用结束后的 Conversation，订阅者据此保存各自的会话状态
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, output: ModelOutput):
+        self.outputs.append(output)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    async def iter_outputs(self) -> AsyncIterator[ModelOutput]:
+        """依次给出全部快照；上游失败时抛出同一个异常。"""
+        index = 0
+        while True:
+            while index < len(self.outputs):
+                yield self.outputs[index]
+                index += 1
+            if self.done:
+                if isinstance(self.error, Exception):
+                    raise self.error
+                if self.error is not None:
+                    # 上游任务被取消不能以 CancelledError 的形式传给订阅者，否则会被当成订阅者自己被取消
+                    raise RuntimeError("Upstream request was cancelled.")
+                return
+            await self._changed.wait()
+
+    async def result(self) -> ModelOutput:
+        """等待上游调用结束并返回最终结果。"""
+        last_output = None
+        async for output in self.iter_outputs():
+            last_output = output
+        return last_output
+
+
+class Subscription:
+    """一个订阅者对 Flight 的订阅。close() 可重复调用，只有第一次生效。"""
+    __slots__ = ("_coalescer", "flight", "_closed")
+
+    def __init__(self, coalescer: "RequestCoalescer", flight: Flight):
+        self._coalescer = coalescer
+        self.flight = flight
+        self._closed = False
+        flight.subscribers += 1
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._coalescer._unsubscribe(self.flight)
+
+
+class RequestCoalescer:
+    """key -> 正在进行的 Flight。key 为 None 的调用（按请求关闭了合并）同样在独立任务中运行，只是不登记。"""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key: str | None) -> Flight | None:
+        flight = self._flights.get(key) if key else None
+        if flight is not None:
+            self.followers += 1
+        return flight
+
+    def start(self, key: str | None, run: Callable[[Flight], Awaitable[None]]) -> Flight:
+        """启动上游调用。run(flight) 负责调用上游并 publish 快照，结束或失败由这里统一处理。"""
+        flight = Flight(key)
+        if key:
+            self._flights[key] = flight
+        self.leaders += 1
+        flight.task = asyncio.create_task(self._run(flight, run))
+        return flight
+
+    async def _run(self, flight: Flight, run: Callable[[Flight], Awaitable[None]]):
+        try:
+            await run(flight)
+        except BaseException as e:
+            flight.finish(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            flight.finish()
+        finally:
+            self._forget(flight)
+
+    def _forget(self, flight: Flight):
+        if flight.key and self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def subscribe(self, flight: Flight) -> Subscription:
+        return Subscription(self, flight)
+
+    def _unsubscribe(self, flight: Flight):
+        """订阅者离开。最后一个订阅者离开且上游尚未结束时取消上游调用，不再接受新的订阅。"""
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.done and flight.task is not None:
+            self._forget(flight)
+            flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {"size": len(self._flights), "hits": self.followers, "misses": self.leaders}
+
+
+request_coalescer = RequestCoalescer()
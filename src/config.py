@@ -9,6 +9,32 @@ load_dotenv()
 SECURE_1PSID = os.environ.get("SECURE_1PSID")
 SECURE_1PSIDTS = os.environ.get("SECURE_1PSIDTS")
 
+
+def _load_account_cookies() -> list[tuple[str, str]]:
+    """
+    读取多账号 Cookie。第一个账号沿用 SECURE_1PSID / SECURE_1PSIDTS，
+    其余账号依次使用 SECURE_1PSID_1 / SECURE_1PSIDTS_1、SECURE_1PSID_2 / SECURE_1PSIDTS_2 ……
+    只配置了其中一个的账号跳过并打印警告，不影响其他账号启动。
+    """
+    pairs = []
+    if SECURE_1PSID and SECURE_1PSIDTS:
+        pairs.append((SECURE_1PSID, SECURE_1PSIDTS))
+    elif SECURE_1PSID or SECURE_1PSIDTS:
+        missing = "SECURE_1PSIDTS" if SECURE_1PSID else "SECURE_1PSID"
+        print(f"Warning: {missing} is not set, skipping the primary account.")
+    index = 1
+    while os.environ.get(f"SECURE_1PSID_{index}"):
+        psidts = os.environ.get(f"SECURE_1PSIDTS_{index}")
+        if psidts:
+            pairs.append((os.environ[f"SECURE_1PSID_{index}"], psidts))
+        else:
+            print(f"Warning: SECURE_1PSIDTS_{index} is not set, skipping account SECURE_1PSID_{index}.")
+        index += 1
+    return pairs
+
+
+GEMINI_ACCOUNTS = _load_account_cookies()
+
 # "元指令Gem" 的配置
 META_GEM_NAME = "WebService_Meta_Gem_v1"
 DEFAULT_META_GEM_PROMPT  = (
@@ -25,4 +51,129 @@ SYSTEM_PROMPT_TAG_START = "<system_prompt>"
 SYSTEM_PROMPT_TAG_END = "</system_prompt>"
 PROXY_URL = os.environ.get("PROXY_URL")
 API_KEY = os.environ.get("API_KEY")
-RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", 5))
\ No newline at end of file
+
+
+def _load_api_keys() -> list[dict]:
+    """
+    读取多个 API Key（租户）。第一个沿用 API_KEY，其余依次为 API_KEY_1、API_KEY_2 ……
+    每个 Key 可选的调度参数（以 API_KEY_1 为例，第一个 Key 去掉序号即 API_KEY_WEIGHT 等）：
+      API_KEY_1_NAME             租户名，用于指标与用量报告，默认 tenant-1（第一个 Key 为 default）
+      API_KEY_1_WEIGHT           排队时的调度权重，默认 1；权重为 4 的租户在竞争时获得 4 倍的名额
+      API_KEY_1_RPM              令牌桶限速（每分钟请求数），默认 0 表示不限速
+      API_KEY_1_BURST            令牌桶容量，默认等于一分钟的配额
+      API_KEY_1_MAX_CONCURRENCY  该 Key 同时占用的并发名额上限，默认 0 表示不单独限制
+    """
+    def read(prefix: str, key: str, default_name: str) -> dict:
+        rpm = float(os.environ.get(f"{prefix}_RPM", 0))
+        return {
+            "key": key,
+            "name": os.environ.get(f"{prefix}_NAME", default_name),
+            "weight": float(os.environ.get(f"{prefix}_WEIGHT", 1)),
+            "rpm": rpm,
+            "burst": int(os.environ.get(f"{prefix}_BURST", 0)) or max(1, int(rpm)),
+            "max_concurrency": int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", 0)),
+        }
+
+    keys = []
+    if API_KEY:
+        keys.append(read("API_KEY", API_KEY, "default"))
+    index = 1
+    while os.environ.get(f"API_KEY_{index}"):
+        keys.append(read(f"API_KEY_{index}", os.environ[f"API_KEY_{index}"], f"tenant-{index}"))
+        index += 1
+    return keys
+
+
+API_KEYS = _load_api_keys()
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", 5))  # 每个请求最多尝试的次数（含第一次）
+# 重试的指数退避（带随机抖动）与总时限：超过时限后不再发起新的尝试
+RETRY_BACKOFF_BASE_SECONDS = float(os.environ.get("RETRY_BACKOFF_BASE_SECONDS", 0.5))
+RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get("RETRY_BACKOFF_MAX_SECONDS", 8))
+RETRY_DEADLINE_SECONDS = float(os.environ.get("RETRY_DEADLINE_SECONDS", 60))
+# 对冲请求：非流式请求耗时超过最近 p95 延迟（不低于 HEDGE_MIN_DELAY_SECONDS）时再发一份，取先返回的结果
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("HEDGE_MIN_DELAY_SECONDS", 2))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))  # 样本数不足时不对冲
+
+# 多账号池的健康检查配置
+ACCOUNT_ERROR_WINDOW = int(os.environ.get("ACCOUNT_ERROR_WINDOW", 20))  # 计算错误率的最近请求数
+ACCOUNT_MAX_ERROR_RATE = float(os.environ.get("ACCOUNT_MAX_ERROR_RATE", 0.5))  # 超过该错误率即移出轮转
+ACCOUNT_COOLDOWN_SECONDS = float(os.environ.get("ACCOUNT_COOLDOWN_SECONDS", 120))  # 被限流/失败后的冷却时间
+ACCOUNT_PROBE_INTERVAL = float(os.environ.get("ACCOUNT_PROBE_INTERVAL", 30))  # 后台探测不健康账号的间隔
+# 熔断器：连续多少次瞬时故障（5xx/网络错误/超时）后熔断；半开试探失败时冷却时间加倍，最长不超过该值
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_MAX_COOLDOWN_SECONDS = float(os.environ.get("BREAKER_MAX_COOLDOWN_SECONDS", 900))
+# 后台重建客户端后，旧客户端最多等待多久让在途请求结束再关闭
+CLIENT_RECYCLE_DRAIN_SECONDS = float(os.environ.get("CLIENT_RECYCLE_DRAIN_SECONDS", 300))
+# 后台续期 __Secure-1PSIDTS 与 access_token 的间隔（<=0 时改用 gemini_webapi 自带的续期），
+# 续期得到的 Cookie 保存到 COOKIE_CACHE_PATH（留空则不保存），重启后优先使用
+COOKIE_REFRESH_INTERVAL_SECONDS = float(os.environ.get("COOKIE_REFRESH_INTERVAL_SECONDS", 540))
+COOKIE_CACHE_PATH = os.environ.get("COOKIE_CACHE_PATH", "cookie_cache.json")
+# 元指令Gem ID 与模型列表的启动缓存（留空则不保存），有缓存时启动不必等待 fetch_gems / create_gem
+BOOTSTRAP_CACHE_PATH = os.environ.get("BOOTSTRAP_CACHE_PATH", "bootstrap_cache.json")
+
+# 多 worker 部署：run.py 按 WORKERS 启动多个 uvicorn worker 进程。worker 之间通过 SHARED_STORE_PATH 指定的
+# SQLite（WAL 模式）共享会话、前缀索引、上传缓存、图片短链接与限速状态；WORKERS > 1 且未设置时使用默认路径
+WORKERS = int(os.environ.get("WORKERS", 1))
+SHARED_STORE_PATH = os.environ.get("SHARED_STORE_PATH") or ("shared_state.sqlite" if WORKERS > 1 else None)
+# 共享存储被其他 worker 锁住时最多等待的毫秒数；超时按“未命中/放行”降级，不让请求排队等锁
+SHARED_STORE_BUSY_TIMEOUT_MS = int(os.environ.get("SHARED_STORE_BUSY_TIMEOUT_MS", 250))
+
+# 有状态会话缓存：session_id -> Gemini 会话 metadata (cid/rid/rcid)
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", 3600))
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 1024))
+# 消息历史前缀索引：客户端不带 session_id 时按历史前缀的哈希自动续接会话
+PREFIX_INDEX_MAX_ENTRIES = int(os.environ.get("PREFIX_INDEX_MAX_ENTRIES", 4096))
+
+# 精确匹配的响应缓存（默认关闭）：相同模型 + 相同压平后的 prompt + 相同附件内容直接返回缓存的回复
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))  # 内存 LRU 容量
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH")  # 设置后同时持久化到该 SQLite 文件，重启后仍可命中
+RESPONSE_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_DISK_MAX_ENTRIES", 10000))
+
+# 附件上传缓存：相同内容（SHA-256）的图片只上传一次，复用 Google 返回的上传 ID
+# 上传 ID 形如 /contrib_service/ttl_1d/...，Google 保留约一天，默认 TTL 略短于此
+UPLOAD_CACHE_TTL_SECONDS = float(os.environ.get("UPLOAD_CACHE_TTL_SECONDS", 23 * 3600))
+UPLOAD_CACHE_MAX_ENTRIES = int(os.environ.get("UPLOAD_CACHE_MAX_ENTRIES", 2048))
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 4))  # 单进程内同时进行的附件上传数上限
+
+# 附件默认只保存在内存里直接上传；超过该大小（字节）的附件才会写入 temp_uploads 目录
+ATTACHMENT_SPILL_BYTES = int(os.environ.get("ATTACHMENT_SPILL_BYTES", 8 * 1024 * 1024))
+TEMP_UPLOAD_DIR = "temp_uploads"
+
+# 用户图片 URL 的抓取：应用级连接池、并发上限、单张大小/超时限制与短期缓存
+IMAGE_FETCH_CONCURRENCY = int(os.environ.get("IMAGE_FETCH_CONCURRENCY", 8))
+IMAGE_FETCH_TIMEOUT_SECONDS = float(os.environ.get("IMAGE_FETCH_TIMEOUT_SECONDS", 20))
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", 20 * 1024 * 1024))
+IMAGE_FETCH_CACHE_TTL_SECONDS = float(os.environ.get("IMAGE_FETCH_CACHE_TTL_SECONDS", 300))
+IMAGE_FETCH_CACHE_BYTES = int(os.environ.get("IMAGE_FETCH_CACHE_BYTES", 64 * 1024 * 1024))
+
+# 生成图片的返回方式："url" 返回指向本服务 /v1/files/{id} 的短链接（默认），"base64" 为内联 data URI
+IMAGE_RESPONSE_MODE = os.environ.get("IMAGE_RESPONSE_MODE", "url").lower()
+# 对外可访问的服务地址（位于反向代理之后时设置），为空则使用请求中的地址
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+IMAGE_PROXY_CACHE_DIR = os.environ.get("IMAGE_PROXY_CACHE_DIR", "image_cache")
+IMAGE_PROXY_CACHE_BYTES = int(os.environ.get("IMAGE_PROXY_CACHE_BYTES", 512 * 1024 * 1024))
+IMAGE_PROXY_TTL_SECONDS = float(os.environ.get("IMAGE_PROXY_TTL_SECONDS", 24 * 3600))  # 短链接的有效期
+
+# 准入控制：同时发往上游的对话请求数上限（<=0 表示不限制），超出的请求按 API Key 分别进入有界队列排队，
+# 名额空出时按各 Key 的权重公平调度；某个 Key 的队列已满或排队超过 ADMISSION_MAX_WAIT_SECONDS 秒时
+# 直接返回 429 与 Retry-After
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", 16))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 64))  # 每个 API Key 的队列长度上限
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", 30))
+
+# Prometheus 指标：开启时在 /metrics 暴露各阶段耗时直方图、在途请求数、按模型/账号的计数与缓存命中率
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 单请求采样分析：请求头 X-Debug-Profile 与该令牌一致时，对该请求采样并输出折叠栈（火焰图）文件；留空即关闭
+DEBUG_PROFILE_TOKEN = os.environ.get("DEBUG_PROFILE_TOKEN", "")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5))
+PROFILE_MAX_CONCURRENT = int(os.environ.get("PROFILE_MAX_CONCURRENT", 2))  # 同时进行的采样会话上限
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# 仅用于本地压测：设置后所有发往 Google 的请求（初始化、Gem、上传、StreamGenerate、生图下载）
+# 都会被改写到该地址，例如 benchmarks/mock_gemini.py 启动的 mock 服务 http://127.0.0.1:8765
+GEMINI_BACKEND_URL = os.environ.get("GEMINI_BACKEND_URL", "").rstrip("/")
+if GEMINI_BACKEND_URL:
+    PROXY_URL = None  # 代理会为所有 URL 挂载自己的 transport，覆盖掉改写逻辑；mock 服务在本地也无需代理
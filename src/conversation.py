@@ -1,8 +1,16 @@
-# --- conversation.py (已移除重试的最终版) ---
+# --- conversation.py (重试与对冲请求见 retry_policy) ---
 
-from typing import List, Any
+import asyncio
+import time
+from typing import AsyncIterator, List
 
-from .gemini_client import GeminiClientManager
+from gemini_webapi import ChatSession, ModelOutput
+
+from .gemini_client import GeminiClientManager, GeminiClientPool
+from .metrics import HEDGED_REQUESTS
+from .retry_policy import is_retryable, retrying, upstream_latency
+from .session_store import SessionState
+from .attachments import Attachment
 from .config import SYSTEM_PROMPT_TAG_START, SYSTEM_PROMPT_TAG_END
 
 def is_empty_result(value) -> bool:
@@ -16,43 +24,131 @@ def is_empty_result(value) -> bool:
 
 class Conversation:
     """
-    管理一个对话会话。它完全相信底层的 client 能成功返回结果。
+    管理一个对话会话。上游失败时按 retry_policy 的策略退避重试，可选地对慢请求发出对冲请求。
+    传入上一轮保存的 SessionState 时，会在同一个账号上用旧的 metadata 续接 Gemini 会话，
+    这样只需要发送新的一轮消息，而不是整段压平后的历史。
     """
-    def __init__(self, client_manager: GeminiClientManager):
-        if not client_manager.meta_gem:
-            raise ValueError("ClientManager is not initialized or Meta Gem is missing.")
-        self.client_manager = client_manager
-        # 注意：因为你的 main.py 每次都创建新的 Conversation，
-        # 所以这个 self.metadata 在你的无状态架构下实际上不会被复用。
-        self.metadata: dict[str, Any] | None = None
+    def __init__(self, client_pool: GeminiClientPool, session: SessionState | None = None):
+        self.client_pool = client_pool
+        # 续接时使用的会话 metadata 与所属账号；发送成功后更新为本轮结束时的状态
+        self.metadata: list[str | None] | None = session.metadata if session else None
+        self.account: str | None = session.account if session else None
+
+    def _start_chat(self, client_manager: GeminiClientManager, model: str | None, user_input: str,
+                    fallback_input: str | None) -> tuple[ChatSession, str]:
+        """
+        在取到的账号上创建 chat_session，返回 (chat_session, 实际要发送的 prompt)。
+        如果原账号已不可用，旧 metadata 在别的账号上无效，只能退回到完整历史重新开一个会话。
+        """
+        metadata = self.metadata
+        prompt = user_input
+        if metadata and client_manager.name != self.account:
+            print(f"Session account '{self.account}' unavailable, falling back to full history.")
+            metadata = None
+            prompt = fallback_input or user_input
+        chat_session = client_manager.client.start_chat(
+            gem=client_manager.meta_gem.id,
+            model=model,
+            metadata=metadata
+        )
+        return chat_session, prompt
+
+    def _remember(self, client_manager: GeminiClientManager, chat_session: ChatSession):
+        self.metadata = list(chat_session.metadata)
+        self.account = client_manager.name
+
+    async def _send_once(self, client_manager: GeminiClientManager, model: str | None, user_input: str,
+                         files: List[Attachment] | None, fallback_input: str | None):
+        """在指定账号上发送一次，返回 (response, client_manager, chat_session)。"""
+        started = time.perf_counter()
+        async with self.client_pool.use(client_manager):
+            chat_session, final_prompt = self._start_chat(client_manager, model, user_input, fallback_input)
+            response = await chat_session.send_message(final_prompt, files=files)
+
+        # 检查以防万一
+        if is_empty_result(response):
+            raise Exception("Gemini returned an empty result. The monkey patch recovery might have failed.")
+        upstream_latency.record(time.perf_counter() - started)
+        return response, client_manager, chat_session
+
+    async def _send_hedged(self, model: str | None, user_input: str, files: List[Attachment] | None,
+                           fallback_input: str | None):
+        """
+        发送一次；开启对冲且耗时超过最近的 p95 延迟时，再向另一个账号发一份，取先成功的结果，另一份取消。
+        没有其他可用账号时不对冲：向同一个账号重复发送只会加重它的负担。
+        """
+        primary = self.client_pool.pick(preferred=self.account)
+        delay = upstream_latency.hedge_delay()
+        if delay is None or self.client_pool.pick_other(primary.name) is None:
+            return await self._send_once(primary, model, user_input, files, fallback_input)
+
+        tasks = [asyncio.create_task(self._send_once(primary, model, user_input, files, fallback_input))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                # 等待期间其他账号可能已被熔断
+                hedge = self.client_pool.pick_other(primary.name)
+                if hedge is not None:
+                    print(f"Request exceeded p95 latency ({delay:.1f}s), hedging on '{hedge.name}'.")
+                    tasks.append(asyncio.create_task(self._send_once(hedge, model, user_input, files, fallback_input)))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            HEDGED_REQUESTS.labels("primary" if task is tasks[0] else "hedge").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def send_message(
             self,
             user_input: str,
             # 移除了 dynamic_system_prompt，因为你的 flatten 函数已经处理了
             model: str | None = "gemini-1.5-pro",
-            files: List[str] | None = None
+            files: List[Attachment] | None = None,
+            fallback_input: str | None = None
     ):
         """
-        发送消息。没有重试，没有复杂的错误处理，就是一次直接的调用。
+        发送消息。续接会话时 user_input 只是新的一轮，fallback_input 是会话失效时改用的完整历史。
+        可安全重试的失败（见 retry_policy）会退避后重新发送，熔断器已把出问题的账号移出轮转。
         """
-        # 注意：你的 flatten 函数已经包含了 system_prompt，所以这里不再需要
-        final_prompt = user_input
+        print(f"\nSending to Gemini: Prompt: '{user_input[:100]}...', Files: {files}\n")
 
-        print(f"\nSending to Gemini (Single Attempt): Prompt: '{final_prompt[:100]}...', Files: {files}\n")
+        async for attempt in retrying():
+            with attempt:
+                response, client_manager, chat_session = await self._send_hedged(model, user_input, files,
+                                                                                 fallback_input)
+        self._remember(client_manager, chat_session)
+        return response
 
-        # 由于你的架构是无状态的，我们每次都用空的 metadata 开始一个新的 chat_session
-        chat_session = self.client_manager.client.start_chat(
-            gem=self.client_manager.meta_gem.id,
-            model=model,
-            metadata=None # 每次都是新会话
-        )
+    async def send_message_stream(
+            self,
+            user_input: str,
+            model: str | None = "gemini-1.5-pro",
+            files: List[Attachment] | None = None,
+            fallback_input: str | None = None
+    ) -> AsyncIterator[ModelOutput]:
+        """
+        流式发送消息。逐个 yield 上游返回的累积快照（ModelOutput），最后一个即为完整结果。
+        只有在还没有 yield 任何快照之前失败才会重试，已经输出的内容无法撤回。
+        """
+        print(f"\nSending to Gemini (Stream): Prompt: '{user_input[:100]}...', Files: {files}\n")
 
-        # 直接调用 send_message，并相信它会成功（因为补丁会处理失败）
-        response = await chat_session.send_message(final_prompt, files=files)
+        last_output = None
+        async for attempt in retrying(lambda error: last_output is None and is_retryable(error)):
+            with attempt:
+                async with self.client_pool.acquire(preferred=self.account) as client_manager:
+                    chat_session, final_prompt = self._start_chat(client_manager, model, user_input, fallback_input)
+                    async for output in chat_session.send_message_stream(final_prompt, files=files):
+                        last_output = output
+                        yield output
+                    self._remember(client_manager, chat_session)
 
-        # 检查以防万一
-        if is_empty_result(response):
+        if is_empty_result(last_output):
             raise Exception("Gemini returned an empty result. The monkey patch recovery might have failed.")
-
-        return response
\ No newline at end of file
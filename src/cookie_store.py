@@ -0,0 +1,70 @@
+# --- cookie_store.py (续期后的 Cookie 持久化) ---
+# 后台续期得到的新 __Secure-1PSIDTS 写入本地 JSON 文件，重启时优先使用，不必重新运行 get_cookies.py。
+# 文件按 __Secure-1PSID 记录，并记下环境变量中原本配置的 PSIDTS：换了账号，或重新运行 get_cookies.py
+# 更新了环境变量时，旧记录自然失效，以环境变量为准。
+
+import json
+import os
+import time
+
+from gemini_webapi.utils import logger
+
+from .config import COOKIE_CACHE_PATH
+
+
+def read_json(path: str | None) -> dict:
+    """读取 JSON 文件；文件不存在或损坏时返回空字典。"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+        return {}
+
+
+def write_json_atomically(path: str, data: dict):
+    """先写临时文件再替换（权限 0600），读到的文件要么是旧内容，要么是完整的新内容。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # 多个 worker 可能同时写同一个文件
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write {path}: {e}")
+
+
+class CookieStore:
+    """__Secure-1PSID -> 最近一次续期得到的 __Secure-1PSIDTS（及其来源配置）。path 为空时不持久化。"""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._entries: dict[str, dict] = read_json(path)
+
+    def reload(self):
+        """重新读取文件，拿到其他 worker 续期后写入的 Cookie。"""
+        if self.path:
+            self._entries = read_json(self.path)
+
+    def psidts_for(self, psid: str, configured_psidts: str) -> str | None:
+        """返回续期后的 PSIDTS；记录不存在或环境变量已更新时返回 None。"""
+        entry = self._entries.get(psid)
+        if not entry or entry.get("configured") != configured_psidts:
+            return None
+        return entry.get("__Secure-1PSIDTS")
+
+    def save(self, psid: str, configured_psidts: str, psidts: str | None):
+        """记录新的 PSIDTS 并原子地写回文件。"""
+        if not self.path or not psidts or psidts in (configured_psidts, self.psidts_for(psid, configured_psidts)):
+            return
+        self._entries[psid] = {"__Secure-1PSIDTS": psidts, "configured": configured_psidts,
+                               "updated": int(time.time())}
+        write_json_atomically(self.path, self._entries)
+
+
+cookie_store = CookieStore(COOKIE_CACHE_PATH)
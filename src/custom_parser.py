@@ -1,70 +1,90 @@
 # --- custom_parser.py (生图解析专家版) ---
 
-import json
+from typing import Iterator
+
 from gemini_webapi import GeneratedImage
 
+from .response_parser import ParsedResponse, decode_frame_line, decode_part_body
+
+# Google 生成图片的典型 URL 特征
+GENERATED_IMAGE_URL_PREFIX = "https://lh3.googleusercontent.com/gg/"
+# 行级预筛选用的特征串：不含斜杠，因此无论 JSON 是否把 "/" 转义成 "\/" 都能命中
+_LINE_MARKER = "lh3.googleusercontent.com"
 
-def find_generated_images_from_raw_text(raw_text: str, cookies: dict, proxy: str | None) -> list[GeneratedImage]:
+
+def find_generated_images_from_raw_text(raw_text: str, cookies: dict, proxy: str | None,
+                                        parsed: ParsedResponse | None = None) -> list[GeneratedImage]:
     """
     一个专门的解析器，只负责从原始响应文本中提取生成的图片。
+    传入主解析器的 ParsedResponse 时，复用其中已解码的帧，不再重复解码。
     """
-    generated_images = []
+    unique_images = [
+        GeneratedImage(url=url, title="[Generated Image (Recovered)]", alt="", proxy=proxy, cookies=cookies)
+        for url in iter_generated_image_urls(raw_text, parsed)
+    ]
+    if unique_images:
+        print(f"[DEBUG] Custom parser successfully recovered {len(unique_images)} generated image(s).")
+    return unique_images
+
+
+def iter_generated_image_urls(raw_text: str, parsed: ParsedResponse | None = None) -> Iterator[str]:
+    """按出现顺序逐个给出去重后的生图 URL。"""
+    seen = set()
+    for body in _iter_marked_bodies(raw_text, parsed):
+        for url in _iter_urls(body):
+            if url not in seen:
+                seen.add(url)
+                yield url
+
+
+def _iter_marked_bodies(raw_text: str, parsed: ParsedResponse | None) -> Iterator:
+    """只解码包含图片 URL 特征的行与帧部分，其余内容连切片都不做。"""
+    for line_start, line in _iter_marked_lines(raw_text):
+        if parsed is not None and line_start == parsed.line_start:
+            for i, part in enumerate(parsed.frames):
+                if _part_mentions_images(part):
+                    yield parsed.part_body(i)
+            continue
+        frame = decode_frame_line(line)
+        if frame is None:
+            continue
+        for part in frame:
+            if _part_mentions_images(part):
+                yield decode_part_body(part)
+
+
+def _iter_marked_lines(raw_text: str) -> Iterator[tuple[int, str]]:
+    """直接在原文中查找特征串，只切出命中的行，并给出其起始位置。"""
+    pos = 0
+    while True:
+        hit = raw_text.find(_LINE_MARKER, pos)
+        if hit == -1:
+            return
+        start = raw_text.rfind("\n", 0, hit) + 1
+        end = raw_text.find("\n", hit)
+        if end == -1:
+            end = len(raw_text)
+        yield start, raw_text[start:end]
+        pos = end + 1
+
+
+def _part_mentions_images(part) -> bool:
+    # part[2] 是尚未解码的内层 JSON 文本，其中的 "/" 同样可能被转义，因此用与行级预筛选相同的特征串
     try:
-        keyword = ")]}'"
-        start_index = raw_text.find(keyword)
-        if start_index == -1: return []
-
-        json_blob = raw_text[start_index:]
-        clean_text = json_blob[4:].strip() if json_blob.startswith(keyword) else json_blob
-        data = json.loads(clean_text)
-
-        # 遍历所有数据块，寻找包含 "https://lh3.googleusercontent.com/gg/" 的部分
-        # 这是 Google 生成图片的典型 URL 特征
-        for item in data:
-            if isinstance(item, list) and len(item) > 2 and isinstance(item[2], str):
-                if "https://lh3.googleusercontent.com/gg/" in item[2]:
-                    # 找到了一个可能包含图片数据块
-                    inner_data_str = item[2]
-                    inner_data = json.loads(inner_data_str)
-
-                    # 在这个数据块内部递归查找图片URL
-                    urls = _recursive_find_urls(inner_data)
-                    for url in urls:
-                        generated_images.append(
-                            GeneratedImage(
-                                url=url,
-                                title="[Generated Image (Recovered)]",
-                                alt="",
-                                proxy=proxy,
-                                cookies=cookies
-                            )
-                        )
-
-        # 去重
-        unique_images = []
-        seen_urls = set()
-        for img in generated_images:
-            if img.url not in seen_urls:
-                unique_images.append(img)
-                seen_urls.add(img.url)
-
-        if unique_images:
-            print(f"[DEBUG] Custom parser successfully recovered {len(unique_images)} generated image(s).")
-        return unique_images
-
-    except (json.JSONDecodeError, IndexError, TypeError):
-        return []
-
-
-def _recursive_find_urls(data) -> list[str]:
-    """递归辅助函数，用于在未知结构中查找所有图片URL"""
-    urls = []
-    if isinstance(data, dict):
-        for key, value in data.items():
-            urls.extend(_recursive_find_urls(value))
-    elif isinstance(data, list):
-        for item in data:
-            urls.extend(_recursive_find_urls(item))
-    elif isinstance(data, str) and data.startswith("https://lh3.googleusercontent.com/gg/"):
-        urls.append(data)
-    return urls
\ No newline at end of file
+        return isinstance(part[2], str) and _LINE_MARKER in part[2]
+    except (IndexError, TypeError, KeyError):
+        return False
+
+
+def _iter_urls(data) -> Iterator[str]:
+    """用显式栈迭代遍历未知结构，按深度优先顺序给出所有图片 URL，不构造中间列表。"""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            if node.startswith(GENERATED_IMAGE_URL_PREFIX):
+                yield node
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            stack.extend(reversed(node.values()))
@@ -2,34 +2,110 @@
 
 import asyncio
 import re
+import time
+from contextlib import asynccontextmanager
 import orjson as json
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-from gemini_webapi import GeminiClient, Gem, ModelOutput, Candidate, WebImage, GeneratedImage
+from gemini_webapi import GeminiClient, ChatSession, Gem, ModelOutput, Candidate, WebImage, GeneratedImage
 from gemini_webapi.constants import Model, Endpoint
-from gemini_webapi.utils import upload_file, parse_file_name, logger
-from gemini_webapi.exceptions import APIError, GeminiError, ImageGenerationError
+from gemini_webapi.utils import logger, rotate_1psidts
+from gemini_webapi.exceptions import (
+    APIError, GeminiError, ImageGenerationError
+)
 
 # vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv
 #
 #                   这里是唯一的、关键的修正
 #
 # vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv
-from .config import SECURE_1PSID, SECURE_1PSIDTS, META_GEM_NAME, META_GEM_PROMPT, PROXY_URL
+from .config import (
+    GEMINI_ACCOUNTS, META_GEM_NAME, META_GEM_PROMPT, PROXY_URL, ACCOUNT_PROBE_INTERVAL, CLIENT_RECYCLE_DRAIN_SECONDS,
+    COOKIE_REFRESH_INTERVAL_SECONDS
+)
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 #                         修正结束
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
 from .custom_parser import find_generated_images_from_raw_text
+from .response_parser import ParsedResponse, iter_line_bodies
+from .upload_cache import upload_cache
+from .attachments import Attachment, as_attachment
+from .backend_override import apply_backend_override
+from .metrics import ACCOUNT_REQUESTS, observe_stage, record_upstream_status, stage_timer
+from .circuit_breaker import AUTH, CircuitBreaker, UpstreamStatusError, classify_failure
+from .cookie_store import cookie_store
+from .bootstrap_cache import account_key, bootstrap_cache
+from .shared_store import shared_store
 
 original_init = GeminiClient.__init__
 
 
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r"http://googleusercontent\.com/image_generation_content/\d+")
+
+
+async def _build_generate_payload(
+        self,
+        prompt: str,
+        files: list[Attachment | str | Path] | None,
+        gem_id: str | None,
+        chat: Optional["ChatSession"],
+) -> dict:
+    """
+    构造 StreamGenerate 请求的表单数据，流式与非流式共用。
+    附件上传先并发启动，与 prompt 部分的构造重叠进行，N 张图的耗时约等于最慢的那一张。
+    """
+    attachments = [as_attachment(file) for file in files] if files else []
+    pending_uploads = upload_cache.start_uploads(attachments, self.proxy) if attachments else None
+    try:
+        file_names = [attachment.name for attachment in attachments]
+        tail = [None, chat.metadata if chat else None] + ([None] * 16 + [gem_id] if gem_id else [])
+        upload_ids = await pending_uploads if pending_uploads else []
+    except BaseException:
+        if pending_uploads:
+            pending_uploads.cancel()
+        raise
+
+    message = [prompt, 0, None, [[[upload_id], file_name] for upload_id, file_name in zip(upload_ids, file_names)]] \
+        if files else [prompt]
+    return {
+        "at": self.access_token,
+        "f.req": json.dumps([None, json.dumps([message] + tail).decode()]).decode(),
+    }
+
+
+def _build_generated_images(self, generated_image_data: list) -> list[GeneratedImage]:
+    """把候选项 [12][7][0] 中的生图数据转换为 GeneratedImage 列表。"""
+    return [GeneratedImage(url=gen_img[0][3][3],
+                           title=f"[Generated Image {gen_img[3][6]}]" if gen_img[3][6] else "[Generated Image]",
+                           alt=(gen_img[3][5][i] if gen_img[3][5] and len(gen_img[3][5]) > i else (
+                               gen_img[3][5][0] if gen_img[3][5] else "")),
+                           proxy=self.proxy, cookies=self.cookies)
+            for i, gen_img in enumerate(generated_image_data)]
+
+
+def _parse_web_images(self, candidate_data: list) -> list[WebImage]:
+    try:
+        if candidate_data[12] and candidate_data[12][1]:
+            return [WebImage(url=img[0][0][0], title=img[7][0], alt=img[0][4], proxy=self.proxy) for img
+                    in candidate_data[12][1]]
+    except (TypeError, IndexError):
+        pass
+    return []
+
+
+def _parse_thoughts(candidate_data: list) -> str | None:
+    try:
+        return candidate_data[37][0][0]
+    except (TypeError, IndexError):
+        return None
+
+
 async def patched_generate_content(
         self,
         prompt: str,
-        files: list[str | Path] | None = None,
+        files: list[Attachment | str | Path] | None = None,
         model: Model | str = Model.UNSPECIFIED,
         gem: Gem | str | None = None,
         chat: Optional["ChatSession"] = None,
@@ -39,106 +115,61 @@ async def patched_generate_content(
     gem_id = gem.id if isinstance(gem, Gem) else gem
     real_chat_session_instance = chat
 
-    response = await self.client.post(
-        Endpoint.GENERATE.value,
-        headers=model.model_header,
-        data={
-            "at": self.access_token,
-            "f.req": json.dumps(
-                [
-                    None,
-                    json.dumps(
-                        [
-                            (
-                                [
-                                    prompt, 0, None,
-                                    [[[await upload_file(file, self.proxy)], parse_file_name(file)] for file in files],
-                                ]
-                                if files else [prompt]
-                            ),
-                            None,
-                            real_chat_session_instance.metadata if real_chat_session_instance else None,
-                        ]
-                        + ([None] * 16 + [gem_id] if gem_id else [])
-                    ).decode(),
-                ]
-            ).decode(),
-        },
-        **kwargs,
-    )
+    data = await _build_generate_payload(self, prompt, files, gem_id, real_chat_session_instance)
+    with stage_timer("upstream"):
+        response = await self.client.post(Endpoint.GENERATE.value, headers=model.model_header, data=data, **kwargs)
+    record_upstream_status("generate", response.status_code)
 
     if response.status_code != 200:
-        await self.close()
-        raise APIError(f"Request failed with status code {response.status_code}")
+        # 不再关闭共享的客户端：其他并发请求仍在使用它，失败交给账号的熔断器处理
+        raise UpstreamStatusError(response.status_code)
+
+    with stage_timer("parse"):
+        output = _parse_model_output(self, response.text)
+    if real_chat_session_instance:
+        real_chat_session_instance.last_output = output
+    return output
 
-    try:
-        response_json = json.loads(response.text.split("\n")[2])
-        body = None
-        body_index = 0
-        for i, part in enumerate(response_json):
-            try:
-                main_part = json.loads(part[2])
-                if main_part and len(main_part) > 4 and main_part[4]:
-                    body = main_part
-                    body_index = i
-                    break
-            except (IndexError, TypeError, ValueError):
-                continue
 
+def _parse_model_output(self, raw_text: str) -> ModelOutput:
+    """
+    把非流式响应体解析为 ModelOutput。帧只解码一次（见 ParsedResponse），
+    生图数据块解析失败时交给自定义解析器从同一批已解码的帧中兜底。
+    """
+    try:
+        parsed = ParsedResponse(raw_text)
+        body = parsed.body
         if not body:
             raise GeminiError("Failed to find response body.")
 
         candidates = []
+        recovered_images = None
         for candidate_index, candidate_data in enumerate(body[4]):
             rcid = candidate_data[0]
             text = candidate_data[1][0]
-
-            thoughts = None
-            try:
-                thoughts = candidate_data[37][0][0]
-            except (TypeError, IndexError):
-                pass
-
-            web_images = []
-            try:
-                if candidate_data[12] and candidate_data[12][1]:
-                    web_images = [WebImage(url=img[0][0][0], title=img[7][0], alt=img[0][4], proxy=self.proxy) for img
-                                  in candidate_data[12][1]]
-            except (TypeError, IndexError):
-                pass
+            thoughts = _parse_thoughts(candidate_data)
+            web_images = _parse_web_images(self, candidate_data)
 
             generated_images = []
             image_parsing_failed = False
             try:
                 if candidate_data[12] and candidate_data[12][7] and candidate_data[12][7][0]:
-                    img_body = None
-                    for i in range(body_index, len(response_json)):
-                        try:
-                            img_part = json.loads(response_json[i][2])
-                            if img_part[4][candidate_index][12][7][0]:
-                                img_body = img_part
-                                break
-                        except (IndexError, TypeError, ValueError):
-                            continue
-                    if not img_body: raise ImageGenerationError("Could not find image data block.")
-                    img_candidate = img_body[4][candidate_index]
-                    text = re.sub(r"http://googleusercontent\.com/image_generation_content/\d+", "",
-                                  img_candidate[1][0]).rstrip()
-                    generated_images = [GeneratedImage(url=gen_img[0][3][3],
-                                                       title=f"[Generated Image {gen_img[3][6]}]" if gen_img[3][
-                                                           6] else "[Generated Image]", alt=(
-                            gen_img[3][5][i] if gen_img[3][5] and len(gen_img[3][5]) > i else (
-                                gen_img[3][5][0] if gen_img[3][5] else "")), proxy=self.proxy, cookies=self.cookies) for
-                                        i, gen_img in enumerate(img_candidate[12][7][0])]
+                    img_candidate = parsed.image_candidate(candidate_index)
+                    if not img_candidate: raise ImageGenerationError("Could not find image data block.")
+                    text = IMAGE_PLACEHOLDER_PATTERN.sub("", img_candidate[1][0]).rstrip()
+                    generated_images = _build_generated_images(self, img_candidate[12][7][0])
             except (TypeError, IndexError):
                 image_parsing_failed = True
                 logger.warning("Official parser failed on generated images. Engaging custom parser as fallback.")
 
             if image_parsing_failed:
-                recovered_images = find_generated_images_from_raw_text(response.text, self.cookies, self.proxy)
+                # 兜底结果与候选项无关，整个响应只扫描一次
+                if recovered_images is None:
+                    recovered_images = find_generated_images_from_raw_text(raw_text, self.cookies, self.proxy,
+                                                                           parsed=parsed)
                 if recovered_images:
                     generated_images = recovered_images
-                    text = re.sub(r"http://googleusercontent\.com/image_generation_content/\d+", "", text).rstrip()
+                    text = IMAGE_PLACEHOLDER_PATTERN.sub("", text).rstrip()
 
             candidate = Candidate(rcid=rcid, text=text, thoughts=thoughts, web_images=web_images,
                                   generated_images=generated_images)
@@ -147,13 +178,104 @@ async def patched_generate_content(
         if not candidates:
             raise GeminiError("No valid candidates found.")
 
-        output = ModelOutput(metadata=body[1], candidates=candidates)
-        if real_chat_session_instance:
-            real_chat_session_instance.last_output = output
-        return output
+        return ModelOutput(metadata=body[1], candidates=candidates)
 
     except Exception as e:
-        raise APIError(f"FATAL: The final fusion parser also failed. Error: {e}. Raw Response: {response.text}")
+        raise APIError(f"FATAL: The final fusion parser also failed. Error: {e}. Raw Response: {raw_text}")
+
+
+def _parse_stream_snapshot(self, body: list) -> ModelOutput | None:
+    """
+    将流式响应中的一个 body 快照解析为 ModelOutput。
+    流式帧里每个快照都是“截至目前”的完整状态，生图数据出现时就在同一个候选项里。
+    """
+    candidates = []
+    for candidate_data in body[4]:
+        try:
+            rcid = candidate_data[0]
+            text = candidate_data[1][0] or ""
+        except (TypeError, IndexError):
+            continue
+
+        generated_images = []
+        try:
+            if candidate_data[12] and candidate_data[12][7] and candidate_data[12][7][0]:
+                generated_images = _build_generated_images(self, candidate_data[12][7][0])
+                text = IMAGE_PLACEHOLDER_PATTERN.sub("", text).rstrip()
+        except (TypeError, IndexError):
+            pass
+
+        candidates.append(Candidate(rcid=rcid, text=text, thoughts=_parse_thoughts(candidate_data),
+                                    web_images=_parse_web_images(self, candidate_data),
+                                    generated_images=generated_images))
+    if not candidates:
+        return None
+    return ModelOutput(metadata=body[1], candidates=candidates)
+
+
+async def patched_generate_content_stream(
+        self,
+        prompt: str,
+        files: list[Attachment | str | Path] | None = None,
+        model: Model | str = Model.UNSPECIFIED,
+        gem: Gem | str | None = None,
+        chat: Optional["ChatSession"] = None,
+        **kwargs,
+) -> AsyncIterator[ModelOutput]:
+    """
+    真正的流式生成：边读取 StreamGenerate 的响应边解析帧，每解析出一个新的 body 快照就 yield 一次 ModelOutput。
+    快照是累积的（text 为截至当前的全文），由调用方自行计算增量。
+    """
+    if not isinstance(model, Model): model = Model.from_name(model)
+    gem_id = gem.id if isinstance(gem, Gem) else gem
+    data = await _build_generate_payload(self, prompt, files, gem_id, chat)
+
+    raw_lines: list[str] = []
+    last_output: ModelOutput | None = None
+    started = time.perf_counter()
+    async with self.client.stream("POST", Endpoint.GENERATE.value, headers=model.model_header, data=data,
+                                  **kwargs) as response:
+        record_upstream_status("generate", response.status_code)
+        if response.status_code != 200:
+            raise UpstreamStatusError(response.status_code)
+
+        async for line in response.aiter_lines():
+            if not raw_lines:
+                observe_stage("upstream_first_byte", time.perf_counter() - started)
+            raw_lines.append(line)
+            # 帧格式为 ")]}'" 前缀后交替出现的 <长度> 行与 JSON 数组行，只有 JSON 行需要解析
+            parse_started = time.perf_counter()
+            outputs = [output for output in (_parse_stream_snapshot(self, body) for body in iter_line_bodies(line))
+                       if output]
+            # 长度行与不含快照的帧不计入，否则解析耗时的分布会被大量近乎为零的样本拉低
+            if outputs:
+                observe_stage("parse", time.perf_counter() - parse_started)
+            for output in outputs:
+                last_output = output
+                yield output
+    observe_stage("upstream", time.perf_counter() - started)
+
+    if not last_output:
+        raise APIError(f"FATAL: No response body found in stream. Raw Response: {chr(10).join(raw_lines)}")
+
+    # 流结束时若仍残留生图占位符却没有解析出图片，则交给自定义解析器兜底
+    if IMAGE_PLACEHOLDER_PATTERN.search(last_output.text) and not last_output.images:
+        recovered_images = find_generated_images_from_raw_text("\n".join(raw_lines), self.cookies, self.proxy)
+        if recovered_images:
+            candidate = last_output.candidates[last_output.chosen]
+            candidate.generated_images = recovered_images
+            candidate.text = IMAGE_PLACEHOLDER_PATTERN.sub("", candidate.text).rstrip()
+            yield last_output
+
+    if chat:
+        chat.last_output = last_output
+
+
+async def patched_send_message_stream(self, prompt: str, files: list[Attachment | str | Path] | None = None,
+                                      **kwargs) -> AsyncIterator[ModelOutput]:
+    async for output in self.geminiclient.generate_content_stream(
+            prompt=prompt, files=files, model=self.model, gem=self.gem, chat=self, **kwargs):
+        yield output
 
 
 def patched_init(self, *args, **kwargs):
@@ -162,34 +284,382 @@ def patched_init(self, *args, **kwargs):
 
 GeminiClient.__init__ = patched_init
 GeminiClient.generate_content = patched_generate_content
+GeminiClient.generate_content_stream = patched_generate_content_stream
+ChatSession.send_message_stream = patched_send_message_stream
+
+apply_backend_override()
 
 print("[INFO] ULTIMATE FUSION MONKEY PATCH APPLIED. Image history and image generation are now robustly supported.")
 
 
+class NoAvailableAccountError(GeminiError):
+    """账号池中没有任何可用（已就绪且未熔断）的账号。retry_after 为最早恢复试探的秒数。"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# 多 worker 部署时协调启动引导与 Gem 校验的租约时长（秒）
+_BOOTSTRAP_LEASE_SECONDS = 60
+_META_GEM_VALIDATE_LEASE_SECONDS = 300
+
+
 class GeminiClientManager:
-    """这个类保持不变。"""
+    """
+    负责单个账号的 GeminiClient 生命周期和“元指令Gem”，并记录该账号的负载与健康状况。
+    上游失败不会关闭正在使用的客户端：失败交给熔断器处理，确实需要重建时在后台新建一个客户端，
+    初始化完成后原子地替换，旧客户端等在途请求结束后再关闭。
+    """
 
-    def __init__(self, psid: str, psidts: str):
+    def __init__(self, psid: str, psidts: str, name: str = "account-0"):
         if not psid or not psidts:
             raise ValueError("Cookies missing.")
-        self.client = GeminiClient(secure_1psid=psid, secure_1psidts=psidts, proxy=PROXY_URL)
+        self.name = name
+        self.psid = psid
+        self.configured_psidts = psidts
+        # 上次运行时续期得到的 PSIDTS 比环境变量里的更新
+        stored_psidts = cookie_store.psidts_for(psid, psidts)
+        if stored_psidts:
+            print(f"[{name}] Using refreshed __Secure-1PSIDTS from {cookie_store.path}.")
+        self.client = self._new_client(psid, stored_psidts or psidts)
         self.meta_gem: Gem | None = None
+        self.ready = False  # 客户端已初始化且元指令Gem就绪
+        self.breaker = CircuitBreaker(name)
+        self.in_flight = 0
+        # 每个客户端对象上的在途请求数：换上新客户端后，旧客户端只需等它自己的请求结束即可关闭
+        self._client_in_flight: dict[GeminiClient, int] = {}
+        self._draining: set[asyncio.Task] = set()
+        self.total_requests = 0
+        self.total_errors = 0
+        self.recycles = 0
+        self.refreshes = 0
+        self.last_refresh: float | None = None
+        self._recycle_task: asyncio.Task | None = None
+        self._validate_task: asyncio.Task | None = None
+
+    @staticmethod
+    def _new_client(psid: str, psidts: str | None) -> GeminiClient:
+        return GeminiClient(secure_1psid=psid, secure_1psidts=psidts, proxy=PROXY_URL)
+
+    async def _init_client(self, client: GeminiClient, verbose: bool = True):
+        # 由 GeminiClientPool 的后台任务负责续期时关闭库自带的自动续期：
+        # 库自带的续期只改写 client.cookies，既不更新 httpx 连接里的 Cookie，也不更新 access_token
+        await client.init(auto_refresh=COOKIE_REFRESH_INTERVAL_SECONDS <= 0, verbose=verbose)
+        cookie_store.save(self.psid, self.configured_psidts, client.cookies.get("__Secure-1PSIDTS"))
+
+    async def _find_meta_gem(self, client: GeminiClient) -> Gem:
+        """找到（或创建）元指令Gem，并写入启动缓存。"""
+        print(f"[{self.name}] Checking for Meta Gem: '{META_GEM_NAME}'...")
+        await client.fetch_gems()
+        meta_gem = client.gems.get(name=META_GEM_NAME)
+        if not meta_gem:
+            print(f"[{self.name}] Meta Gem not found. Creating a new one...")
+            meta_gem = await client.create_gem(name=META_GEM_NAME, prompt=META_GEM_PROMPT)
+        await bootstrap_cache.save(self.psid, meta_gem)
+        return meta_gem
+
+    async def _bootstrap(self, client: GeminiClient) -> Gem:
+        """初始化客户端并找到（或创建）元指令Gem。"""
+        print(f"[{self.name}] Initializing Gemini client...")
+        await self._init_client(client)
+        print(f"[{self.name}] Client initialized successfully.")
+        return await self._find_meta_gem(client)
 
     async def initialize(self):
-        print("Initializing Gemini client...")
-        await self.client.init()
-        print("Client initialized successfully.")
-        print(f"Checking for Meta Gem: '{META_GEM_NAME}'...")
-        await self.client.fetch_gems()
-        existing_gem = self.client.gems.get(name=META_GEM_NAME)
-        if existing_gem:
-            self.meta_gem = existing_gem
+        """
+        启动缓存中有该账号的元指令Gem 时，客户端初始化完成即可开始服务，Gem 是否仍然存在交给后台校验；
+        否则按原流程查找或创建 Gem 后才就绪。
+        """
+        cached_gem = await bootstrap_cache.meta_gem_for(self.psid) or await self._wait_for_peer_bootstrap()
+        if cached_gem is None:
+            try:
+                self.meta_gem = await self._bootstrap(self.client)
+            finally:
+                await shared_store.release_lease(self._lease("bootstrap"))
+        else:
+            print(f"[{self.name}] Initializing Gemini client (cached Meta Gem {cached_gem.id})...")
+            await self._init_client(self.client)
+            self.meta_gem = cached_gem
+            # 多个 worker 同时启动时只由一个 worker 校验
+            if await shared_store.acquire_lease(self._lease("validate"), _META_GEM_VALIDATE_LEASE_SECONDS):
+                self._validate_task = asyncio.create_task(self._validate_meta_gem())
+        self.ready = True
+
+    def _lease(self, action: str) -> str:
+        return f"{action}:{account_key(self.psid)}"
+
+    async def _wait_for_peer_bootstrap(self) -> Gem | None:
+        """
+        多 worker 部署时只让取得租约的 worker 查找/创建元指令Gem，其余 worker 等它写入共享存储后直接使用，
+        避免 N 个 worker 同时 fetch_gems，甚至各自创建出一个同名 Gem。返回 None 表示由自己完成引导。
+        持有租约的 worker 崩溃时，租约过期后由下一个 worker 接手。
+        """
+        lease = self._lease("bootstrap")
+        while not await shared_store.acquire_lease(lease, _BOOTSTRAP_LEASE_SECONDS):
+            await asyncio.sleep(0.5)
+            cached_gem = await bootstrap_cache.meta_gem_for(self.psid)
+            if cached_gem is not None:
+                return cached_gem
+        # 取得租约时上一个持有者可能刚好完成
+        cached_gem = await bootstrap_cache.meta_gem_for(self.psid)
+        if cached_gem is not None:
+            await shared_store.release_lease(lease)
+        return cached_gem
+
+    async def _validate_meta_gem(self):
+        """后台确认缓存的元指令Gem 仍然存在；已被删除时换成重新找到或创建的 Gem。"""
+        try:
+            meta_gem = await self._find_meta_gem(self.client)
+        except Exception as e:
+            logger.warning(f"[{self.name}] Failed to validate cached Meta Gem, keeping it for now: {e!r}")
+            return
+        if meta_gem.id != self.meta_gem.id:
+            logger.warning(f"[{self.name}] Cached Meta Gem {self.meta_gem.id} is gone, switched to {meta_gem.id}.")
+        self.meta_gem = meta_gem
+
+    @property
+    def error_rate(self) -> float:
+        return self.breaker.error_rate
+
+    @property
+    def available(self) -> bool:
+        return self.ready and self.client.running and self.breaker.allows_request()
+
+    @property
+    def recycling(self) -> bool:
+        return self._recycle_task is not None and not self._recycle_task.done()
+
+    def _current_cookies(self) -> tuple[str, str | None]:
+        return self.psid, self.client.cookies.get("__Secure-1PSIDTS")
+
+    def schedule_recycle(self, reason: str):
+        """在后台重建客户端，不阻塞当前流量；已经在重建或续期时忽略。"""
+        if not self.recycling:
+            self._recycle_task = asyncio.create_task(self._recycle(reason))
+
+    def schedule_refresh(self):
+        """在后台续期 Cookie 与 access_token；客户端尚未就绪或正在重建时跳过这一轮。"""
+        if self.ready and not self.recycling:
+            self._recycle_task = asyncio.create_task(self._refresh())
+
+    async def _recycle(self, reason: str):
+        logger.warning(f"[{self.name}] Recycling Gemini client in background: {reason}")
+        client = self._new_client(*self._current_cookies())
+        try:
+            meta_gem = await self._bootstrap(client)
+        except Exception as e:
+            await client.close()
+            self.breaker.trip(f"client recycle failed ({e})", backoff=True)
+            return
+        self.recycles += 1
+        self.breaker.allow_trial()
+        print(f"[{self.name}] Gemini client recycled.")
+        self._swap(client, meta_gem)
+
+    async def _refresh(self):
+        """
+        续期 __Secure-1PSIDTS，再用新的 Cookie 初始化一个客户端（同时拿到新的 access_token），
+        完成后原子地替换当前客户端。元指令Gem 属于账号本身，沿用即可。
+        续期期间请求照常使用旧客户端；续期失败时保留旧客户端，Cookie 被拒绝（401）时熔断该账号。
+        """
+        psid, psidts = self._current_cookies()
+        client = None
+        try:
+            # 多 worker 部署时每个周期只由一个 worker 续期 PSIDTS，其余 worker 使用它保存下来的结果
+            rotated = None
+            if await shared_store.acquire_lease(self._lease("refresh"), COOKIE_REFRESH_INTERVAL_SECONDS / 2):
+                rotated = await rotate_1psidts({"__Secure-1PSID": psid, "__Secure-1PSIDTS": psidts}, PROXY_URL)
+            elif shared_store.enabled:
+                cookie_store.reload()
+            psidts = rotated or cookie_store.psidts_for(psid, self.configured_psidts) or psidts
+            client = self._new_client(psid, psidts)
+            await self._init_client(client, verbose=False)
+        except Exception as e:
+            if client is not None:
+                await client.close()
+            if classify_failure(e) == AUTH:
+                self.breaker.trip(f"cookie refresh rejected ({e})", backoff=True)
+            else:
+                logger.warning(f"[{self.name}] Cookie refresh failed, keeping the current client: {e!r}")
+            return
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        logger.debug(f"[{self.name}] Cookies and access token refreshed.")
+        self._swap(client, self.meta_gem)
+
+    def _swap(self, client: GeminiClient, meta_gem: Gem):
+        """
+        原子地换上新客户端：之后开始的请求都使用它，已经开始的请求继续使用旧客户端直到结束。
+        旧客户端在独立的任务中等待关闭，重建/续期任务随即结束，不会挡住之后的重建与续期。
+        """
+        old_client, self.client, self.meta_gem = self.client, client, meta_gem
+        self.ready = True
+        task = asyncio.create_task(self._close_when_drained(old_client))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    def begin_request(self) -> GeminiClient:
+        """登记一个即将使用当前客户端的请求，返回该客户端；请求结束时以同一个客户端调用 end_request。"""
+        client = self.client
+        self.in_flight += 1
+        self._client_in_flight[client] = self._client_in_flight.get(client, 0) + 1
+        return client
+
+    def end_request(self, client: GeminiClient):
+        self.in_flight -= 1
+        remaining = self._client_in_flight.get(client, 0) - 1
+        if remaining > 0:
+            self._client_in_flight[client] = remaining
         else:
-            print("Meta Gem not found. Creating a new one...")
-            self.meta_gem = await self.client.create_gem(name=META_GEM_NAME, prompt=META_GEM_PROMPT)
+            self._client_in_flight.pop(client, None)
+
+    async def _close_when_drained(self, client: GeminiClient):
+        """旧客户端上可能还有在途请求，等它们结束（最多 CLIENT_RECYCLE_DRAIN_SECONDS 秒）后再关闭。"""
+        deadline = time.monotonic() + CLIENT_RECYCLE_DRAIN_SECONDS
+        try:
+            while self._client_in_flight.get(client) and time.monotonic() < deadline:
+                await asyncio.sleep(1)
+        finally:
+            await client.close()
+
+    def record_success(self):
+        self.total_requests += 1
+        self.breaker.record_success()
+        ACCOUNT_REQUESTS.labels(self.name, "success").inc()
+
+    def record_failure(self, error: Exception):
+        kind = classify_failure(error)
+        self.total_requests += 1
+        self.total_errors += 1
+        self.breaker.record_failure(kind)
+        ACCOUNT_REQUESTS.labels(self.name, kind).inc()
+        if kind == AUTH:
+            self.schedule_recycle(f"authentication failed ({error})")
+        elif not self.client.running:
+            self.schedule_recycle("client is no longer running")
+
+    def stats(self) -> dict:
+        return {"name": self.name, "healthy": self.available, "breaker": self.breaker.state,
+                "in_flight": self.in_flight, "error_rate": round(self.error_rate, 3),
+                "total_requests": self.total_requests, "total_errors": self.total_errors, "recycles": self.recycles,
+                "refreshes": self.refreshes, "last_refresh": self.last_refresh}
 
     async def close(self):
+        for task in (self._recycle_task, self._validate_task, *self._draining):
+            if task:
+                task.cancel()
+        # 正在等待关闭的旧客户端在任务取消时立即关闭
+        await asyncio.gather(*self._draining, return_exceptions=True)
         if self.client: await self.client.close()
 
 
-gemini_manager = GeminiClientManager(SECURE_1PSID, SECURE_1PSIDTS)
\ No newline at end of file
+class GeminiClientPool:
+    """
+    多账号池：每个账号一个 GeminiClientManager（各自拥有自己的元指令Gem）。
+    请求总是派发给当前在途请求最少的可用账号；熔断中的账号不接收请求，
+    初始化失败或客户端已关闭的账号由后台任务定期重建。
+    """
+
+    def __init__(self, accounts: list[tuple[str, str]]):
+        if not accounts:
+            raise ValueError("Cookies missing.")
+        self.managers = [GeminiClientManager(psid, psidts, name=f"account-{i}")
+                         for i, (psid, psidts) in enumerate(accounts)]
+        self._probe_task: asyncio.Task | None = None
+        self._refresh_task: asyncio.Task | None = None
+
+    async def initialize(self):
+        results = await asyncio.gather(*(manager.initialize() for manager in self.managers), return_exceptions=True)
+        for manager, result in zip(self.managers, results):
+            if isinstance(result, Exception):
+                manager.breaker.trip(f"initialization failed ({result})")
+        if not any(manager.available for manager in self.managers):
+            raise NoAvailableAccountError("All Gemini accounts failed to initialize.")
+        print(f"Account pool ready: {sum(m.available for m in self.managers)}/{len(self.managers)} account(s) healthy.")
+        self._probe_task = asyncio.create_task(self._probe_loop())
+        if COOKIE_REFRESH_INTERVAL_SECONDS > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    def get(self, name: str | None) -> GeminiClientManager | None:
+        return next((manager for manager in self.managers if manager.name == name), None)
+
+    def is_available(self, name: str | None) -> bool:
+        manager = self.get(name)
+        return bool(manager and manager.available)
+
+    def ensure_available(self):
+        """没有任何可用账号时立即抛出 NoAvailableAccountError，用于在排队之前快速返回 503。"""
+        if not any(manager.available for manager in self.managers):
+            retry_after = min((m.breaker.retry_after() for m in self.managers if m.breaker.retry_after()),
+                              default=ACCOUNT_PROBE_INTERVAL)
+            raise NoAvailableAccountError("No healthy Gemini account is available right now.", retry_after)
+
+    def pick(self, preferred: str | None = None) -> GeminiClientManager:
+        """
+        选出在途请求最少的可用账号，平局时优先错误率更低的。
+        续接已有会话时会优先使用 preferred 指定的账号（会话 metadata 只在该账号上有效）。
+        """
+        if preferred and self.is_available(preferred):
+            return self.get(preferred)
+        candidates = [manager for manager in self.managers if manager.available]
+        if not candidates:
+            self.ensure_available()
+        return min(candidates, key=lambda m: (m.in_flight, m.error_rate))
+
+    def pick_other(self, exclude: str) -> GeminiClientManager | None:
+        """对冲用：在 exclude 以外的可用账号中选出在途请求最少的；没有其他可用账号时返回 None。"""
+        candidates = [manager for manager in self.managers if manager.available and manager.name != exclude]
+        return min(candidates, key=lambda m: (m.in_flight, m.error_rate), default=None)
+
+    @asynccontextmanager
+    async def acquire(self, preferred: str | None = None) -> AsyncIterator[GeminiClientManager]:
+        async with self.use(self.pick(preferred)) as manager:
+            yield manager
+
+    @asynccontextmanager
+    async def use(self, manager: GeminiClientManager) -> AsyncIterator[GeminiClientManager]:
+        """在选定的账号上执行一次上游调用，记录在途数与结果（成功/失败）。"""
+        client = manager.begin_request()
+        manager.breaker.on_request()
+        try:
+            yield manager
+        except Exception as e:
+            manager.record_failure(e)
+            raise
+        else:
+            manager.record_success()
+        finally:
+            manager.end_request(client)
+            manager.breaker.on_request_done()
+
+    async def _probe_loop(self):
+        """后台检查：初始化失败或客户端已关闭的账号，在熔断冷却结束后重建客户端。"""
+        while True:
+            await asyncio.sleep(ACCOUNT_PROBE_INTERVAL)
+            for manager in self.managers:
+                if manager.recycling or manager.breaker.retry_after():
+                    continue
+                if not manager.ready:
+                    manager.schedule_recycle("initialization retry")
+                elif not manager.client.running:
+                    manager.schedule_recycle("client is no longer running")
+
+    async def _refresh_loop(self):
+        """后台定期续期各账号的 Cookie 与 access_token，在 access_token 过期之前换上新客户端。"""
+        while True:
+            await asyncio.sleep(COOKIE_REFRESH_INTERVAL_SECONDS)
+            for manager in self.managers:
+                manager.schedule_refresh()
+
+    def stats(self) -> list[dict]:
+        return [manager.stats() for manager in self.managers]
+
+    async def close(self):
+        for task in (self._probe_task, self._refresh_task):
+            if task:
+                task.cancel()
+        await asyncio.gather(*(manager.close() for manager in self.managers), return_exceptions=True)
+
+
+gemini_pool = GeminiClientPool(GEMINI_ACCOUNTS)
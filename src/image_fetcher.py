@@ -0,0 +1,76 @@
+# --- image_fetcher.py (用户图片 URL 抓取) ---
+
+import asyncio
+
+import aiohttp
+from cachetools import TTLCache
+
+from .config import (
+    IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT_SECONDS, IMAGE_FETCH_MAX_BYTES, IMAGE_FETCH_CACHE_TTL_SECONDS,
+    IMAGE_FETCH_CACHE_BYTES
+)
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+class ImageFetcher:
+    """
+    抓取用户消息中的远程图片。
+    整个应用共用一个 aiohttp 会话（在 lifespan 中创建），复用连接并缓存 DNS；
+    并发数、单张大小和超时都有上限，最近抓过的公开图片在短时间内直接从缓存返回。
+    """
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self._slots = asyncio.Semaphore(max(1, IMAGE_FETCH_CONCURRENCY))
+        # 缓存容量按字节计算：url -> (内容, Content-Type)
+        self._cache: TTLCache[str, tuple[bytes, str]] = TTLCache(
+            maxsize=IMAGE_FETCH_CACHE_BYTES, ttl=IMAGE_FETCH_CACHE_TTL_SECONDS, getsizeof=lambda item: len(item[0]))
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=IMAGE_FETCH_CONCURRENCY * 2, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=IMAGE_FETCH_TIMEOUT_SECONDS),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str) -> tuple[bytes, str]:
+        """返回 (图片字节, Content-Type)。超过 IMAGE_FETCH_MAX_BYTES 时抛出 ImageTooLargeError。"""
+        cached = self._cache.get(url)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        if self._session is None:
+            await self.start()
+        async with self._slots:
+            async with self._session.get(url) as resp:
+                resp.raise_for_status()
+                if resp.content_length and resp.content_length > IMAGE_FETCH_MAX_BYTES:
+                    raise ImageTooLargeError(f"Image at {url} exceeds {IMAGE_FETCH_MAX_BYTES} bytes.")
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    buffer.extend(chunk)
+                    if len(buffer) > IMAGE_FETCH_MAX_BYTES:
+                        raise ImageTooLargeError(f"Image at {url} exceeds {IMAGE_FETCH_MAX_BYTES} bytes.")
+                result = (bytes(buffer), resp.headers.get('Content-Type', ''))
+
+        if len(result[0]) <= self._cache.maxsize:
+            self._cache[url] = result
+        return result
+
+    def stats(self) -> dict:
+        return {"cached_bytes": self._cache.currsize, "hits": self.hits, "misses": self.misses}
+
+
+image_fetcher = ImageFetcher()
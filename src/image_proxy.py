@@ -0,0 +1,161 @@
+# --- image_proxy.py (生成图片代理) ---
+
+import hashlib
+import os
+from typing import AsyncIterator
+
+import aiofiles
+import httpx
+from cachetools import TTLCache
+
+from .config import PROXY_URL, IMAGE_PROXY_CACHE_DIR, IMAGE_PROXY_CACHE_BYTES, IMAGE_PROXY_TTL_SECONDS
+from .backend_override import upstream_client_kwargs
+from .metrics import record_upstream_status
+from .shared_store import shared_store
+
+
+class ImageNotFoundError(KeyError):
+    pass
+
+
+def _cookie_header(cookies: dict | None) -> dict | None:
+    # 生成的图片需要带上生成它的那个账号的 Cookie 才能下载
+    if not cookies:
+        return None
+    return {"Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items())}
+
+
+class ImageProxy:
+    """
+    把上游图片 URL 登记为短 ID，通过 /v1/files/{id} 以流的方式转发图片字节，
+    这样回复里只需要携带短链接，不必把整张图 base64 内联进 JSON。
+    所有下载共用一个带连接池的 httpx 客户端；转发过的图片会写入一个按总字节数做 LRU 淘汰的磁盘缓存。
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_PROXY_CACHE_DIR, cache_bytes: int = IMAGE_PROXY_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self._client: httpx.AsyncClient | None = None
+        # file_id -> (上游 URL, Cookie)
+        self._registry: TTLCache[str, tuple[str, dict | None]] = TTLCache(maxsize=10000, ttl=IMAGE_PROXY_TTL_SECONDS)
+        # 磁盘缓存的命中统计
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._client is None:
+            self._client = httpx.AsyncClient(proxy=PROXY_URL, timeout=30.0, follow_redirects=True,
+                                             limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+                                             **upstream_client_kwargs())
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("ImageProxy is not started.")
+        return self._client
+
+    async def register(self, url: str, cookies: dict | None = None) -> str:
+        file_id = hashlib.sha256(url.encode()).hexdigest()[:32]
+        self._registry[file_id] = (url, cookies)
+        if shared_store.enabled:
+            # 短链接可能由另一个 worker 处理
+            await shared_store.set("image_proxy", file_id, [url, cookies], ttl=self._registry.ttl,
+                                   max_entries=self._registry.maxsize)
+        return file_id
+
+    async def fetch_bytes(self, url: str, cookies: dict | None = None) -> tuple[bytes, str]:
+        """一次性下载整张图片，用于内联 base64 模式。"""
+        response = await self.client.get(url, headers=_cookie_header(cookies))
+        record_upstream_status("image", response.status_code)
+        response.raise_for_status()
+        return response.content, response.headers.get("content-type", "image/png")
+
+    def _cache_paths(self, file_id: str) -> tuple[str, str]:
+        path = os.path.join(self.cache_dir, file_id)
+        return path, path + ".type"
+
+    def cached(self, file_id: str) -> tuple[str, str] | None:
+        """磁盘缓存命中时返回 (文件路径, Content-Type)，并刷新其访问时间。"""
+        data_path, type_path = self._cache_paths(file_id)
+        try:
+            with open(type_path) as f:
+                content_type = f.read().strip()
+            os.utime(data_path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data_path, content_type
+
+    async def open_upstream(self, file_id: str) -> httpx.Response:
+        """打开上游图片的流式响应，调用方在读完后负责关闭。"""
+        entry = self._registry.get(file_id)
+        if entry is None and shared_store.enabled:
+            entry = await shared_store.get("image_proxy", file_id)
+        if entry is None:
+            raise ImageNotFoundError(file_id)
+        url, cookies = entry
+        request = self.client.build_request("GET", url, headers=_cookie_header(cookies))
+        response = await self.client.send(request, stream=True)
+        record_upstream_status("image", response.status_code)
+        if response.status_code != 200:
+            await response.aclose()
+            raise httpx.HTTPStatusError(f"Upstream image returned {response.status_code}",
+                                        request=request, response=response)
+        return response
+
+    async def relay(self, file_id: str, response: httpx.Response) -> AsyncIterator[bytes]:
+        """边转发边写入磁盘缓存；完整读完才会把临时文件换成正式缓存文件。"""
+        data_path, type_path = self._cache_paths(file_id)
+        temp_path = f"{data_path}.{os.getpid()}.{id(response)}.part"
+        completed = False
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    await f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            await response.aclose()
+            if completed:
+                with open(type_path, "w") as f:
+                    f.write(response.headers.get("content-type", "image/png"))
+                os.replace(temp_path, data_path)
+                self._evict()
+            else:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到缓存总字节数不超过上限。"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith((".type", ".part")) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.cache_bytes:
+                break
+            for stale in (path, path + ".type"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self) -> dict:
+        return {"size": len(self._registry), "hits": self.hits, "misses": self.misses}
+
+
+image_proxy = ImageProxy()
@@ -1,98 +1,299 @@
 import uuid
+import hashlib
 import time
 import json
 import base64
-import aiohttp
-import aiofiles
+import asyncio
 import os
+import weakref
 from contextlib import asynccontextmanager
 import httpx
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 
-from .config import API_KEY, PROXY_URL, SYSTEM_PROMPT_TAG_START, SYSTEM_PROMPT_TAG_END
-from .gemini_client import gemini_manager
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .config import (
+    API_KEYS, SYSTEM_PROMPT_TAG_START, SYSTEM_PROMPT_TAG_END, TEMP_UPLOAD_DIR, IMAGE_RESPONSE_MODE, PUBLIC_BASE_URL,
+    METRICS_ENABLED, IMAGE_PROXY_TTL_SECONDS
+)
+from .gemini_client import gemini_pool, IMAGE_PLACEHOLDER_PATTERN, NoAvailableAccountError
 from .conversation import Conversation
+from .session_store import ACTIVE_SESSIONS, CONVERSATION_PREFIXES, SessionState
+from .response_cache import response_cache, hash_attachments, ResponseCache
+from .upload_cache import upload_cache
+from .attachments import Attachment, cleanup_attachments, purge_stale_temp_uploads
+from .image_fetcher import image_fetcher
+from .image_proxy import image_proxy, ImageNotFoundError
+from .admission import admission, AdmissionRejected, AdmissionSlot
+from .tenants import ANONYMOUS_TENANT, Tenant, find_tenant
+from .coalescer import Flight, Subscription, request_coalescer
+from .retry_policy import upstream_latency
+from .shared_store import shared_store
+from .metrics import (
+    CHAT_ERRORS, CHAT_REQUESTS, MetricsMiddleware, ServerTimingMiddleware, model_label, observe_stage,
+    register_state_collector, stage_timer
+)
+from .profiler import ProfilingMiddleware, is_valid_profile_id, profile_path
 from .models import (
     ChatCompletionRequest, ChatCompletionResponse, ChatCompletionMessage,
-    ChatCompletionChoice, ModelList, ModelCard, TextContentBlock,
+    ChatCompletionChoice, ChatMessage, ModelList, ModelCard, TextContentBlock,
     ImageContentBlock, Content, ImageUrl
 )
 
 
-# (修改) 移除所有会话缓存逻辑
-# ACTIVE_SESSIONS: TTLCache[str, Conversation] = TTLCache(maxsize=1024, ttl=3600)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    os.makedirs("temp_uploads", exist_ok=True)
-    await gemini_manager.initialize()
+    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+    purge_stale_temp_uploads()
+    await image_fetcher.start()
+    await image_proxy.start()
+    await gemini_pool.initialize()
     yield
-    await gemini_manager.close()
+    await gemini_pool.close()
+    await upload_cache.close()
+    await image_fetcher.close()
+    await image_proxy.close()
+    response_cache.close()
+    shared_store.close()
 
 
 app = FastAPI(lifespan=lifespan, title="Catfish API", version="1.2.2 Final")
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 auth_scheme = HTTPBearer()
+register_state_collector(gemini_pool, {
+    "sessions": ACTIVE_SESSIONS, "conversation_prefixes": CONVERSATION_PREFIXES, "responses": response_cache,
+    "uploads": upload_cache, "image_fetch": image_fetcher, "image_proxy": image_proxy,
+    "inflight_requests": request_coalescer,
+}, admission)
+
+
+async def verify_key(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> Tenant:
+    """校验 Bearer Key 并返回它对应的租户；未配置任何 API Key 时不做鉴权。"""
+    if not API_KEYS: return ANONYMOUS_TENANT
+    tenant = find_tenant(credentials.credentials) if credentials.scheme == "Bearer" else None
+    if tenant is None: raise HTTPException(status_code=401,
+                                           detail="Incorrect bearer token",
+                                           headers={
+                                               "WWW-Authenticate": "Bearer"})
+    return tenant
+
+
+def _stream_chunk(response_id: str, created: int, model: str, delta: dict, finish_reason: str | None = None) -> str:
+    started = time.perf_counter()
+    chunk = {"id": response_id, "object": "chat.completion.chunk", "created": created, "model": model,
+             "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    data = f"data: {json.dumps(chunk)}\n\n"
+    observe_stage("serialize", time.perf_counter() - started)
+    return data
+
+
+def _json_response(payload: ChatCompletionResponse, headers: dict) -> Response:
+    """非流式回复在这里完成序列化（而不是交给 FastAPI），以便计入 serialize 阶段的耗时。"""
+    with stage_timer("serialize"):
+        body = payload.model_dump_json()
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _retry_after_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, int(seconds + 0.999)))}
+
+
+def _stable_text(text: str) -> str:
+    """
+    返回当前可以安全下发的文本前缀。
+    末尾尚未写完的 URL（例如还没收全的生图占位符）会在后续快照中被替换掉，先扣住不发。
+    """
+    text = IMAGE_PLACEHOLDER_PATTERN.sub("", text)
+    tail_start = max(text.rfind(" "), text.rfind("\n")) + 1
+    if text[tail_start:].startswith("http"):
+        return text[:tail_start]
+    return text
+
+
+async def cached_stream_response_generator(content: Content, model: str):
+    """缓存命中时一次性下发完整内容。"""
+    response_id = f"chatcmpl-{uuid.uuid4()}"
+    created_timestamp = int(time.time())
+    yield _stream_chunk(response_id, created_timestamp, model, {"role": "assistant"})
+    yield _stream_chunk(response_id, created_timestamp, model, {"content": content_to_markdown(content)},
+                        finish_reason="stop")
+    yield "data: [DONE]\n\n"
 
 
-# ... (verify_key, fake_stream_response_generator 保持不变) ...
-async def verify_key(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme)):
-    if not API_KEY: return
-    if credentials.scheme != "Bearer" or credentials.credentials != API_KEY: raise HTTPException(status_code=401,
-                                                                                                 detail="Incorrect bearer token",
-                                                                                                 headers={
-                                                                                                     "WWW-Authenticate": "Bearer"})
-
-
-async def fake_stream_response_generator(response_content: str, model: str, session_id: str):
+def content_to_markdown(content: Content) -> str:
+    """把图文混合的 content 转为流式输出使用的 Markdown 文本。"""
+    if isinstance(content, str):
+        return content
+    texts = []
+    images = []
+    for part in content:
+        part = part if isinstance(part, dict) else part.model_dump()
+        if part.get("type") == "text":
+            texts.append(part["text"])
+        elif part.get("type") == "image_url":
+            images.append(f"![Generated Image]({part['image_url']['url']})")
+    return "\n".join(texts + images)
+
+
+def is_cache_bypassed(request: ChatCompletionRequest, http_request: Request) -> bool:
+    """
+    判断本次请求是否跳过响应缓存。
+    显式 session_id 的请求只发送最后一条消息，压平后的 prompt 不能代表整段对话，因此不参与缓存。
+    """
+    if not response_cache.enabled or request.cache is False or request.session_id:
+        return True
+    cache_control = http_request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+
+async def stream_response_generator(subscription: Subscription, model: str, tenant: Tenant,
+                                    client_session_id: str | None, messages: list, cache_key: str | None,
+                                    image_base_url: str | None):
+    """
+    真流式响应：上游每返回一个快照，就把新增的文本作为 chat.completion.chunk 下发；
+    图片在出现时通过代理下载并以 Markdown 形式追加。流结束后保存会话状态以便下一轮续接。
+    快照来自订阅的 Flight，合并进来的相同请求也会从头收到完整的流。
+    """
+    flight = subscription.flight
     response_id = f"chatcmpl-{uuid.uuid4()}"
     created_timestamp = int(time.time())
-    choice_data_role = {"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}
-    chunk_role = {"id": response_id, "object": "chat.completion.chunk", "created": created_timestamp, "model": model,
-                  "choices": [choice_data_role]}
-    yield f"data: {json.dumps(chunk_role)}\n\n"
-    choice_data_content = {"index": 0, "delta": {"content": response_content}, "finish_reason": "stop"}
-    chunk_content = {"id": response_id, "object": "chat.completion.chunk", "created": created_timestamp, "model": model,
-                     "choices": [choice_data_content]}
-    yield f"data: {json.dumps(chunk_content)}\n\n"
+    sent_text = ""
+    sent_image_urls: set[str] = set()
+    streamed_parts: list[str] = []  # 客户端最终拼出的完整回复，用于建立前缀索引
+    try:
+        yield _stream_chunk(response_id, created_timestamp, model, {"role": "assistant"})
+        last_output = None
+        async for output in flight.iter_outputs():
+            last_output = output
+            text = _stable_text(output.text or "")
+            if text.startswith(sent_text) and len(text) > len(sent_text):
+                streamed_parts.append(text[len(sent_text):])
+                yield _stream_chunk(response_id, created_timestamp, model, {"content": streamed_parts[-1]})
+                sent_text = text
+
+            new_images = [img for img in output.images if getattr(img, "url", None) and img.url not in sent_image_urls]
+            if new_images:
+                sent_image_urls.update(img.url for img in new_images)
+                image_markdown = []
+                for part in await proxy_images_to_content_blocks(new_images, image_base_url):
+                    if isinstance(part, ImageContentBlock):
+                        image_markdown.append(f"![Generated Image]({part.image_url.url})")
+                    else:
+                        image_markdown.append(part.text)
+                streamed_parts.append("\n" + "\n".join(image_markdown))
+                yield _stream_chunk(response_id, created_timestamp, model, {"content": streamed_parts[-1]})
+
+        # 流结束后补发被扣住的尾部文本
+        final_text = IMAGE_PLACEHOLDER_PATTERN.sub("", last_output.text or "") if last_output else ""
+        diverged = not final_text.startswith(sent_text)
+        if diverged:
+            # 上游改写了已经下发的内容：已发出的无法撤回，至少把公共前缀之后的部分补发出去，不丢掉回答的后半段
+            common = len(os.path.commonprefix([sent_text, final_text]))
+            print(f"Warning: final snapshot diverged from streamed text at offset {common} "
+                  f"(sent {len(sent_text)} chars, final {len(final_text)} chars); sending the remainder.")
+            sent_text = final_text[:common]
+        if len(final_text) > len(sent_text):
+            streamed_parts.append(final_text[len(sent_text):])
+            yield _stream_chunk(response_id, created_timestamp, model, {"content": streamed_parts[-1]})
+        await remember_conversation(flight.conversation, tenant, client_session_id, messages, "".join(streamed_parts),
+                                    model)
+        # 客户端拼出的文本与最终回复不一致时不写入缓存
+        if cache_key and not diverged:
+            await response_cache.set(cache_key, "".join(streamed_parts),
+                                     **cache_lifetime(image_base_url is not None and bool(sent_image_urls)))
+        yield _stream_chunk(response_id, created_timestamp, model, {}, finish_reason="stop")
+    except Exception as e:
+        print(f"Error during streaming: {e}")
+        CHAT_ERRORS.labels(model_label(model), type(e).__name__).inc()
+        yield f"data: {json.dumps({'error': {'message': str(e), 'type': 'upstream_error'}})}\n\n"
+    finally:
+        subscription.close()
     yield "data: [DONE]\n\n"
 
 
-async def process_multimodal_content(messages: list) -> tuple[str, list[str]]:
+def cache_lifetime(has_image_links: bool) -> dict:
+    """
+    回复中的 /v1/files/{id} 短链接只在图片代理的登记有效期内可用，缓存条目不能比登记活得更久；
+    登记只保存在进程内存中（未启用共享存储）时，重启后链接即失效，这类条目也不写入磁盘。
+    """
+    if not has_image_links:
+        return {}
+    return {"ttl": IMAGE_PROXY_TTL_SECONDS, "persist": shared_store.enabled}
+
+
+async def proxy_images_to_content_blocks(images: list, image_base_url: str | None) -> list:
+    """
+    把回复中的图片转换为图片块。
+    默认登记到图片代理并返回 {image_base_url}/v1/files/{id} 短链接；image_base_url 为 None 时
+    改为下载并内联为 data URI。下载失败时返回错误提示文本块。
+    """
+    content_parts: list = []
+    for img in images:
+        if hasattr(img, 'url') and img.url:
+            image_cookies = getattr(img, 'cookies', None)
+            if image_base_url is not None:
+                file_id = await image_proxy.register(img.url, image_cookies)
+                content_parts.append(ImageContentBlock(type="image_url",
+                                                       image_url=ImageUrl(url=f"{image_base_url}/v1/files/{file_id}")))
+                continue
+            try:
+                with stage_timer("image_proxy"):
+                    image_data, content_type = await image_proxy.fetch_bytes(img.url, image_cookies)
+                base64_encoded_image = base64.b64encode(image_data).decode("utf-8")
+                data_uri = f"data:{content_type};base64,{base64_encoded_image}"
+                content_parts.append(ImageContentBlock(type="image_url", image_url=ImageUrl(url=data_uri)))
+            except Exception as e:
+                print(f"Failed to download or encode image via proxy: {e}")
+                error_text = f"\n[Error: Backend failed to proxy image from {img.url}]"
+                content_parts.append(TextContentBlock(type="text", text=error_text))
+    return content_parts
+
+
+def resolve_image_base_url(request: ChatCompletionRequest, http_request: Request) -> str | None:
+    """返回图片短链接的前缀；请求（或服务端配置）选择内联 base64 时返回 None。"""
+    mode = request.image_response_format or IMAGE_RESPONSE_MODE
+    if mode == "base64":
+        return None
+    return PUBLIC_BASE_URL or str(http_request.base_url).rstrip("/")
+
+
+async def _load_image(image_url: str) -> Attachment:
+    file_name = f"{uuid.uuid4()}"
+    if image_url.startswith("data:image"):
+        with stage_timer("image_decode"):
+            header, encoded = image_url.split(",", 1)
+            file_extension = header.split("/")[1].split(";")[0]
+            data = base64.b64decode(encoded)
+        return await Attachment.from_bytes(f"{file_name}.{file_extension}", data)
+    with stage_timer("image_fetch"):
+        data, content_type = await image_fetcher.fetch(image_url)
+    file_extension = f".{content_type.split('/')[-1].split(';')[0]}" if '/' in content_type else ".jpg"
+    return await Attachment.from_bytes(f"{file_name}{file_extension}", data)
+
+
+async def process_multimodal_content(messages: list) -> tuple[str, list[Attachment]]:
     # 此函数现在只用于提取图片，文本部分由新的 flatten 函数处理
-    user_prompt_parts = []
-    temp_file_paths = []
+    # 图片解码/下载后直接以内存中的 Attachment 交给上传流程，不再写入 temp_uploads 再读回；
+    # 多张远程图片通过共享连接池并发抓取
     last_user_message = next((msg for msg in reversed(messages) if msg.role == 'user'), None)
     if not last_user_message or isinstance(last_user_message.content, str):
         return "", []
 
-    async with aiohttp.ClientSession() as session:
-        for content_block in last_user_message.content:
-            if isinstance(content_block, TextContentBlock):
-                user_prompt_parts.append(content_block.text)  # 仍然提取文本以备用
-            elif isinstance(content_block, ImageContentBlock):
-                image_url = content_block.image_url.url
-                file_path = os.path.join("temp_uploads", f"{uuid.uuid4()}")
-                try:
-                    if image_url.startswith("data:image"):
-                        header, encoded = image_url.split(",", 1)
-                        file_extension = header.split("/")[1].split(";")[0]
-                        file_path_with_ext = f"{file_path}.{file_extension}"
-                        async with aiofiles.open(file_path_with_ext, "wb") as f:
-                            await f.write(base64.b64decode(encoded))
-                        temp_file_paths.append(file_path_with_ext)
-                    else:
-                        async with session.get(image_url) as resp:
-                            resp.raise_for_status()
-                            content_type = resp.headers.get('Content-Type', '')
-                            file_extension = f".{content_type.split('/')[-1]}" if '/' in content_type else ".jpg"
-                            file_path_with_ext = f"{file_path}{file_extension}"
-                            async with aiofiles.open(file_path_with_ext, "wb") as f: await f.write(await resp.read())
-                            temp_file_paths.append(file_path_with_ext)
-                except Exception as e:
-                    print(f"Error processing image: {e}")
-    return " ".join(user_prompt_parts), temp_file_paths
+    user_prompt_parts = [block.text for block in last_user_message.content if isinstance(block, TextContentBlock)]
+    image_urls = [block.image_url.url for block in last_user_message.content if isinstance(block, ImageContentBlock)]
+    results = await asyncio.gather(*(_load_image(url) for url in image_urls), return_exceptions=True)
+
+    attachments = []
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Error processing image: {result}")
+        else:
+            attachments.append(result)
+    return " ".join(user_prompt_parts), attachments
 
 
 # vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv
@@ -133,19 +334,115 @@ def flatten_messages_to_prompt(messages: list) -> str:
     return f"{system_prompt}{full_history}"
 
 
+def hash_message_history(messages: list) -> str:
+    """
+    对消息历史做规范化后取 SHA-256，用于识别客户端重发的同一段对话。
+    只有单个文本块的列表与纯字符串等价；图片只取其 URL 的哈希，避免把整段 base64 拼进去。
+    """
+    hasher = hashlib.sha256()
+    for msg in messages:
+        if isinstance(msg.content, str):
+            parts = [msg.content.strip()]
+        else:
+            parts = [
+                block.text.strip() if isinstance(block, TextContentBlock)
+                else "image:" + hashlib.sha256(block.image_url.url.encode()).hexdigest()
+                for block in msg.content
+            ]
+        hasher.update(msg.role.encode())
+        hasher.update(b"\x1e")
+        hasher.update("\x1f".join(parts).encode())
+        hasher.update(b"\x1d")
+    return hasher.hexdigest()
+
+
+def _tenant_scoped(tenant: Tenant, key: str | None) -> str | None:
+    """会话与前缀索引的键都带上租户名：其他租户即使知道 session_id 或发送相同的历史，也续接不到别人的 Gemini 会话。"""
+    return f"{tenant.name}:{key}" if key else None
+
+
+async def find_resumable_session(request: ChatCompletionRequest, tenant: Tenant) -> SessionState | None:
+    """
+    查找该租户可以续接的 Gemini 会话：优先使用显式的 session_id，
+    否则用“除最后一条用户消息以外的全部历史”的哈希去前缀索引里查。
+    """
+    session = await ACTIVE_SESSIONS.get(_tenant_scoped(tenant, request.session_id))
+    if session is None and len(request.messages) > 1 and request.messages[-1].role == 'user':
+        session = await CONVERSATION_PREFIXES.get(_tenant_scoped(tenant, hash_message_history(request.messages[:-1])))
+    if session and not gemini_pool.is_available(session.account):
+        return None
+    return session
+
+
+async def remember_conversation(convo: Conversation, tenant: Tenant, session_id: str | None, messages: list,
+                               reply_content: Content, model: str):
+    """
+    保存本轮结束后的会话状态：客户端给出了 session_id 时按它保存一份，再按“本轮历史 + 回复”的哈希保存一份。
+    服务端为无状态请求随机生成的 session_id 不保存，否则每个这样的请求都会挤掉一个真实会话；这类客户端每轮重发完整历史，
+    靠前缀索引即可续接。
+    """
+    if not convo.metadata:
+        return
+    state = SessionState(convo.account, convo.metadata, model)
+    if session_id:
+        await ACTIVE_SESSIONS.save(_tenant_scoped(tenant, session_id), state)
+    history = list(messages) + [ChatMessage(role="assistant", content=reply_content)]
+    await CONVERSATION_PREFIXES.save(_tenant_scoped(tenant, hash_message_history(history)), state)
+
+
+def start_upstream_flight(key: str | None, request: ChatCompletionRequest, tenant: Tenant, full_prompt_text: str,
+                          attachments: list[Attachment], slot: AdmissionSlot) -> Flight:
+    """
+    在独立任务中调用上游（流式请求走 send_message_stream），快照发布到返回的 Flight。
+    准入名额与附件归上游任务所有，调用结束时释放，与发起请求的客户端是否还在无关。
+    """
+    async def run(flight: Flight):
+        try:
+            # 命中 session_id 或历史前缀且所属账号仍可用时续接 Gemini 会话，只发送最后一条用户消息；
+            # 会话已过期或账号不可用时退回到完整的历史压平
+            session = await find_resumable_session(request, tenant)
+            final_prompt_text = extract_last_user_text(request.messages) if session else full_prompt_text
+            convo = Conversation(gemini_pool, session=session)
+            if request.stream:
+                async for output in convo.send_message_stream(user_input=final_prompt_text, model=request.model,
+                                                              files=attachments, fallback_input=full_prompt_text):
+                    flight.publish(output)
+            else:
+                flight.publish(await convo.send_message(user_input=final_prompt_text, model=request.model,
+                                                        files=attachments, fallback_input=full_prompt_text))
+            flight.conversation = convo
+        finally:
+            slot.release()
+            cleanup_attachments(attachments)
+
+    return request_coalescer.start(key, run)
+
+
+def extract_last_user_text(messages: list) -> str:
+    """续接会话时只需发送最后一条用户消息的文本。"""
+    last_user_message = next((msg for msg in reversed(messages) if msg.role == 'user'), None)
+    if not last_user_message:
+        return ""
+    if isinstance(last_user_message.content, str):
+        return last_user_message.content
+    return " ".join(block.text for block in last_user_message.content if isinstance(block, TextContentBlock))
+
+
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
 
 @app.get("/")
 def read_root():
-    return {"status": "ok", "message": "Welcome to CatfishAPI!"}
+    # 准入队列的深度与在途请求数，供负载均衡/自动扩缩容的健康检查读取
+    return {"status": "ok", "message": "Welcome to CatfishAPI!", "admission": admission.stats(),
+            "upstream_latency": upstream_latency.stats()}
 
 
 @app.get("/v1/models", response_model=ModelList, dependencies=[Depends(verify_key)])
 async def list_models():
     # ... (保持不变) ...
     try:
-        model_ids = await gemini_manager.client.get_models()
+        model_ids = await gemini_pool.pick().client.get_models()
         if model_ids: return ModelList(data=[ModelCard(id=model_id) for model_id in model_ids])
     except Exception as e:
         print(f"Error dynamically fetching models: {e}")
@@ -153,52 +450,148 @@ async def list_models():
     return ModelList(data=[ModelCard(id=model_id) for model_id in fallback_models])
 
 
-@app.post("/v1/chat/completions", dependencies=[Depends(verify_key)])
-async def chat_completions(request: ChatCompletionRequest):
+if METRICS_ENABLED:
+    @app.get("/metrics")
+    def metrics():
+        """Prometheus 抓取端点。与 /v1/files 一样不要求 API Key，部署时请只对内网开放。"""
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/v1/debug/profiles/{profile_id}", dependencies=[Depends(verify_key)])
+def get_profile(profile_id: str):
+    """取回 X-Debug-Profile 请求生成的折叠栈文件，可直接交给 flamegraph.pl 或 speedscope。"""
+    if not is_valid_profile_id(profile_id) or not os.path.exists(profile_path(profile_id)):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(profile_path(profile_id), media_type="text/plain")
+
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str):
+    """
+    转发生成的图片。不要求 API Key：这些链接会被浏览器/客户端直接当作图片加载，
+    file_id 由上游 URL 的哈希得到，只有出现在回复中的图片才能被访问。
+    """
+    cached = image_proxy.cached(file_id)
+    if cached:
+        path, content_type = cached
+        return FileResponse(path, media_type=content_type, headers={"Cache-Control": "public, max-age=86400"})
+    try:
+        with stage_timer("image_proxy"):
+            upstream = await image_proxy.open_upstream(file_id)
+    except ImageNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found or expired.")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch upstream image: {e}")
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if "content-length" in upstream.headers:
+        headers["Content-Length"] = upstream.headers["content-length"]
+    return StreamingResponse(image_proxy.relay(file_id, upstream),
+                             media_type=upstream.headers.get("content-type", "image/png"), headers=headers)
+
+
+@app.get("/v1/usage")
+def get_usage(tenant: Tenant = Depends(verify_key)):
+    """调用方所属租户的用量、排队与延迟统计。"""
+    return next((stats for stats in admission.tenant_stats() if stats["name"] == tenant.name),
+                {**tenant.stats(), "in_flight": 0, "queue_depth": 0})
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest, http_request: Request, response: Response,
+                           tenant: Tenant = Depends(verify_key)):
     # (核心修改) 调用新函数将整个历史记录压平成一个 prompt
-    final_prompt_text = flatten_messages_to_prompt(request.messages)
+    with stage_timer("flatten"):
+        full_prompt_text = flatten_messages_to_prompt(request.messages)
 
     # 仍然需要调用旧函数，但只为了提取图片文件
-    _, temp_files = await process_multimodal_content(request.messages)
+    _, attachments = await process_multimodal_content(request.messages)
 
-    if not final_prompt_text and not temp_files:
+    if not full_prompt_text and not attachments:
         raise HTTPException(status_code=400, detail="No user text or valid image content.")
 
-    # (修改) 每次都创建一个新的、无状态的 Conversation 实例
-    convo = Conversation(gemini_manager)
-    # session_id 仅用于响应，不再用于状态管理
     session_id = request.session_id or str(uuid.uuid4())
 
-    try:
-        # (修改) 调用一个更简单的 send_message
-        response_object = await convo.send_message(
-            user_input=final_prompt_text,
-            model=request.model,
-            files=temp_files
-        )
+    image_base_url = resolve_image_base_url(request, http_request)
+    cache_key = None
+    if not is_cache_bypassed(request, http_request):
+        # 流式缓存的是拼好的 Markdown 文本，非流式缓存的是内容块，两者不能互相命中；图片形式（短链接/base64）同样要区分
+        cache_variant = f"{'stream' if request.stream else 'json'}|{image_base_url or 'base64'}"
+        cache_key = ResponseCache.make_key(request.model, full_prompt_text, hash_attachments(attachments),
+                                           cache_variant)
+        cached_content = await response_cache.get(cache_key)
+        if cached_content is not None:
+            cleanup_attachments(attachments)
+            CHAT_REQUESTS.labels(model_label(request.model), str(bool(request.stream)).lower(), "HIT").inc()
+            cache_headers = {"X-Cache": "HIT", "X-Session-Id": session_id}
+            if request.stream:
+                return StreamingResponse(cached_stream_response_generator(cached_content, request.model),
+                                         media_type="text/event-stream", headers=cache_headers)
+            response_message = ChatCompletionMessage(role="assistant", content=cached_content)
+            return _json_response(ChatCompletionResponse(id=f"chatcmpl-{uuid.uuid4()}", created=int(time.time()),
+                                                         model=request.model,
+                                                         choices=[ChatCompletionChoice(message=response_message)],
+                                                         session_id=session_id), cache_headers)
+    cache_status = "MISS" if cache_key else "BYPASS"
+    CHAT_REQUESTS.labels(model_label(request.model), str(bool(request.stream)).lower(), cache_status).inc()
+
+    # 同时进行的相同请求只调用一次上游；只在同一租户内合并，各租户的准入与限速互不影响。
+    # 显式 session_id 的请求只发送最后一条消息，需要按会话区分
+    flight_key = None
+    if request.coalesce is not False:
+        variant = f"tenant:{tenant.name}" + (f"|session:{request.session_id}" if request.session_id else "")
+        flight_key = ResponseCache.make_key(request.model, full_prompt_text, hash_attachments(attachments),
+                                            variant=variant)
+    flight = request_coalescer.join(flight_key)
+    coalesced = flight is not None
+    if coalesced:
+        # 附件只由发起上游调用的请求使用；先订阅再扣令牌，期间发起者断开也不会取消这次上游调用
+        cleanup_attachments(attachments)
+        subscription = request_coalescer.subscribe(flight)
+        try:
+            await admission.charge(tenant)
+        except AdmissionRejected as e:
+            subscription.close()
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        except BaseException:
+            subscription.close()
+            raise
+    else:
+        try:
+            # 所有账号都在熔断时不必排队，直接返回 503 并告知最早恢复试探的时间
+            gemini_pool.ensure_available()
+            slot = await admission.acquire(tenant)
+        except NoAvailableAccountError as e:
+            cleanup_attachments(attachments)
+            CHAT_ERRORS.labels(model_label(request.model), type(e).__name__).inc()
+            raise HTTPException(status_code=503, detail=str(e), headers=_retry_after_header(e.retry_after))
+        except AdmissionRejected as e:
+            cleanup_attachments(attachments)
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        # 排队期间相同的请求可能已经发出
+        flight = request_coalescer.join(flight_key)
+        coalesced = flight is not None
+        if coalesced:
+            slot.release()
+            cleanup_attachments(attachments)
+        else:
+            flight = start_upstream_flight(flight_key, request, tenant, full_prompt_text, attachments, slot)
+        subscription = request_coalescer.subscribe(flight)
+    headers = {"X-Session-Id": session_id, "X-Cache": cache_status, "X-Coalesced": str(coalesced).lower()}
 
-        # ... (后续的图文代理和响应构建逻辑完全保持不变) ...
+    if request.stream:
+        # 客户端在生成器开始前就断开时生成器不会执行 finally，由 finalize 在它被回收时兜底退订
+        generator = stream_response_generator(subscription, request.model, tenant, request.session_id,
+                                              request.messages, cache_key, image_base_url)
+        weakref.finalize(generator, subscription.close)
+        return StreamingResponse(generator, media_type="text/event-stream", headers=headers)
+
+    try:
+        response_object = await flight.result()
         response_content_parts: list = []
         if response_object.text:
             response_content_parts.append(TextContentBlock(type="text", text=response_object.text))
         if hasattr(response_object, 'images') and response_object.images:
-            async with httpx.AsyncClient(proxy=PROXY_URL, cookies=gemini_manager.client.cookies, timeout=30.0,
-                                         follow_redirects=True) as client:
-                for img in response_object.images:
-                    if hasattr(img, 'url') and img.url:
-                        try:
-                            image_response = await client.get(img.url)
-                            image_response.raise_for_status()
-                            image_data = image_response.content
-                            content_type = image_response.headers.get("content-type", "image/png")
-                            base64_encoded_image = base64.b64encode(image_data).decode("utf-8")
-                            data_uri = f"data:{content_type};base64,{base64_encoded_image}"
-                            image_block = ImageContentBlock(type="image_url", image_url=ImageUrl(url=data_uri))
-                            response_content_parts.append(image_block)
-                        except Exception as e:
-                            print(f"Failed to download or encode image via proxy: {e}")
-                            error_text = f"\n[Error: Backend failed to proxy image from {img.url}]"
-                            response_content_parts.append(TextContentBlock(type="text", text=error_text))
+            response_content_parts.extend(await proxy_images_to_content_blocks(response_object.images, image_base_url))
         final_content: Content
         if len(response_content_parts) == 1 and response_content_parts[0].type == "text":
             final_content = response_content_parts[0].text
@@ -206,31 +599,30 @@ async def chat_completions(request: ChatCompletionRequest):
             final_content = ""
         else:
             final_content = response_content_parts
-
+        await remember_conversation(flight.conversation, tenant, request.session_id, request.messages, final_content,
+                                    request.model)
+        # 图片代理失败时回复里带有错误提示，不写入缓存
+        proxy_failed = any(isinstance(part, TextContentBlock) and part.text.startswith("\n[Error:")
+                           for part in response_content_parts)
+        if cache_key and not proxy_failed:
+            has_image_links = any(isinstance(part, ImageContentBlock) for part in response_content_parts)
+            await response_cache.set(cache_key, final_content if isinstance(final_content, str)
+                                     else [part.model_dump() for part in final_content],
+                                     **cache_lifetime(image_base_url is not None and has_image_links))
+
+    except NoAvailableAccountError as e:
+        CHAT_ERRORS.labels(model_label(request.model), type(e).__name__).inc()
+        raise HTTPException(status_code=503, detail=str(e), headers=_retry_after_header(e.retry_after))
     except Exception as e:
+        CHAT_ERRORS.labels(model_label(request.model), type(e).__name__).inc()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        for f in temp_files:
-            try:
-                os.remove(f)
-            except OSError as e:
-                print(f"Error cleaning up temp file {f}: {e}")
+        subscription.close()
 
-    if request.stream:
-        stream_content: str
-        if isinstance(final_content, list):
-            texts = [part.text for part in final_content if hasattr(part, 'text')]
-            images = [f"![Generated Image]({part.image_url.url})" for part in final_content if
-                      hasattr(part, 'image_url')]
-            stream_content = "\n".join(texts + images)
-        else:
-            stream_content = final_content or ""
-        return StreamingResponse(fake_stream_response_generator(stream_content, request.model, session_id),
-                                 media_type="text/event-stream")
-    else:
-        response_id = f"chatcmpl-{uuid.uuid4()}"
-        created_timestamp = int(time.time())
-        response_message = ChatCompletionMessage(role="assistant", content=final_content)
-        choice = ChatCompletionChoice(message=response_message)
-        return ChatCompletionResponse(id=response_id, created=created_timestamp, model=request.model, choices=[choice],
-                                      session_id=session_id)
\ No newline at end of file
+    response_id = f"chatcmpl-{uuid.uuid4()}"
+    created_timestamp = int(time.time())
+    response_message = ChatCompletionMessage(role="assistant", content=final_content)
+    choice = ChatCompletionChoice(message=response_message)
+    return _json_response(ChatCompletionResponse(id=response_id, created=created_timestamp, model=request.model,
+                                                 choices=[choice], session_id=session_id),
+                          {**headers, **response.headers})
@@ -0,0 +1,245 @@
+# --- metrics.py (Prometheus 指标) ---
+# 热路径上只做 Counter/Histogram 的一次加法；缓存命中率、账号状态等现成的统计在抓取时才读取。
+
+import time
+from contextvars import ContextVar
+
+from gemini_webapi.constants import Model
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+# 请求处理的各个阶段，顺序与一次请求的执行顺序一致
+STAGES = (
+    "flatten",              # 历史消息压平为 prompt
+    "image_decode",         # data URI 图片解码
+    "image_fetch",          # 远程图片 URL 抓取
+    "attachment_spill",     # 大附件写入临时文件
+    "queue",                # 在准入队列中等待并发名额
+    "upload",               # 附件上传到 Google
+    "upstream_first_byte",  # StreamGenerate 请求发出到收到第一行
+    "upstream",             # StreamGenerate 请求发出到响应读完
+    "parse",                # 响应帧解析（流式为每个快照一次）
+    "image_proxy",          # 生成图片的下载/转发
+    "serialize",            # 响应序列化（流式为每个 chunk 一次）
+)
+
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_DURATION = Histogram("catfish_stage_duration_seconds", "Time spent in each request-processing stage.",
+                           ["stage"], buckets=_BUCKETS)
+_STAGE_CHILDREN = {stage: STAGE_DURATION.labels(stage) for stage in STAGES}
+
+HTTP_REQUEST_DURATION = Histogram("catfish_http_request_duration_seconds",
+                                  "HTTP request duration until the last body byte is sent.",
+                                  ["route", "status"], buckets=_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("catfish_http_requests_in_flight", "HTTP requests currently being served.", ["route"])
+
+CHAT_REQUESTS = Counter("catfish_chat_requests", "Chat completion requests by model, mode and cache status.",
+                        ["model", "stream", "cache"])
+CHAT_ERRORS = Counter("catfish_chat_errors", "Chat completion failures by model and error type.",
+                      ["model", "error"])
+ACCOUNT_REQUESTS = Counter("catfish_account_requests", "Upstream requests per account by outcome.",
+                           ["account", "outcome"])
+UPSTREAM_RETRIES = Counter("catfish_upstream_retries", "Upstream attempts retried, by failure kind.", ["kind"])
+HEDGED_REQUESTS = Counter("catfish_hedged_requests", "Hedged upstream requests, by which attempt won.", ["winner"])
+BREAKER_TRANSITIONS = Counter("catfish_breaker_transitions", "Circuit breaker state transitions per account.",
+                              ["account", "state"])
+ADMISSION_IN_FLIGHT = Gauge("catfish_admission_in_flight", "Requests holding an admission slot.")
+ADMISSION_QUEUE_DEPTH = Gauge("catfish_admission_queue_depth", "Requests waiting for an admission slot.")
+ADMISSION_REJECTED = Counter("catfish_admission_rejected", "Requests rejected with 429 by admission control.",
+                             ["reason"])
+TENANT_REQUESTS = Counter("catfish_tenant_requests", "Chat requests per API key tenant by admission outcome.",
+                          ["tenant", "outcome"])
+TENANT_LATENCY = Histogram("catfish_tenant_latency_seconds",
+                           "Time from admission request to slot release (queue wait + upstream) per tenant.",
+                           ["tenant"], buckets=_BUCKETS)
+TENANT_QUEUE_WAIT = Histogram("catfish_tenant_queue_wait_seconds", "Admission queue wait per tenant.",
+                              ["tenant"], buckets=_BUCKETS)
+UPSTREAM_RESPONSES = Counter("catfish_upstream_responses", "Upstream HTTP responses by endpoint and status code.",
+                             ["endpoint", "status_code"])
+
+# 模型名来自请求体，未知的模型统一归为 other，避免标签基数失控
+_KNOWN_MODELS = frozenset(model.model_name for model in Model)
+_ROUTES = ("/v1/chat/completions", "/v1/models", "/metrics", "/")
+# 带 Server-Timing 响应头的路由
+_SERVER_TIMING_ROUTES = ("/v1/chat/completions",)
+
+# 当前请求各阶段的累计耗时（秒），由 ServerTimingMiddleware 在请求开始时设置；
+# 请求内派生的任务（如并发上传）复制同一个上下文，因此累加到同一个字典里
+_REQUEST_STAGES: ContextVar[dict | None] = ContextVar("request_stages", default=None)
+
+
+class _StageTimer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.stage, time.perf_counter() - self.started)
+
+
+def stage_timer(stage: str) -> _StageTimer:
+    """`with stage_timer("flatten"): ...` 记录该阶段耗时。"""
+    return _StageTimer(stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    _STAGE_CHILDREN[stage].observe(seconds)
+    stages = _REQUEST_STAGES.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def model_label(model: str | None) -> str:
+    return model if model in _KNOWN_MODELS else "other"
+
+
+def record_upstream_status(endpoint: str, status_code: int):
+    UPSTREAM_RESPONSES.labels(endpoint, str(status_code)).inc()
+
+
+def _route_label(path: str) -> str:
+    if path in _ROUTES:
+        return path
+    if path.startswith("/v1/files/"):
+        return "/v1/files/{file_id}"
+    return "other"
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：统计在途请求数，以及到最后一个响应体字节发出为止的总耗时（流式响应也准确）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_label(scope["path"])
+        started = time.perf_counter()
+        status = "500"
+        in_flight = HTTP_IN_FLIGHT.labels(route)
+        in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(route, status).observe(time.perf_counter() - started)
+
+
+def format_server_timing(stages: dict, total: float) -> str:
+    """按 STAGES 的顺序输出 `flatten;dur=0.05, upstream;dur=812.3, total;dur=815.0`（毫秒）。"""
+    entries = [f"{stage};dur={stages[stage] * 1000:.2f}" for stage in STAGES if stage in stages]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    为聊天接口的响应加上 Server-Timing 头，列出该请求已完成的各阶段耗时与响应头发出前的总耗时。
+    流式响应的响应头在上游请求开始前就已发出，因此只包含压平、图片处理等前置阶段。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in _SERVER_TIMING_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stages = {}
+        token = _REQUEST_STAGES.set(stages)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                header = format_server_timing(stages, time.perf_counter() - started)
+                message = {**message, "headers": [*message.get("headers", ()), (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _REQUEST_STAGES.reset(token)
+
+
+class StateCollector:
+    """
+    抓取时读取各缓存的 stats()、账号池与各租户的排队状态，热路径上没有任何额外开销。
+    caches: 名称 -> 带有 stats() 方法（返回含 hits/misses 的字典）的对象。
+    """
+
+    def __init__(self, pool, caches: dict, admission=None):
+        self.pool = pool
+        self.caches = caches
+        self.admission = admission
+
+    def collect(self):
+        hits = CounterMetricFamily("catfish_cache_hits", "Cache hits.", labels=["cache"])
+        misses = CounterMetricFamily("catfish_cache_misses", "Cache misses.", labels=["cache"])
+        ratio = GaugeMetricFamily("catfish_cache_hit_ratio", "Cache hit ratio since start.", labels=["cache"])
+        entries = GaugeMetricFamily("catfish_cache_entries", "Entries currently cached.", labels=["cache"])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            total = stats["hits"] + stats["misses"]
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hits"] / total if total else 0.0)
+            if "size" in stats:
+                entries.add_metric([name], stats["size"])
+        yield from (hits, misses, ratio, entries)
+
+        healthy = GaugeMetricFamily("catfish_account_healthy", "Whether the account is in rotation.",
+                                    labels=["account"])
+        in_flight = GaugeMetricFamily("catfish_account_in_flight", "Upstream requests in flight per account.",
+                                      labels=["account"])
+        error_rate = GaugeMetricFamily("catfish_account_error_rate", "Recent error rate per account.",
+                                       labels=["account"])
+        breaker = GaugeMetricFamily("catfish_breaker_state", "Circuit breaker state per account (1 = current).",
+                                    labels=["account", "state"])
+        recycles = CounterMetricFamily("catfish_account_client_recycles", "Background client rebuilds per account.",
+                                       labels=["account"])
+        refreshes = CounterMetricFamily("catfish_account_cookie_refreshes", "Background cookie/access token "
+                                        "refreshes per account.", labels=["account"])
+        for account in self.pool.stats():
+            healthy.add_metric([account["name"]], 1 if account["healthy"] else 0)
+            in_flight.add_metric([account["name"]], account["in_flight"])
+            error_rate.add_metric([account["name"]], account["error_rate"])
+            for state in ("closed", "half_open", "open"):
+                breaker.add_metric([account["name"], state], 1 if account["breaker"] == state else 0)
+            recycles.add_metric([account["name"]], account["recycles"])
+            refreshes.add_metric([account["name"]], account["refreshes"])
+        yield from (healthy, in_flight, error_rate, breaker, recycles, refreshes)
+
+        if self.admission is None:
+            return
+        tenant_in_flight = GaugeMetricFamily("catfish_tenant_in_flight", "Admission slots held per tenant.",
+                                             labels=["tenant"])
+        tenant_queue = GaugeMetricFamily("catfish_tenant_queue_depth", "Requests queued per tenant.",
+                                         labels=["tenant"])
+        for tenant in self.admission.tenant_stats():
+            tenant_in_flight.add_metric([tenant["name"]], tenant["in_flight"])
+            tenant_queue.add_metric([tenant["name"]], tenant["queue_depth"])
+        yield from (tenant_in_flight, tenant_queue)
+
+
+def register_state_collector(pool, caches: dict, admission=None):
+    REGISTRY.register(StateCollector(pool, caches, admission))
@@ -40,6 +40,12 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = None
     top_p: Optional[float] = None
     max_tokens: Optional[int] = None
+    # 设为 False 时本次请求跳过响应缓存（也可以用请求头 Cache-Control: no-cache）
+    cache: Optional[bool] = None
+    # 设为 False 时本次请求不与同时进行的相同请求合并，总是单独调用上游
+    coalesce: Optional[bool] = None
+    # 生成图片的返回方式："url" 为 /v1/files/{id} 短链接，"base64" 为内联 data URI；不填则使用服务端配置
+    image_response_format: Optional[Literal["url", "base64"]] = None
 
     class Config:
         extra = "ignore"
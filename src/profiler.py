@@ -0,0 +1,176 @@
+# --- profiler.py (单请求采样分析) ---
+# 请求带上 X-Debug-Profile: <DEBUG_PROFILE_TOKEN> 时，由一个后台线程按固定间隔对事件循环线程采样，
+# 只统计属于该请求（及其派生任务）的样本，结果为 flamegraph.pl / speedscope 可直接读取的折叠栈格式。
+# 每个样本以任务名为根：任务正在运行时记录真实调用栈，挂起时记录 await 链并以 [await] 结尾，
+# 因此火焰图反映的是墙钟时间，等待上游的时间也能看到。
+
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+from .config import DEBUG_PROFILE_TOKEN, PROFILE_DIR, PROFILE_MAX_CONCURRENT, PROFILE_SAMPLE_INTERVAL_MS
+
+PROFILE_HEADER = b"x-debug-profile"
+
+_SESSION: ContextVar["ProfileSession | None"] = ContextVar("profile_session", default=None)
+_active_sessions = 0
+_factory_loops = set()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _running_stack(frame, root_frame) -> list[str]:
+    """从线程当前帧向外回溯到任务协程的最外层帧为止，返回从根到叶的帧标签。"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        if frame is root_frame:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(coro) -> list[str]:
+    """沿着挂起协程的 await 链向内走，返回从根到叶的帧标签。"""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    stack.append("[await]")
+    return stack
+
+
+class ProfileSession:
+    """一次请求的采样会话。样本在采样线程中累加，请求结束后写入 PROFILE_DIR/<id>.folded。"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float):
+        self.id = uuid.uuid4().hex
+        self.loop = loop
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.tasks: set[asyncio.Task] = set()
+        self.samples: Counter = Counter()
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        current_tasks = asyncio.tasks._current_tasks
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample(current_tasks.get(self.loop))
+            except Exception:
+                # 与事件循环线程并发读取帧对象，偶尔会读到正在变化的状态，丢弃这个样本即可
+                continue
+
+    def _sample(self, running: asyncio.Task | None):
+        # 集合只会在事件循环线程中增长，这里先拷贝一份再遍历
+        for task in tuple(self.tasks):
+            if task.done():
+                continue
+            coro = task.get_coro()
+            if task is running:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = _running_stack(frame, getattr(coro, "cr_frame", None))
+            else:
+                stack = _await_stack(coro)
+            self.samples[";".join([task.get_name(), *stack])] += 1
+
+    def finish(self) -> str:
+        """停止采样并写出折叠栈文件，返回文件路径。"""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = profile_path(self.id)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# interval_ms={self.interval * 1000:g} duration_ms={(time.perf_counter() - self.started) * 1000:.1f}\n")
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+
+
+def is_valid_profile_id(profile_id: str) -> bool:
+    return len(profile_id) == 32 and all(c in "0123456789abcdef" for c in profile_id)
+
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop):
+    """包装事件循环的任务工厂：在采样会话的上下文中创建的任务都归入该会话。"""
+    if loop in _factory_loops:
+        return
+    previous = loop.get_task_factory()
+
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        session = _SESSION.get()
+        if session is not None:
+            session.tasks.add(task)
+        return task
+
+    loop.set_task_factory(factory)
+    _factory_loops.add(loop)
+
+
+def _requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return hmac.compare_digest(value, DEBUG_PROFILE_TOKEN.encode())
+    return False
+
+
+class ProfilingMiddleware:
+    """
+    纯 ASGI 中间件：只有配置了 DEBUG_PROFILE_TOKEN 且请求头携带相同令牌时才开启采样，
+    响应头 X-Profile-Id 给出结果的 ID，可在请求结束后通过 /v1/debug/profiles/{id} 取回。
+    同时进行的采样会话数受 PROFILE_MAX_CONCURRENT 限制，超出时该请求照常处理但不采样。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _active_sessions
+        if (scope["type"] != "http" or not DEBUG_PROFILE_TOKEN or not _requested(scope)
+                or _active_sessions >= PROFILE_MAX_CONCURRENT):
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        _install_task_factory(loop)
+        session = ProfileSession(loop, PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        session.tasks.add(asyncio.current_task())
+        token = _SESSION.set(session)
+        _active_sessions += 1
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()), (b"x-profile-id", session.id.encode())]}
+            await send(message)
+
+        session.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _SESSION.reset(token)
+            _active_sessions -= 1
+            path = await asyncio.to_thread(session.finish)
+            print(f"[Profiler] Request profile written to {path} ({sum(session.samples.values())} samples).")
@@ -0,0 +1,127 @@
+# --- response_cache.py (精确匹配响应缓存) ---
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+
+import orjson as json
+from cachetools import LRUCache
+
+from .attachments import Attachment
+from .config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_DB_PATH, RESPONSE_CACHE_DISK_MAX_ENTRIES
+)
+
+
+def hash_attachments(attachments: list[Attachment]) -> list[str]:
+    """附件按内容取 SHA-256，文件名不参与缓存键。"""
+    return [attachment.sha256 for attachment in attachments]
+
+
+class ResponseCache:
+    """
+    请求 -> 最终回复内容 的精确匹配缓存。
+    内存中是 LRU；配置了 db_path 时再用 SQLite 做二级存储（同样按最近访问时间淘汰），重启后仍能命中。
+    缓存的是已经处理好的回复 content（字符串或内容块字典列表），命中时无需再访问上游或下载图片。
+    条目可以带有效期（例如引用了图片短链接的回复），也可以只保存在内存中不写入磁盘。
+    """
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, maxsize: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 db_path: str | None = RESPONSE_CACHE_DB_PATH, disk_maxsize: int = RESPONSE_CACHE_DISK_MAX_ENTRIES):
+        self.enabled = enabled
+        self._memory: LRUCache[str, tuple[str | list, float | None]] = LRUCache(maxsize=maxsize)
+        self.db_path = db_path
+        self.disk_maxsize = disk_maxsize
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, attachment_hashes: list[str], variant: str = "") -> str:
+        """variant 用于区分同一请求的不同输出形式（例如图片以短链接还是 base64 返回）。"""
+        payload = json.dumps({"model": model, "prompt": prompt, "attachments": attachment_hashes, "variant": variant})
+        return hashlib.sha256(payload).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            # 多 worker 部署时可能有多个进程同时读写同一个文件：WAL 模式下读写互不阻塞，写锁冲突时等待
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content BLOB NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, expires REAL)"
+            )
+            if "expires" not in {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}:
+                # 旧版本创建的文件没有有效期列，其中的条目视为永不过期
+                self._db.execute("ALTER TABLE responses ADD COLUMN expires REAL")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key: str) -> tuple[str | list, float | None] | None:
+        now = time.time()
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute("SELECT content, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < now:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, content: str | list, expires: float | None):
+        now = time.time()
+        with self._db_lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO responses (key, content, created, accessed, expires) "
+                       "VALUES (?, ?, ?, ?, ?)", (key, json.dumps(content), now, now, expires))
+            db.execute("DELETE FROM responses WHERE key IN "
+                       "(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.disk_maxsize,))
+            db.commit()
+
+    async def get(self, key: str) -> str | list | None:
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            del self._memory[key]
+            entry = None
+        if entry is None and self.db_path:
+            try:
+                entry = await asyncio.to_thread(self._disk_get, key)
+            except (sqlite3.Error, ValueError) as e:
+                # 数据库被锁或已损坏时按未命中处理，缓存出错不应让请求失败
+                print(f"Error reading response cache from disk: {e}")
+            if entry is not None:
+                self._memory[key] = entry
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, key: str, content: str | list, ttl: float | None = None, persist: bool = True):
+        """ttl 为条目的有效期（秒），None 表示只按容量淘汰；persist 为 False 时只保存在内存中。"""
+        expires = time.time() + ttl if ttl is not None else None
+        self._memory[key] = (content, expires)
+        if self.db_path and persist:
+            try:
+                await asyncio.to_thread(self._disk_set, key, content, expires)
+            except sqlite3.Error as e:
+                print(f"Error writing response cache to disk: {e}")
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "size": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+response_cache = ResponseCache()
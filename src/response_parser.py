@@ -0,0 +1,124 @@
+# --- response_parser.py (StreamGenerate 响应体的一次性解析) ---
+
+from typing import Iterator
+
+import orjson as json
+
+RESPONSE_PREFIX = ")]}'"
+
+
+def decode_frame_line(line: str) -> list | None:
+    """解析一行 JSON 帧数组（形如 [["wrb.fr", null, "<内层 JSON>"], ...]），不是帧的行返回 None。"""
+    if not line.startswith("["):
+        return None
+    try:
+        frame = json.loads(line)
+    except ValueError:
+        return None
+    return frame if isinstance(frame, list) else None
+
+
+def decode_part_body(part) -> list | None:
+    """解析帧中单个部分 part[2] 的内层 JSON，结构不符时返回 None。"""
+    try:
+        return json.loads(part[2])
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+def is_response_body(body) -> bool:
+    return bool(body) and isinstance(body, list) and len(body) > 4 and bool(body[4])
+
+
+def iter_line_bodies(line: str) -> Iterator[list]:
+    """流式场景：逐个给出一行帧中所有有效的 body。"""
+    frame = decode_frame_line(line)
+    if frame is None:
+        return
+    for part in frame:
+        body = decode_part_body(part)
+        if is_response_body(body):
+            yield body
+
+
+def _candidate_has_generated_images(body: list, candidate_index: int) -> bool:
+    try:
+        return bool(body[4][candidate_index][12][7][0])
+    except (IndexError, TypeError, KeyError):
+        return False
+
+
+_UNDECODED = object()
+
+
+class ParsedResponse:
+    """
+    StreamGenerate 非流式响应体的索引结构。
+    响应体可能有多行帧，每行是截至当时的完整快照，与流式路径一样以最后一个带 body 的帧行为准；
+    只解码这一行，之前的快照行不解析。帧部分的内层 JSON 按需解码且只解码一次，body、生图数据块等查询
+    都基于这份索引完成，不再像旧实现那样为每个候选项重新 json.loads 一遍帧数据。
+    """
+    __slots__ = ("raw_text", "line_start", "frames", "_bodies", "body_index", "_image_body_index")
+
+    def __init__(self, raw_text: str):
+        self.raw_text = raw_text
+        self.line_start: int | None = None  # frames 所在行在 raw_text 中的起始位置
+        self.frames: list = []
+        self._bodies: list = []
+        self.body_index: int | None = None
+        self._image_body_index: dict[int, int | None] = {}
+        # 从末尾逐行向前查找，只切出帧行（以 "[" 开头），不对整个响应体做 split
+        end = len(raw_text)
+        while end >= 0:
+            line_start = raw_text.rfind("\n", 0, end) + 1
+            line_end, end = end, line_start - 1
+            if not raw_text.startswith("[", line_start):
+                continue
+            frame = decode_frame_line(raw_text[line_start:line_end])
+            if not frame:
+                continue
+            bodies = []
+            for part in frame:
+                body = decode_part_body(part)
+                bodies.append(body)
+                if is_response_body(body):
+                    # 找到 body 之前的部分已经解码；之后的部分留给生图查询按需解码
+                    self.line_start, self.frames, self.body_index = line_start, frame, len(bodies) - 1
+                    self._bodies = bodies + [_UNDECODED] * (len(frame) - len(bodies))
+                    return
+            if not self.frames:
+                # 没有任何帧行带 body 时保留最后一行，供兜底解析器扫描
+                self.line_start, self.frames, self._bodies = line_start, frame, bodies
+
+    def part_body(self, index: int) -> list | None:
+        body = self._bodies[index]
+        if body is _UNDECODED:
+            body = self._bodies[index] = decode_part_body(self.frames[index])
+        return body
+
+    @property
+    def body(self) -> list | None:
+        return self.part_body(self.body_index) if self.body_index is not None else None
+
+    @property
+    def decoded_parts(self) -> Iterator[list]:
+        """所有解码成功的内层 JSON，供兜底解析器复用，已解码过的部分不会再次解码。"""
+        return (body for body in map(self.part_body, range(len(self.frames))) if body is not None)
+
+    def image_body(self, candidate_index: int) -> list | None:
+        """从 body 所在帧开始，返回第一个包含该候选项生图数据的 body（结果按候选项缓存）。"""
+        if candidate_index not in self._image_body_index:
+            found = None
+            if self.body_index is not None:
+                for i in range(self.body_index, len(self.frames)):
+                    body = self.part_body(i)
+                    if body is not None and _candidate_has_generated_images(body, candidate_index):
+                        found = i
+                        break
+            self._image_body_index[candidate_index] = found
+        index = self._image_body_index[candidate_index]
+        return self.part_body(index) if index is not None else None
+
+    def image_candidate(self, candidate_index: int) -> list | None:
+        body = self.image_body(candidate_index)
+        return body[4][candidate_index] if body is not None else None
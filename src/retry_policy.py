@@ -0,0 +1,79 @@
+# --- retry_policy.py (重试与对冲请求) ---
+# 上游偶发的 5xx、网络错误、超时，以及单个账号被限流或 Cookie 失效，都不应该直接变成 500：
+# 这类失败发生时客户端还没有收到任何内容，换一个账号（熔断器已把出问题的账号移出轮转）重新发送是安全的。
+# 重试采用带随机抖动的指数退避，次数受 RETRY_ATTEMPTS 限制，超过 RETRY_DEADLINE_SECONDS 后不再发起新的尝试。
+# 对冲：非流式请求耗时超过最近的 p95 延迟时，再向另一个账号发一份相同的请求，取先返回的结果，削掉长尾延迟。
+
+from collections import deque
+
+from gemini_webapi.utils import logger
+from tenacity import (
+    AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, stop_before_delay, wait_random_exponential
+)
+
+from .circuit_breaker import AUTH, THROTTLED, TRANSIENT, classify_failure
+from .config import (
+    HEDGE_ENABLED, HEDGE_MIN_DELAY_SECONDS, HEDGE_MIN_SAMPLES, RETRY_ATTEMPTS, RETRY_BACKOFF_BASE_SECONDS,
+    RETRY_BACKOFF_MAX_SECONDS, RETRY_DEADLINE_SECONDS
+)
+from .metrics import UPSTREAM_RETRIES
+
+# 可以安全重试的失败类型：上游没有给出任何回复，客户端也还没有收到内容
+RETRYABLE_KINDS = (TRANSIENT, THROTTLED, AUTH)
+
+_LATENCY_WINDOW = 200
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, Exception) and classify_failure(error) in RETRYABLE_KINDS
+
+
+def _log_retry(state: RetryCallState):
+    error = state.outcome.exception()
+    UPSTREAM_RETRIES.labels(classify_failure(error)).inc()
+    logger.warning(f"Upstream attempt {state.attempt_number} failed ({type(error).__name__}: {error}), "
+                   f"retrying in {state.next_action.sleep:.2f}s.")
+
+
+def retrying(can_retry=is_retryable) -> AsyncRetrying:
+    """
+    返回一个 tenacity 的 AsyncRetrying，用法为 `async for attempt in retrying(): with attempt: ...`。
+    can_retry 决定某个异常能否重试；流式请求用它额外检查是否已经向客户端输出过内容。
+    """
+    return AsyncRetrying(
+        retry=retry_if_exception(can_retry),
+        stop=stop_after_attempt(max(1, RETRY_ATTEMPTS)) | stop_before_delay(RETRY_DEADLINE_SECONDS),
+        wait=wait_random_exponential(multiplier=RETRY_BACKOFF_BASE_SECONDS, max=RETRY_BACKOFF_MAX_SECONDS),
+        before_sleep=_log_retry,
+        reraise=True,
+    )
+
+
+class LatencyTracker:
+    """最近 _LATENCY_WINDOW 次成功的非流式上游调用的耗时，用来决定何时发出对冲请求。"""
+
+    def __init__(self, window: int = _LATENCY_WINDOW):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float | None:
+        """未开启对冲或样本不足时返回 None。"""
+        if not HEDGE_ENABLED or len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_SECONDS, self.percentile(0.95))
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {"samples": len(self._samples), "p50_seconds": round(p50, 3) if p50 is not None else None,
+                "p95_seconds": round(p95, 3) if p95 is not None else None, "hedge_delay_seconds": self.hedge_delay()}
+
+
+upstream_latency = LatencyTracker()
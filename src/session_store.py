@@ -0,0 +1,81 @@
+# --- session_store.py (有状态会话缓存) ---
+
+from cachetools import TTLCache
+
+from .config import SESSION_TTL_SECONDS, SESSION_MAX_ENTRIES, PREFIX_INDEX_MAX_ENTRIES
+from .shared_store import shared_store
+
+
+class SessionState:
+    """
+    一轮对话结束后保存下来的 Gemini 会话状态。
+    metadata 即 ChatSession 的 [cid, rid, rcid]，只在创建它的那个账号上有效。
+    """
+    __slots__ = ("account", "metadata", "model")
+
+    def __init__(self, account: str, metadata: list[str | None], model: str | None = None):
+        self.account = account
+        self.metadata = list(metadata)
+        self.model = model
+
+    def as_dict(self) -> dict:
+        return {"account": self.account, "metadata": self.metadata, "model": self.model}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionState":
+        return cls(data["account"], data["metadata"], data.get("model"))
+
+    def __repr__(self):
+        return f"SessionState(account='{self.account}', metadata={self.metadata})"
+
+
+class SessionStore:
+    """
+    session_id -> SessionState 的有界缓存。
+    超过 TTL 的条目自动过期，容量满时淘汰最久未使用的条目；过期后调用方应退回到完整的历史压平。
+    启用了共享存储（多 worker 部署）时条目保存在 shared_store 的 namespace 下，所有 worker 看到同一份会话。
+    """
+
+    def __init__(self, namespace: str, maxsize: int = SESSION_MAX_ENTRIES, ttl: float = SESSION_TTL_SECONDS):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache: TTLCache[str, SessionState] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, session_id: str | None) -> SessionState | None:
+        if not session_id:
+            return None
+        if shared_store.enabled:
+            data = await shared_store.get(self.namespace, session_id)
+            state = SessionState.from_dict(data) if data else None
+        else:
+            state = self._cache.get(session_id)
+        if state is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return state
+
+    async def save(self, session_id: str, state: SessionState):
+        # 重新赋值会刷新 TTL，活跃的会话因此不会过期
+        if shared_store.enabled:
+            await shared_store.set(self.namespace, session_id, state.as_dict(), ttl=self.ttl, max_entries=self.maxsize)
+        else:
+            self._cache[session_id] = state
+
+    async def discard(self, session_id: str):
+        if shared_store.enabled:
+            await shared_store.delete(self.namespace, session_id)
+        else:
+            self._cache.pop(session_id, None)
+
+    def stats(self) -> dict:
+        size = shared_store.count(self.namespace) if shared_store.enabled else len(self._cache)
+        return {"size": size, "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+ACTIVE_SESSIONS = SessionStore("sessions")
+# 按“消息历史前缀哈希”索引的会话状态，供不发送 session_id 的标准 OpenAI 客户端自动续接
+CONVERSATION_PREFIXES = SessionStore("conversation_prefixes", maxsize=PREFIX_INDEX_MAX_ENTRIES)
@@ -0,0 +1,225 @@
+# --- shared_store.py (多 worker 共享状态) ---
+# 多个 uvicorn worker 各自是独立的进程，模块级的缓存互相看不到：会话续接、前缀索引、上传缓存、
+# 图片短链接和限速状态都会因为请求落到另一个 worker 而失效。配置了 SHARED_STORE_PATH 时，
+# 这些状态改存到同一台机器上的一个 WAL 模式 SQLite 文件里，所有 worker 读写同一份数据。
+# SQLite 调用是阻塞的，等锁时更可能阻塞上百毫秒，因此全部交给一个专用线程按顺序执行，事件循环只 await 结果；
+# 等锁超过 SHARED_STORE_BUSY_TIMEOUT_MS 即放弃，按“未命中/放行”降级。
+# 另外提供带过期时间的租约，用来保证同一时刻只有一个 worker 执行查找/创建 Gem、续期 Cookie 这类操作。
+# 未配置时 enabled 为 False，各模块继续使用进程内的缓存。
+
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson as json
+from gemini_webapi.utils import logger
+
+from .config import SHARED_STORE_BUSY_TIMEOUT_MS, SHARED_STORE_PATH
+
+# 每个进程每写入这么多次，清理一次过期条目并按容量淘汰最久未更新的条目
+_PURGE_EVERY_WRITES = 256
+
+
+def _is_busy(error: sqlite3.Error) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+class SharedStore:
+    """
+    (namespace, key) -> JSON 值，可带 TTL；外加租约与令牌桶这两种需要原子读改写的操作。
+    SQLite 出错时记录日志并按“未命中/放行”降级，不影响请求本身。
+    公开方法都是协程；连接只在专用线程中使用，同一进程内的操作天然串行，无需再加锁。
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.owner = f"{os.getpid()}"
+        self._db: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._writes = 0
+        self._max_entries: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _thread(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread(), fn, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 会话状态与图片短链接里带有账号 Cookie，文件只允许当前用户读写
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+            # isolation_level=None：默认自动提交，需要原子读改写时显式 BEGIN IMMEDIATE
+            db = sqlite3.connect(self.path, timeout=SHARED_STORE_BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                 check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires REAL, updated REAL NOT NULL,"
+                "PRIMARY KEY (namespace, key));"
+                "CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated);"
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);"
+            )
+            self._db = db
+        return self._db
+
+    async def get(self, namespace: str, key: str):
+        try:
+            row = await self._run(self._get, namespace, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared store read failed ({namespace}): {e}")
+            return None
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _get(self, namespace: str, key: str):
+        return self._connect().execute("SELECT value, expires FROM entries WHERE namespace = ? AND key = ?",
+                                       (namespace, key)).fetchone()
+
+    async def set(self, namespace: str, key: str, value, ttl: float | None = None, max_entries: int = 0):
+        """写入一个值。max_entries > 0 时该命名空间超出容量的部分按最久未更新淘汰（定期执行）。"""
+        if max_entries:
+            self._max_entries[namespace] = max_entries
+        try:
+            await self._run(self._set, namespace, key, json.dumps(value), ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared store write failed ({namespace}): {e}")
+
+    def _set(self, namespace: str, key: str, value: bytes, ttl: float | None):
+        now = time.time()
+        db = self._connect()
+        db.execute("INSERT OR REPLACE INTO entries (namespace, key, value, expires, updated) "
+                   "VALUES (?, ?, ?, ?, ?)", (namespace, key, value, now + ttl if ttl else None, now))
+        self._writes += 1
+        if self._writes % _PURGE_EVERY_WRITES == 0:
+            self._purge(db, now)
+
+    def _purge(self, db: sqlite3.Connection, now: float):
+        db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+        for namespace, max_entries in self._max_entries.items():
+            db.execute("DELETE FROM entries WHERE namespace = ? AND key IN (SELECT key FROM entries WHERE namespace = ? "
+                       "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (namespace, namespace, max_entries))
+
+    async def delete(self, namespace: str, key: str):
+        try:
+            await self._run(self._delete, namespace, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared store delete failed ({namespace}): {e}")
+
+    def _delete(self, namespace: str, key: str):
+        self._connect().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def count(self, namespace: str) -> int:
+        """
+        命名空间里未过期的条目数。同步方法，供 /metrics 抓取使用：该接口本身运行在线程池中，
+        这里把查询交给专用线程并等待结果，不能在事件循环里调用。
+        """
+        try:
+            return self._thread().submit(self._count, namespace).result()
+        except sqlite3.Error:
+            return 0
+
+    def _count(self, namespace: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM entries WHERE namespace = ? AND (expires IS NULL OR expires >= ?)",
+            (namespace, time.time())).fetchone()[0]
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        """所有 worker 共享的令牌桶，语义同 tenants.TokenBucket.take()：成功返回 0，否则返回还需等待的秒数。"""
+        try:
+            return await self._run(self._take_token, key, rate, burst)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared rate limit check failed, allowing request: {e}")
+            return 0.0
+
+    def _take_token(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT value FROM entries WHERE namespace = 'token_buckets' AND key = ?",
+                             (key,)).fetchone()
+            tokens, updated = json.loads(row[0]) if row else (float(burst), now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            db.execute("INSERT OR REPLACE INTO entries (namespace, key, value, expires, updated) "
+                       "VALUES ('token_buckets', ?, ?, NULL, ?)", (key, json.dumps([tokens, now]), now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def acquire_lease(self, name: str, ttl: float) -> bool:
+        """
+        取得名为 name 的租约（已过期或本进程持有时可以取得），有效期 ttl 秒。
+        未启用共享存储时只有一个进程，总是返回 True。数据库正被其他 worker 锁住时按“租约被占用”返回 False，
+        调用方稍后重试即可；其他 SQLite 错误则放行。
+        """
+        if not self.enabled:
+            return True
+        try:
+            return await self._run(self._acquire_lease, name, ttl)
+        except sqlite3.Error as e:
+            if _is_busy(e):
+                return False
+            logger.warning(f"Shared lease '{name}' unavailable, proceeding without coordination: {e}")
+            return True
+
+    def _acquire_lease(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            acquired = row is None or row[1] < now or row[0] == self.owner
+            if acquired:
+                db.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                           (name, self.owner, now + ttl))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return acquired
+
+    async def release_lease(self, name: str):
+        if not self.enabled:
+            return
+        try:
+            await self._run(self._release_lease, name)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release shared lease '{name}': {e}")
+
+    def _release_lease(self, name: str):
+        self._connect().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.submit(self._close).result()
+            self._executor.shutdown()
+            self._executor = None
+
+
+shared_store = SharedStore(SHARED_STORE_PATH)
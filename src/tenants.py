@@ -0,0 +1,80 @@
+# --- tenants.py (按 API Key 区分的租户) ---
+# 每个 API Key 是一个租户：拥有自己的调度权重、令牌桶限速与并发上限，用量和延迟分别统计。
+
+import hmac
+import time
+
+from .config import API_KEYS
+from .shared_store import shared_store
+
+
+class TokenBucket:
+    """
+    经典令牌桶：按 rate（每秒）持续补充，最多积攒 burst 个。
+    启用了共享存储（多 worker 部署）时桶的状态保存在 shared_store 中，限速对所有 worker 合计生效。
+    """
+    __slots__ = ("name", "rate", "burst", "tokens", "updated")
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def take(self) -> float:
+        """取一个令牌。成功返回 0，否则返回还需等待的秒数（不扣减）。"""
+        if shared_store.enabled:
+            return await shared_store.take_token(self.name, self.rate, self.burst)
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Tenant:
+    """
+    一个 API Key 对应的租户。key 只用于鉴权，对外（指标、日志、用量报告）一律使用 name。
+    """
+    __slots__ = ("name", "key", "weight", "max_concurrency", "bucket", "requests", "rejected", "completed",
+                 "total_latency", "total_queue_wait")
+
+    def __init__(self, name: str, key: str | None = None, weight: float = 1.0, rpm: float = 0, burst: int = 1,
+                 max_concurrency: int = 0):
+        self.name = name
+        self.key = key
+        self.weight = weight if weight > 0 else 1.0
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(name, rpm / 60, burst) if rpm > 0 else None
+        self.requests = 0
+        self.rejected = 0
+        self.completed = 0
+        self.total_latency = 0.0  # 排队 + 占用名额的总时长（秒）
+        self.total_queue_wait = 0.0
+
+    def stats(self) -> dict:
+        return {"name": self.name, "weight": self.weight, "max_concurrency": self.max_concurrency,
+                "rpm": self.bucket.rate * 60 if self.bucket else 0, "requests": self.requests,
+                "rejected": self.rejected, "completed": self.completed,
+                "avg_latency_seconds": round(self.total_latency / self.completed, 3) if self.completed else 0.0,
+                "avg_queue_wait_seconds": round(self.total_queue_wait / self.completed, 3) if self.completed else 0.0}
+
+    def __repr__(self):
+        return f"Tenant(name='{self.name}', weight={self.weight})"
+
+
+TENANTS = [Tenant(**options) for options in API_KEYS]
+# 未配置任何 API Key 时不做鉴权，所有请求归入同一个匿名租户
+ANONYMOUS_TENANT = Tenant("anonymous")
+
+
+def find_tenant(key: str) -> Tenant | None:
+    """按 API Key 查找租户；逐个做常数时间比较，避免通过响应时间猜测 Key。"""
+    match = None
+    for tenant in TENANTS:
+        if hmac.compare_digest(tenant.key.encode(), key.encode()):
+            match = tenant
+    return match
@@ -0,0 +1,117 @@
+# --- upload_cache.py (按内容寻址的上传缓存) ---
+
+import asyncio
+from pathlib import Path
+
+import httpx
+from cachetools import TTLCache
+from gemini_webapi.constants import Endpoint, Headers
+
+from .config import UPLOAD_CACHE_TTL_SECONDS, UPLOAD_CACHE_MAX_ENTRIES, UPLOAD_CONCURRENCY
+from .attachments import Attachment, as_attachment
+from .backend_override import upstream_client_kwargs
+from .metrics import record_upstream_status, stage_timer
+from .shared_store import shared_store
+
+
+class UploadCache:
+    """
+    SHA-256(文件内容) -> 上传 ID 的缓存。
+    对话里反复出现的同一张图片只会真正上传一次；同一内容的并发上传也只发一次请求。
+    上传 ID 与账号无关，因此所有账号共享同一个缓存；多 worker 部署时还通过 shared_store 在 worker 之间共享。
+    """
+
+    def __init__(self, maxsize: int = UPLOAD_CACHE_MAX_ENTRIES, ttl: float = UPLOAD_CACHE_TTL_SECONDS,
+                 concurrency: int = UPLOAD_CONCURRENCY):
+        self._cache: TTLCache[str, str] = TTLCache(maxsize=maxsize, ttl=ttl)
+        # 只限制真正发往 Google 的上传，缓存命中不占用名额
+        self._upload_slots = asyncio.Semaphore(max(1, concurrency))
+        self._pending: dict[str, asyncio.Task] = {}
+        self._http_clients: dict[str | None, httpx.AsyncClient] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _http_client(self, proxy: str | None) -> httpx.AsyncClient:
+        client = self._http_clients.get(proxy)
+        if client is None:
+            client = httpx.AsyncClient(http2=True, proxy=proxy, follow_redirects=True, **upstream_client_kwargs())
+            self._http_clients[proxy] = client
+        return client
+
+    async def _upload_bytes(self, data: bytes | memoryview, proxy: str | None) -> str:
+        """与 gemini_webapi.utils.upload_file 相同的上传请求，但直接发送内存中的字节，并复用连接。"""
+        with stage_timer("upload"):
+            response = await self._http_client(proxy).post(
+                url=Endpoint.UPLOAD.value,
+                headers=Headers.UPLOAD.value,
+                files={"file": bytes(data)},
+            )
+        record_upstream_status("upload", response.status_code)
+        response.raise_for_status()
+        return response.text
+
+    async def upload(self, file: Attachment | str | Path, proxy: str | None = None) -> str:
+        attachment = as_attachment(file)
+        digest = attachment.sha256
+
+        upload_id = self._cache.get(digest)
+        if upload_id is None and shared_store.enabled:
+            # 其他 worker 上传过的内容；不复制到本地缓存，以免在本地重新计算 TTL
+            upload_id = await shared_store.get("uploads", digest)
+        if upload_id is not None:
+            self.hits += 1
+            return upload_id
+
+        task = self._pending.get(digest)
+        if task is None:
+            self.misses += 1
+            # 上传放在不属于任何请求的任务里：发起上传的请求被取消（客户端断开）时，
+            # 等待同一内容的其他请求照常拿到结果，而不是收到 CancelledError。
+            # 字节在这里就读出来交给任务：请求被取消后附件会被 cleanup()，任务不能再去读它
+            task = asyncio.create_task(self._upload_and_cache(attachment.read(), digest, proxy))
+            self._pending[digest] = task
+            task.add_done_callback(lambda done: self._finish_pending(digest, done))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _upload_and_cache(self, data: bytes | memoryview, digest: str, proxy: str | None) -> str:
+        async with self._upload_slots:
+            upload_id = await self._upload_bytes(data, proxy)
+        self._cache[digest] = upload_id
+        if shared_store.enabled:
+            await shared_store.set("uploads", digest, upload_id, ttl=self._cache.ttl, max_entries=self._cache.maxsize)
+        return upload_id
+
+    def _finish_pending(self, digest: str, task: asyncio.Task):
+        if self._pending.get(digest) is task:
+            del self._pending[digest]
+        # 所有等待者都已取消时避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def start_uploads(self, files: list[Attachment | str | Path], proxy: str | None = None) -> asyncio.Future:
+        """
+        立即并发启动所有附件的上传（受并发上限约束），返回一个按原顺序给出上传 ID 列表的 Future。
+        调用方可以先去构造请求的其余部分，最后再 await，让上传与其他工作重叠。
+        """
+        return asyncio.gather(*(self.upload(file, proxy) for file in files))
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def close(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        for client in self._http_clients.values():
+            await client.aclose()
+        self._http_clients.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "maxsize": self._cache.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 3)}
+
+
+upload_cache = UploadCache()